@@ -0,0 +1,226 @@
+"""
+Measure the speed of the engine on the scenarios of scenarios.py, and save
+the results as JSON to compare versions.
+
+    python benchmarks/run.py --out results.json
+    python benchmarks/run.py --compare results.json
+
+For each scenario, rounds are simulated frame by frame and each phase of
+Engine.step is timed, along with serialize_state. We report:
+    - steps_per_sec: frames simulated per second by Engine.step
+    - mapgraph_per_sec, damage_per_sec, serialize_per_sec: calls per second
+        of MapGraph.__call__, DamageEngine.__call__ and serialize_state
+    - rounds_per_sec: rounds per second with Engine.simulate_round
+    - peak_memory_kb: peak memory while simulating a round and logging all
+        its frames
+    - batch_steps_per_sec: with --batch N, frames simulated per second by a
+        BatchEngine stepping N games at once (the boards of the seeds seed
+        to seed + N - 1, the games that are over are not counted), to
+        compare with steps_per_sec
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO) # benchmark the sources, even if tc1 is installed
+
+import numpy as np
+from tc1.batch import BatchEngine
+from tc1.engine import Engine
+from scenarios import SCENARIOS
+
+# Metrics for which a lower value is better, the others are rates
+LOWER_IS_BETTER = {'peak_memory_kb'}
+
+
+def _new_engine(scenario, seed):
+    engine = Engine()
+    engine.game_state = SCENARIOS[scenario](seed)
+    return engine
+
+
+def _is_over(state):
+    return not any(u.id < 4 for u in state.s_units + state.a_units)
+
+
+def time_phases(scenario, seed, max_frames, min_time):
+    """
+    Simulate rounds frame by frame until min_time seconds have been spent
+    in the engine, timing each phase. Return the rates of each phase.
+    """
+    totals = {'mapgraph': 0., 'damage': 0., 'remove': 0., 'serialize': 0.}
+    n_frames = 0
+    clock = time.perf_counter
+    while sum(totals.values()) < min_time:
+        engine = _new_engine(scenario, seed)
+        state = engine.game_state
+        for _ in range(max_frames):
+            if _is_over(state):
+                break
+            t0 = clock()
+            events = engine.map_graph(state)
+            t1 = clock()
+            engine.damage_engine(state, events)
+            t2 = clock()
+            state.remove_dead_units()
+            t3 = clock()
+            state.serialize_state()
+            t4 = clock()
+            totals['mapgraph'] += t1 - t0
+            totals['damage'] += t2 - t1
+            totals['remove'] += t3 - t2
+            totals['serialize'] += t4 - t3
+            n_frames += 1
+    step_time = totals['mapgraph'] + totals['damage'] + totals['remove']
+    return {'frames_per_round': n_frames, # overwritten below, see run_scenario
+            'steps_per_sec': n_frames / step_time,
+            'mapgraph_per_sec': n_frames / totals['mapgraph'],
+            'damage_per_sec': n_frames / totals['damage'],
+            'serialize_per_sec': n_frames / totals['serialize']}
+
+
+def time_rounds(scenario, seed, max_frames, min_time):
+    """Return the number of rounds simulated per second, and the frames of a round"""
+    n_rounds = 0
+    spent = 0.
+    while spent < min_time:
+        engine = _new_engine(scenario, seed)
+        t0 = time.perf_counter()
+        _, result = engine.simulate_round(max_frames)
+        spent += time.perf_counter() - t0
+        n_rounds += 1
+    return n_rounds / spent, result.n_frames
+
+
+def time_batch(scenario, seed, n_games, max_frames, min_time):
+    """
+    Return the number of frames simulated per second, over all the games,
+    by a BatchEngine running n_games games. As in time_phases, only the
+    frames of the games that are not over are counted.
+    """
+    n_frames = 0
+    spent = 0.
+    clock = time.perf_counter
+    while spent < min_time:
+        batch = BatchEngine([SCENARIOS[scenario](seed + i) for i in range(n_games)])
+        for _ in range(max_frames):
+            n_active = int(((batch.uid > 0) & (batch.uid < 4)).any(axis=(1, 2)).sum())
+            if not n_active:
+                break
+            t0 = clock()
+            batch.step()
+            spent += clock() - t0
+            n_frames += n_active
+            if spent > min_time:
+                break
+    return n_frames / spent
+
+
+def peak_memory(scenario, seed, max_frames):
+    """Peak memory in KB while simulating a round and logging its frames"""
+    engine = _new_engine(scenario, seed)
+    tracemalloc.start()
+    logs = []
+    for _ in range(max_frames):
+        if _is_over(engine.game_state):
+            break
+        engine.step()
+        logs.append(engine.game_state.serialize_state())
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak / 1e3
+
+
+def run_scenario(scenario, seed, max_frames, min_time, n_games=0):
+    results = time_phases(scenario, seed, max_frames, min_time)
+    results['rounds_per_sec'], results['frames_per_round'] = time_rounds(
+            scenario, seed, max_frames, min_time)
+    results['peak_memory_kb'] = peak_memory(scenario, seed, max_frames)
+    if n_games:
+        results['batch_steps_per_sec'] = time_batch(scenario, seed, n_games, max_frames, min_time)
+    return results
+
+
+def metadata():
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=REPO,
+                stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'commit': commit,
+            'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.machine()}
+
+
+def compare(new, old, tolerance):
+    """
+    Print the ratio between the new and old results, and return the list of
+    the metrics that are worse by more than tolerance
+    """
+    regressions = []
+    for scenario, metrics in new['results'].items():
+        if scenario not in old['results']:
+            continue
+        for metric, value in metrics.items():
+            previous = old['results'][scenario].get(metric)
+            if not previous or metric == 'frames_per_round':
+                continue
+            ratio = value / previous
+            worse = ratio > 1 + tolerance if metric in LOWER_IS_BETTER else ratio < 1 / (1 + tolerance)
+            print('{:10} {:18} {:12.1f} -> {:12.1f}  x{:.2f}{}'.format(scenario, metric,
+                previous, value, ratio, '  REGRESSION' if worse else ''))
+            if worse:
+                regressions.append((scenario, metric))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', nargs='+', default=sorted(SCENARIOS),
+            choices=sorted(SCENARIOS))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--max-frames', type=int, default=300)
+    parser.add_argument('--min-time', type=float, default=0.5,
+            help='minimum time spent on each measure, in seconds')
+    parser.add_argument('--batch', type=int, default=0, metavar='N',
+            help='also measure a BatchEngine running N games')
+    parser.add_argument('--out', help='save the results to this JSON file')
+    parser.add_argument('--compare', help='JSON file of previous results')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+            help='relative slowdown reported as a regression')
+    args = parser.parse_args(argv)
+
+    results = {'meta': metadata(), 'results': {}}
+    for scenario in args.scenarios:
+        res = run_scenario(scenario, args.seed, args.max_frames, args.min_time, args.batch)
+        results['results'][scenario] = res
+        print('{:10} {:8.0f} steps/s {:8.1f} rounds/s {:8.0f} serialize/s {:8.0f} KB peak'.format(
+            scenario, res['steps_per_sec'], res['rounds_per_sec'],
+            res['serialize_per_sec'], res['peak_memory_kb']))
+        if args.batch:
+            print('{:10} {:8.0f} batch steps/s with {} games, x{:.1f}'.format(scenario,
+                res['batch_steps_per_sec'], args.batch,
+                res['batch_steps_per_sec'] / res['steps_per_sec']))
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            old = json.load(f)
+        if compare(results, old, args.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
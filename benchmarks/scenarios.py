@@ -0,0 +1,120 @@
+"""
+Reproducible boards for the benchmarks. Each scenario is a function of a
+seed returning a new GameState, the same seed always giving the same board.
+"""
+import random
+from tc1.bfs import INTMAX
+from tc1.mapgraph import MapGraph
+from tc1.state import GameState
+
+
+def _in_map(x, y):
+    return abs(x - 14.5) + abs(y - 14.5) <= 14
+
+
+def _mirror(pos):
+    """Position of the ennemy unit mirroring a friendly unit"""
+    return (29 - pos[0], 29 - pos[1])
+
+
+def _deploy_info(state, rng, team, names, n_stacks, stack_size):
+    """Deploy stacks of information units on random cells of a team border"""
+    borders = state.FRIENDLY_BORDERS if team == 's' else state.ENNEMY_BORDERS
+    # the cells of the border with a defensive unit can't be used
+    legal = state.legal_placements(team, names[0])
+    borders = [pos for pos in borders if legal[pos]]
+    for _ in range(n_stacks):
+        pos = rng.choice(borders)
+        for _ in range(stack_size):
+            state.add_unit(team, rng.choice(names), pos)
+
+
+def empty_board(seed):
+    """No defense at all, a few information units on both sides"""
+    rng = random.Random(seed)
+    state = GameState()
+    _deploy_info(state, rng, 's', ['ping', 'emp', 'scrambler'], 5, 2)
+    _deploy_info(state, rng, 'a', ['ping', 'emp', 'scrambler'], 5, 2)
+    return state
+
+
+def filter_wall(seed):
+    """The wall of 19 filters of main.py, attacked by a ping, an emp and a ping"""
+    state = GameState()
+    for p in range(19):
+        state.add_unit('a', 'filter', (p+1, 15))
+    state.add_unit('s', 'ping', (10,5))
+    state.add_unit('s', 'emp', (10,5))
+    state.add_unit('s', 'ping', (17,3))
+    return state
+
+
+def maze(seed):
+    """
+    Walls of filters with a single random gap on each side, so the units
+    must zigzag, and a closed wall on the first row of the ennemy side
+    (which holds the two lowest cells of the ennemy borders), so that the
+    border can't be reached and units have to self-destruct (until their
+    blasts open the wall)
+    """
+    rng = random.Random(seed)
+    state = GameState()
+    for y in [4, 7, 10, 13]:
+        xs = [x for x in range(30) if _in_map(x, y)]
+        gap = rng.choice(xs[1:-1])
+        for x in xs:
+            if x != gap:
+                state.add_unit('s', 'filter', (x, y))
+    for x in range(30):
+        if _in_map(x, 15):
+            state.add_unit('a', 'filter', (x, 15))
+    _deploy_info(state, rng, 's', ['ping', 'scrambler'], 4, 3)
+    # the point of the scenario is MapGraph.find_deepest_position: check
+    # that no unit can reach its border
+    map_graph = MapGraph()
+    map_graph.update_state(state)
+    map_graph.update_distance_maps()
+    assert all(map_graph.distance_maps[u.target][u.pos] == INTMAX for u in state.s_units if u.id < 4)
+    return state
+
+
+def ping_swarm(seed):
+    """50 pings on the same cell, against a few destructors"""
+    rng = random.Random(seed)
+    state = GameState()
+    destructors = set()
+    while len(destructors) < 6: # on distinct cells
+        x = rng.randint(8, 21)
+        pos = (x, rng.randint(16, 20))
+        if pos not in destructors:
+            destructors.add(pos)
+            state.add_unit('a', 'destructor', pos)
+    pos = rng.choice(state.FRIENDLY_BORDERS)
+    for _ in range(50):
+        state.add_unit('s', 'ping', pos)
+    return state
+
+
+def late_game(seed):
+    """
+    Dense defenses on both sides (filters, encryptors, destructors) and
+    stacks of all the information units from both teams
+    """
+    rng = random.Random(seed)
+    state = GameState()
+    cells = [(x, y) for x in range(30) for y in range(8, 15) if _in_map(x, y)]
+    for pos in rng.sample(cells, 45):
+        name = rng.choice(['filter', 'filter', 'encryptor', 'destructor'])
+        state.add_unit('s', name, pos)
+        state.add_unit('a', name, _mirror(pos))
+    _deploy_info(state, rng, 's', ['ping', 'emp', 'scrambler'], 6, 4)
+    _deploy_info(state, rng, 'a', ['ping', 'emp', 'scrambler'], 6, 4)
+    return state
+
+
+SCENARIOS = {
+        'empty': empty_board,
+        'wall': filter_wall,
+        'maze': maze,
+        'swarm': ping_swarm,
+        'late_game': late_game}
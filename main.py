@@ -2,8 +2,7 @@ from tc1.engine import Engine
 
 myengine = Engine()
 
-for p in range(19):
-    myengine.game_state.add_unit('a', 'filter', (p+1, 15))
+myengine.game_state.add_units('a', ['filter'] * 19, [(p+1, 15) for p in range(19)])
 
 myengine.game_state.add_unit('s', 'ping', (10,5))
 myengine.game_state.add_unit('s', 'emp', (10,5))
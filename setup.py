@@ -9,6 +9,7 @@ setup(name='TC1',
       packages = find_packages(exclude=['*.tests*']),
       license='MIT',
       install_requires=['numpy'],
+      extras_require={'display': ['matplotlib']},
       classifiers=[
           'Development Status :: 1 - Planning',
           'Intended Audience :: Developers',
@@ -0,0 +1,670 @@
+import numpy as np
+from .bfs import (INTMAX, OUTSIDE, PADDED_GRID_SIZE, batch_border_distance_maps,
+        batch_repair_distance_maps, batch_self_destruct_maps, pack_rows)
+from .damage import BLAST_OFFSETS, ENTER_OFFSETS, SHIELD, SHIELD_OFFSETS, neighbourhood_sum
+from .geometry import GEOMETRY
+from .mapgraph import DEEPEST_DIRECTIONS, SELF_DESTRUCT_MIN_MOVES, MapGraph
+from .observation import DIST, N_TURNS_STATIC, N_UNIT_TYPES, OBSERVATION_SHAPE, STABILITY
+from .state import GameState
+from .unit import MOVES, Unit
+from .unit_desc import UNITS_BY_ID
+
+# Stats tables indexed by unit id, the id 0 being used for empty slots
+SPEED = np.array([0] + [d['speed'] for d in UNITS_BY_ID[1:]])
+RANGE = np.array([0] + [d['range'] for d in UNITS_BY_ID[1:]])
+DPF = np.array([0] + [d['dpf'] for d in UNITS_BY_ID[1:]])
+INITIAL_STABILITY = np.array([0] + [d['stability'] for d in UNITS_BY_ID[1:]])
+# The ranges are half-integers: the nodes within range of a unit are the
+# nodes at a distance of at most its radius. The attackers are first
+# checked against the ennemies grown by each of the radii, see _damage
+RADIUS = np.ceil(RANGE).astype(int) - 1
+RADII = sorted(set(RADIUS[DPF > 0].tolist()))
+RADIUS_INDEX = np.array([RADII.index(r) if r in RADII else 0 for r in RADIUS])
+
+# The previous moves are stored as their index in MOVES
+DX = np.array([m[0] if m else 0 for m in MOVES])
+DY = np.array([m[1] if m else 0 for m in MOVES])
+# Offsets of the flat index (x * 30 + y) of the neighbours, in the order of
+# MOVES, and the neighbours prefered after each previous move, as in the
+# cases 1 and 2 of MapGraph._compute_move (vertical moves for the units
+# that haven't moved yet, then the moves orthogonal to the previous one)
+NEIGHBOURS = DX[1:] * PADDED_GRID_SIZE + DY[1:]
+PREFERED = np.array([DX[1:] == 0] + [np.abs(DX[1:]) != abs(DX[m]) for m in range(1, len(MOVES))])
+# Index of the move in MOVES that is prefered for each target in the case 3
+# of MapGraph._compute_move (first the vertical one, then the horizontal one)
+PREFERED_MOVES = {2:(3,1), 3:(3,2), 4:(4,2), 5:(4,1)}
+FIRST_MOVE = np.array([PREFERED_MOVES.get(i, (0,0))[0] for i in range(6)])
+SECOND_MOVE = np.array([PREFERED_MOVES.get(i, (0,0))[1] for i in range(6)])
+# The prefered directions of the deepest position, by target - 2
+DEEPEST = np.array([DEEPEST_DIRECTIONS[i] for i in [2,3,4,5]])
+
+# Offsets of the encryptors whose range is entered with each move (see
+# damage.ENTER_OFFSETS, they all have the same length), and of the
+# encryptors covering a node, as flat offsets in the grids of the
+# encryptors. These grids are padded with SHIELD_PAD nodes on each side, so
+# that all the offsets can be read without checking the bounds
+SHIELD_PAD = max(abs(dx) for dx, _ in SHIELD_OFFSETS)
+SHIELD_GRID_SIZE = PADDED_GRID_SIZE + 2 * SHIELD_PAD
+ENTER = np.array([[dx * SHIELD_GRID_SIZE + dy for dx, dy in offsets] or [0] * len(ENTER_OFFSETS[1])
+    for offsets in ENTER_OFFSETS])
+COVER = np.array([dx * SHIELD_GRID_SIZE + dy for dx, dy in SHIELD_OFFSETS])
+
+# The fields of a unit, stored as (n_games, 2, n_slots) arrays. The axis 1
+# is the team (0 for 's', 1 for 'a'). The encryptors that shielded a unit
+# (see Unit.shielded_by) are stored as a mask of their index in the team,
+# given once for all by _encryptor_index
+FIELDS = ['uid', 'x', 'y', 'stability', 'target', 'n_turns_static', 'previous_move',
+        'n_moves', 'shielded_by']
+TEAMS = ['s', 'a']
+GRID_NODES = PADDED_GRID_SIZE ** 2
+NO_TARGET = np.iinfo(np.int64).max
+# Above this number of pairs of attacking groups and ennemy slots, the
+# groups out of range of all the ennemies are skipped first, see _damage
+DENSE_PAIRS = 1 << 20
+# The distance maps of the games whose defensive units were destroyed are
+# computed again for each layout, instead of being repaired, when at least
+# this number of games share each layout (as the forks of a game do)
+REBUILD_SHARING = 4
+# Random odd multipliers hashing the packed rows of a layout, see _unique_layouts
+_LAYOUT_HASH = np.random.default_rng(0).integers(1 << 62, size=PADDED_GRID_SIZE, dtype=np.uint64) * 2 + 1
+
+
+def _popcount(masks):
+    """Number of bits set in each value of an int64 array"""
+    v = masks.view(np.uint64)
+    v = v - ((v >> np.uint64(1)) & np.uint64(0x5555555555555555))
+    v = (v & np.uint64(0x3333333333333333)) + ((v >> np.uint64(2)) & np.uint64(0x3333333333333333))
+    v = (v + (v >> np.uint64(4))) & np.uint64(0x0F0F0F0F0F0F0F0F)
+    return ((v * np.uint64(0x0101010101010101)) >> np.uint64(56)).astype(np.int64)
+
+
+def _unique_layouts(blocked):
+    """
+    Return the index of the first grid with each layout, and the index of
+    the layout of each grid, as np.unique(..., return_index=True,
+    return_inverse=True) would for the grids of blocked nodes, an array of
+    shape (n, 30, 30). The layouts are compared by a hash of their packed
+    rows, and checked against the rows of their first grid.
+    """
+    rows = pack_rows(blocked)
+    hashes = (rows.astype(np.uint64) * _LAYOUT_HASH).sum(1)
+    _, first, inverse = np.unique(hashes, return_index=True, return_inverse=True)
+    if not (rows[first][inverse] == rows).all():
+        # a collision of the hashes
+        _, first, inverse = np.unique(rows, axis=0, return_index=True, return_inverse=True)
+    return first, inverse.ravel()
+
+
+def _grow_rows(rows, radius):
+    """
+    Return the nodes at a distance of at most radius of the nodes set in
+    rows, an array of packed rows of shape (..., 30) (see bfs.pack_rows)
+    """
+    # the nodes of a row within distance w, for each w
+    spread = [rows]
+    for w in range(1, radius + 1):
+        spread.append(spread[-1] | (rows << w) | (rows >> w))
+    out = spread[radius].copy()
+    for dx in range(1, radius + 1):
+        out[..., dx:] |= spread[radius - dx][..., :-dx]
+        out[..., :-dx] |= spread[radius - dx][..., dx:]
+    return out
+
+
+class BatchEngine:
+    def __init__(self, states):
+        """
+        Run many independent games at once. The units of all the games are
+        stored as struct-of-arrays, and each step advances all the games with
+        array operations. The result of a step is the same as calling
+        Engine.step on each state separately.
+        Arguments:
+            - states: list of GameState, they are not modified by the engine
+        """
+        self.n_games = len(states)
+        self.health = np.array([[s.s_health, s.a_health] for s in states])
+        self.core = np.array([[s.s_core, s.a_core] for s in states])
+        self.bits = np.array([[s.s_bits, s.a_bits] for s in states])
+        self.turn = np.array([s.turn for s in states])
+        self._testmode = [s.testmode for s in states]
+
+        n_slots = max([max(len(s.s_units), len(s.a_units)) for s in states] + [1])
+        shape = (self.n_games, 2, n_slots)
+        for f in FIELDS:
+            setattr(self, f, np.zeros(shape, dtype=np.int64))
+        # The encryptors of each team are given an index, from 0 to 63, in
+        # their order in the team: the index of the encryptor on each node
+        # (-1 without encryptor), and the nodes of the encryptors by index
+        self._encryptor_index = np.full((self.n_games, 2, PADDED_GRID_SIZE, PADDED_GRID_SIZE), -1,
+                dtype=np.int8)
+        self._encryptor_nodes = [([], []) for _ in states]
+        for g, s in enumerate(states):
+            for t, units in enumerate([s.s_units, s.a_units]):
+                nodes = self._encryptor_nodes[g][t]
+                for u in units:
+                    if u.id == 5 and self._encryptor_index[g, t][u.pos] < 0:
+                        if len(nodes) == 64:
+                            raise ValueError('A team can have at most 64 encryptors')
+                        self._encryptor_index[g, t][u.pos] = len(nodes)
+                        nodes.append(u.pos[0] * PADDED_GRID_SIZE + u.pos[1])
+                for k, u in enumerate(units):
+                    self.uid[g,t,k] = u.id
+                    self.x[g,t,k], self.y[g,t,k] = u.pos
+                    self.stability[g,t,k] = u.stability
+                    self.target[g,t,k] = u.target or 0
+                    self.n_turns_static[g,t,k] = u.n_turns_static
+                    self.previous_move[g,t,k] = MOVES.index(u.previous_move)
+                    self.n_moves[g,t,k] = u.n_moves
+                    mask = sum(1 << i for i, n in enumerate(nodes) if u.shielded_by >> n & 1)
+                    # the bit 63 is the sign bit of the int64
+                    self.shielded_by[g,t,k] = mask - (mask >> 63 << 64)
+
+        # The distance maps only change when a defensive unit is destroyed.
+        # They are computed from scratch for the games flagged as dirty (all
+        # of them at the start), and repaired from the nodes freed since the
+        # last step (as (games, flat indices) arrays) for the others
+        self._blocked = np.zeros((self.n_games, PADDED_GRID_SIZE, PADDED_GRID_SIZE), dtype=bool)
+        self._dist = np.zeros((self.n_games, 4, PADDED_GRID_SIZE, PADDED_GRID_SIZE), dtype=np.int16)
+        self._dirty = np.ones(self.n_games, dtype=bool)
+        self._freed = []
+        # The encryptors of each team still standing, as the bit of their
+        # index on their node in a grid padded with SHIELD_PAD nodes, and
+        # their number. They only change with the defensive units too
+        self._shield_bits = np.zeros((self.n_games, 2, SHIELD_GRID_SIZE, SHIELD_GRID_SIZE),
+                dtype=np.int64)
+        self._n_encryptors = np.zeros((self.n_games, 2), dtype=np.int64)
+        # For the units that can't reach their border, the distance to the
+        # node where they self-destruct, for each game and target (see
+        # bfs.batch_self_destruct_maps). They are only computed for the
+        # games and targets of such units, when flagged as not ready
+        self._stuck = None
+        self._stuck_ready = np.zeros((self.n_games, 4), dtype=bool)
+        # The layout of the defensive units of each game (its packed blocked
+        # nodes, None until needed), and the MapGraph of each layout, which
+        # keeps its caches (components, deepest positions, moves) from one
+        # game or step to the next
+        self._layouts = [None] * self.n_games
+        self._map_graphs = {}
+        # The self-destructions of the current frame, as (game, team, x, y, damages)
+        self._blasts = []
+        # The flat index of the units that moved in the current frame
+        self._moved = np.zeros(0, dtype=np.int64)
+
+    def __len__(self):
+        return self.n_games
+
+    def step(self):
+        """Perform a unique step in all the games"""
+        self._update_distance_maps()
+        self._move()
+        self._shield()
+        self._self_destruct()
+        self._damage()
+        self._remove_dead_units()
+
+    def _update_distance_maps(self):
+        """
+        Compute the blocked nodes and the distance maps of the games flagged
+        as dirty, and repair the maps of the games whose defensive units
+        were destroyed since the last step
+        """
+        games = np.nonzero(self._dirty)[0]
+        if len(games):
+            blocked = np.broadcast_to(OUTSIDE, (len(games),) + OUTSIDE.shape).copy()
+            defensive = self.uid[games] > 3
+            g = np.nonzero(defensive)[0]
+            blocked[g, self.x[games][defensive], self.y[games][defensive]] = True
+            self._blocked[games] = blocked
+            # games often share the same defense, the BFS is run once per layout
+            first, inverse = _unique_layouts(blocked)
+            self._dist[games] = batch_border_distance_maps(blocked[first])[inverse]
+            self._shield_bits[games] = 0
+            g, t, k = np.nonzero(self.uid[games] == 5)
+            g = games[g]
+            x, y = self.x[g, t, k], self.y[g, t, k]
+            bits = np.left_shift(1, self._encryptor_index[g, t, x, y].astype(np.int64))
+            self._shield_bits[g, t, x + SHIELD_PAD, y + SHIELD_PAD] = bits
+            self._n_encryptors[games] = (self.uid[games] == 5).sum(2)
+            self._changed(games)
+            self._dirty[games] = False
+        if self._freed:
+            g, nodes = (np.concatenate(a) for a in zip(*self._freed))
+            self._freed = []
+            self._blocked.reshape(self.n_games, -1)[g, nodes] = False
+            games = np.unique(g)
+            blocked = self._blocked[games]
+            first, inverse = _unique_layouts(blocked)
+            if len(first) * REBUILD_SHARING <= len(games):
+                self._dist[games] = batch_border_distance_maps(blocked[first])[inverse]
+            else:
+                # as in MapGraph.update_distance_maps, freeing nodes can only
+                # make the paths shorter, so the maps are repaired
+                batch_repair_distance_maps(self._dist, self._blocked, g, nodes)
+            self._changed(games)
+
+    def _changed(self, games):
+        """Forget what depended on the layouts of the games"""
+        self._stuck_ready[games] = False
+        for g in games.tolist():
+            self._layouts[g] = None
+
+    def _move(self):
+        """
+        Move the information units of all the games, following the rules
+        of MapGraph._move_one and MapGraph._compute_move. The units that
+        can't reach their border walk to the node where they self-destruct,
+        following the maps of bfs.batch_self_destruct_maps.
+        """
+        mobile = (self.uid > 0) & (self.uid < 4)
+        self.n_turns_static += mobile
+        moving = np.flatnonzero(mobile & (self.n_turns_static >= SPEED[self.uid]))
+        self._moved = moving[:0]
+        if not len(moving):
+            return
+        # the units are read and written by their flat index in the fields
+        n_slots = self.uid.shape[2]
+        g, t = moving // (2 * n_slots), moving // n_slots % 2
+        self.n_turns_static.reshape(-1)[moving] = 0
+        x, y = self.x.reshape(-1)[moving], self.y.reshape(-1)[moving]
+        tg = self.target.reshape(-1)[moving]
+        node = x * PADDED_GRID_SIZE + y
+        maps = (g * 4 + tg - 2) * GRID_NODES
+        dist = self._dist.reshape(-1)
+        here = dist[maps + node]
+        stability = self.stability.reshape(-1)
+
+        # Units on their border score: they are killed and the other team
+        # loses one health point
+        scoring = here == 0
+        stability[moving[scoring]] = 0
+        np.subtract.at(self.health, (g[scoring], 1 - t[scoring]), 1)
+
+        # The units of a stack following the same map from the same node
+        # after the same move make the same move: it is computed once for
+        # the consecutive units, and the results are spread to the others
+        previous = self.previous_move.reshape(-1)[moving]
+        key = (maps + node) * len(MOVES) + previous
+        lead = np.r_[True, key[1:] != key[:-1]]
+        spread = np.cumsum(lead) - 1
+        lead = np.flatnonzero(lead)
+        lg, ltg, lnode, lmaps = g[lead], tg[lead], node[lead], maps[lead]
+
+        # Distance to the border of the four neighbours, in the order of MOVES
+        neighbours = lnode[:, None] + NEIGHBOURS
+        ndist = dist[lmaps[:, None] + neighbours]
+        # The units that can't reach their border read the distance to the
+        # node where they self-destruct, and self-destruct once there. The
+        # units standing on a blocked node (deployed on a defensive unit)
+        # are delegated to the MapGraph
+        blocked = self._blocked.reshape(-1)
+        fallback = (here == INTMAX) & blocked[g * GRID_NODES + node]
+        stuck = np.nonzero((here[lead] == INTMAX) & ~fallback[lead])[0]
+        blast = np.zeros(len(lead), dtype=bool)
+        if len(stuck):
+            stuck_maps = self._stuck_maps(lg[stuck], ltg[stuck])
+            blast[stuck] = self._stuck.reshape(-1)[stuck_maps + lnode[stuck]] == 0
+            ndist[stuck] = self._stuck.reshape(-1)[stuck_maps[:, None] + neighbours[stuck]]
+        ndist = np.where(blocked[(lg * GRID_NODES)[:, None] + neighbours], INTMAX + 1, ndist)
+
+        # Tie breaks of _compute_move: the prefered closest tiles after the
+        # previous move, or all of them if none is prefered, then the move
+        # in the direction of the target edge, then the first one
+        best = ndist == ndist.min(1, keepdims=True)
+        prefered = best & PREFERED[previous[lead]]
+        prefered = np.where(prefered.any(1, keepdims=True), prefered, best)
+        r = np.arange(len(lead))
+        first, second = FIRST_MOVE[ltg], SECOND_MOVE[ltg]
+        move = np.where(prefered[r, first - 1], first,
+               np.where(prefered[r, second - 1], second, prefered.argmax(1) + 1))
+        move, blast = move[spread], blast[spread]
+
+        if blast.any():
+            # as in MapGraph._move_one, only the units which moved enough
+            # damage the ennemies
+            i = moving[blast]
+            stability[i] = 0
+            far = self.n_moves.reshape(-1)[i] >= SELF_DESTRUCT_MIN_MOVES
+            i = np.nonzero(blast)[0][far]
+            self._blasts.extend(zip(g[i].tolist(), t[i].tolist(), x[i].tolist(), y[i].tolist(),
+                INITIAL_STABILITY[self.uid.reshape(-1)[moving[i]]].tolist()))
+        normal = ~scoring & ~fallback & ~blast
+        i, move = moving[normal], move[normal]
+        self.x.reshape(-1)[i] += DX[move]
+        self.y.reshape(-1)[i] += DY[move]
+        self.previous_move.reshape(-1)[i] = move
+        self.n_moves.reshape(-1)[i] += 1
+        for i in moving[fallback].tolist():
+            self._move_with_mapgraph(*np.unravel_index(i, self.uid.shape))
+        self._moved = moving[normal | fallback]
+
+    def _stuck_maps(self, g, tg):
+        """
+        Return the offsets in the flat self._stuck of the maps of the units
+        of the games g with the targets tg, which can't reach their border.
+        The missing maps are computed at once.
+        """
+        if self._stuck is None:
+            self._stuck = np.zeros(self._dist.shape, dtype=np.int16)
+        maps = g * 4 + tg - 2
+        missing = np.unique(maps[~self._stuck_ready.reshape(-1)[maps]])
+        if len(missing):
+            games, i = np.divmod(missing, 4)
+            self._stuck[games, i] = batch_self_destruct_maps(self._blocked[games],
+                    self._dist[games, i], DEEPEST[i])
+            self._stuck_ready[games, i] = True
+        return maps * GRID_NODES
+
+    def _move_with_mapgraph(self, g, t, k):
+        """
+        Move one unit by calling MapGraph.get_direction on the grid of its
+        game. This is only used for the units standing on a blocked node,
+        which reach the components of their neighbours. As in
+        MapGraph._move_one, the units already at their self-destruction
+        position self-destruct.
+        """
+        mg = self._map_graph(g)
+        unit = self._unit(g, t, k)
+        x, y = unit.pos
+        if self._dist[g, unit.target - 2, x, y] == INTMAX and mg.find_deepest_position(unit) == unit.pos:
+            self.stability[g,t,k] = 0
+            if unit.n_moves >= SELF_DESTRUCT_MIN_MOVES:
+                self._blasts.append((g, t, x, y, INITIAL_STABILITY[unit.id]))
+            return
+        self.x[g,t,k], self.y[g,t,k] = mg.get_direction(unit)
+        self.previous_move[g,t,k] = MOVES.index(unit.previous_move)
+        self.n_moves[g,t,k] += 1
+
+    def _map_graph(self, g):
+        """
+        Return a MapGraph with the grid and the distance maps of the game g.
+        The MapGraphs are shared by the games with the same layout, so the
+        following steps reuse their caches. Like the shield maps of
+        MapGraph, they are all dropped when there are too many of them
+        (about two layouts per game).
+        """
+        layout = self._layouts[g]
+        if layout is None:
+            layout = self._layouts[g] = np.packbits(self._blocked[g]).tobytes()
+        mg = self._map_graphs.get(layout)
+        if mg is None:
+            if len(self._map_graphs) >= 2 * self.n_games + 16:
+                self._map_graphs = {}
+            mg = MapGraph()
+            mg._grid = mg._grid_template.copy()
+            mg._grid[self._blocked[g] & ~OUTSIDE] = 1
+            # copies, as the maps of the game change with its layout
+            mg.distance_maps = {i: self._dist[g, i - 2].copy() for i in [2,3,4,5]}
+            self._map_graphs[layout] = mg
+        return mg
+
+    def _shield(self):
+        """
+        Shield the information units that moved in this step, with the
+        encryptors of their game, as in MapGraph._move_team: each encryptor
+        shields a unit once, the first time it enters its range
+        """
+        moved = self._moved
+        if not len(moved) or not self._n_encryptors.any():
+            return
+        n_slots = self.uid.shape[2]
+        g, t = moved // (2 * n_slots), moved // n_slots % 2
+        keep = self._n_encryptors[g, t] > 0
+        moved, g, t = moved[keep], g[keep], t[keep]
+        node = ((g * 2 + t) * SHIELD_GRID_SIZE + self.x.reshape(-1)[moved] + SHIELD_PAD) * SHIELD_GRID_SIZE \
+                + self.y.reshape(-1)[moved] + SHIELD_PAD
+        move = self.previous_move.reshape(-1)[moved]
+        bits = self._shield_bits.reshape(-1)
+        entered = np.bitwise_or.reduce(bits[node[:, None] + ENTER[move]], 1)
+        # on their first move, the units are also shielded by the
+        # encryptors covering the node where they were deployed
+        first = np.nonzero(self.n_moves.reshape(-1)[moved] == 1)[0]
+        if len(first):
+            start = node[first] - DX[move[first]] * SHIELD_GRID_SIZE - DY[move[first]]
+            entered[first] |= np.bitwise_or.reduce(bits[start[:, None] + COVER], 1)
+        shielded_by = self.shielded_by.reshape(-1)
+        new = entered & ~shielded_by[moved]
+        self.stability.reshape(-1)[moved] += _popcount(new) * SHIELD
+        shielded_by[moved] |= new
+
+    def _self_destruct(self):
+        """
+        Inflict the damages of the self-destructions of this step to the
+        ennemy firewalls around them, as in DamageEngine._self_destruct
+        """
+        if not self._blasts:
+            return
+        g, t, x, y, damage = np.array(self._blasts).T
+        self._blasts = []
+        # only the games with blasts are looked at
+        games, g = np.unique(g, return_inverse=True)
+        grid = np.zeros((len(games), 2, PADDED_GRID_SIZE, PADDED_GRID_SIZE), dtype=np.int64)
+        # the blasts of a team hit the other team
+        np.add.at(grid, (g, 1 - t, x, y), damage)
+        blast = neighbourhood_sum(grid, BLAST_OFFSETS)
+        g, t, k = np.nonzero((self.uid[games] > 3) & (self.stability[games] > 0))
+        x, y = self.x[games[g], t, k], self.y[games[g], t, k]
+        self.stability[games[g], t, k] -= blast[g, t, x, y]
+
+    def _damage(self):
+        """
+        Inflict the damages in all the games. As in DamageEngine, the
+        friendly units attack first, then the ennemy units, but the units
+        killed by the friendly units still attack: the attacks of the two
+        teams don't depend on each other, and are inflicted at once.
+        As in DamageEngine._runs, the consecutive units with the same id on
+        the same node attack as a group, and each group sees the damages
+        inflicted by the previous ones of its team. The groups with an
+        ennemy in range are found at once, for all the games, teams and
+        slots. The rules of DamageEngine._targeting_key are packed in a
+        single integer key, and each group attacks the ennemy with the
+        lowest key. As in DamageEngine._attack, the hits of a group go to
+        the same target until it dies, then the next target is chosen.
+        The groups whose targets can't be hit by a previous group of their
+        team attack all at once. The others attack in their order, one
+        group of each team of each game at a time: the number of steps is
+        the largest number of such groups in a team, not the number of
+        slots.
+        """
+        n_slots = self.uid.shape[2]
+        # the fields of the teams of all the games, as (n_games * 2,
+        # n_slots) arrays: the ennemies of the team i are the team i ^ 1
+        uid, x, y, stability = (a.reshape(-1, n_slots) for a in (self.uid, self.x, self.y, self.stability))
+        # first unit of each group, and the size of the groups
+        start = np.ones(uid.shape, dtype=bool)
+        start[:, 1:] = (uid[:, 1:] != uid[:, :-1]) | (x[:, 1:] != x[:, :-1]) | (y[:, 1:] != y[:, :-1])
+        leaders = np.flatnonzero(start & (DPF[uid] > 0))
+        if not len(leaders):
+            return
+        team, k = np.divmod(leaders, n_slots)
+        attacker, ax, ay = uid.reshape(-1)[leaders], x.reshape(-1)[leaders], y.reshape(-1)[leaders]
+        alive = (uid > 0) & (stability > 0)
+        if len(leaders) * n_slots > DENSE_PAIRS:
+            # too many pairs of groups and ennemies: the living ennemies,
+            # and the nodes within each radius of them, are computed as
+            # packed rows, and the groups out of range of all of them are
+            # skipped
+            first = np.r_[True, team[1:] != team[:-1]]
+            ennemies = team[first] ^ 1
+            nodes = x[ennemies] * PADDED_GRID_SIZE + y[ennemies]
+            nodes += np.arange(len(ennemies))[:, None] * GRID_NODES
+            occupied = np.zeros((len(ennemies), PADDED_GRID_SIZE, PADDED_GRID_SIZE), dtype=bool)
+            occupied.reshape(-1)[nodes[alive[ennemies]]] = True
+            near = [pack_rows(occupied)]
+            radius = 0
+            for r in RADII:
+                near.append(_grow_rows(near[-1], r - radius))
+                radius = r
+            near = np.stack(near[1:])
+            fighting = (near[RADIUS_INDEX[attacker], np.cumsum(first) - 1, ax] >> ay) & 1 == 1
+            team, k, attacker, ax, ay = team[fighting], k[fighting], attacker[fighting], ax[fighting], ay[fighting]
+
+        # The candidate targets of each group, as pairs of a group and the
+        # slot of an ennemy. The scramblers can't attack the defensive
+        # units, which come after all the information units in the keys:
+        # they are not candidates
+        targetable = np.stack([alive, alive & (uid < 4)])
+        ox, oy = x.astype(np.int16), y.astype(np.int16)
+        dist = np.abs(ox[team ^ 1] - ax[:, None].astype(np.int16))
+        dist += np.abs(oy[team ^ 1] - ay[:, None].astype(np.int16))
+        candidates = targetable[(attacker == 3).view(np.int8), team ^ 1]
+        candidates &= dist <= RADIUS[attacker][:, None].astype(np.int16)
+        rows, cols = np.divmod(np.flatnonzero(candidates), n_slots)
+        if not len(rows):
+            return
+        dist = dist[rows, cols]
+        n_candidates = np.bincount(rows, minlength=len(team))
+        fighting = n_candidates > 0
+        rows = (np.cumsum(fighting) - 1)[rows]
+        team, k, attacker, n_candidates = team[fighting], k[fighting], attacker[fighting], n_candidates[fighting]
+        following = np.where(start, np.arange(n_slots), n_slots)
+        following = np.minimum.accumulate(following[:, ::-1], axis=1)[:, ::-1]
+        following = np.concatenate([following[:, 1:], np.full((len(uid), 1), n_slots)], 1)
+        count = following[team, k] - k
+        dpf = DPF[attacker]
+
+        # The candidates of each group are put in the first columns of its
+        # row, and the parts of their keys which don't depend on their
+        # stability are computed once. The targets are given by their flat
+        # index in the stabilities
+        n = len(team)
+        stability = stability.reshape(-1)
+        pairs = (team[rows] ^ 1) * n_slots + cols
+        cx, cy = x.reshape(-1)[pairs], y.reshape(-1)[pairs]
+        high = (uid.reshape(-1)[pairs] > 3) * 8 + dist
+        depth = np.where(team[rows] & 1, PADDED_GRID_SIZE - cy, cy)
+        low = (depth * 16 + GEOMETRY.edge_distance[cx, cy]) * n_slots + (n_slots - 1 - cols)
+        span = PADDED_GRID_SIZE * 16 * n_slots
+        first = np.cumsum(n_candidates) - n_candidates
+        index = (rows, np.arange(len(rows)) - first[rows])
+        shape = (n, n_candidates.max())
+        valid = np.zeros(shape, dtype=bool)
+        valid[index] = True
+        targets = np.zeros(shape, dtype=np.int64)
+        targets[index] = pairs
+        # the stabilities only decrease during the attack
+        base = np.zeros(shape, dtype=np.int64)
+        base[index] = high * ((max(stability.max(), 0) + 1) * span) + low
+
+        # A group is independent if none of its candidates is a candidate
+        # of a previous group of its team
+        claim = np.full(stability.shape, n)
+        np.minimum.at(claim, pairs, rows)
+        independent = np.ones(n, dtype=bool)
+        independent[rows[claim[pairs] != rows]] = False
+        dependent = np.flatnonzero(~independent)
+        independent = np.flatnonzero(independent)
+        first = np.flatnonzero(np.r_[True, team[dependent[1:]] != team[dependent[:-1]]]) if len(dependent) else dependent
+        for order, current, end in [
+                (independent, np.arange(len(independent)), np.arange(1, len(independent) + 1)),
+                (dependent, first, np.r_[first[1:], len(dependent)])]:
+            while len(current):
+                h = order[current]
+                c = targets[h]
+                cstab = stability[c]
+                ok = valid[h] & (cstab > 0)
+                best = np.where(ok, base[h] + cstab * span, NO_TARGET).argmin(1)
+                r = np.arange(len(h))
+                hit = ok[r, best]
+                h, target = h[hit], c[r, best][hit]
+                # number of hits before the target dies
+                s = stability[target]
+                hits = np.minimum(count[h], -(-s // dpf[h]))
+                stability[target] = s - hits * dpf[h]
+                count[h] -= hits
+                # the groups without target, or without units left, are
+                # done and the next group of their team attacks
+                done = ~hit
+                done[hit] = count[h] == 0
+                current = current + done
+                left = current < end
+                current, end = current[left], end[left]
+
+    def _remove_dead_units(self):
+        """
+        Remove the units whose stability has reached zero, while keeping
+        the order of the other units
+        """
+        dead = (self.uid > 0) & (self.stability <= 0)
+        if not dead.any():
+            return
+        g, t, k = np.unravel_index(np.flatnonzero(dead & (self.uid > 3)), dead.shape)
+        if len(g):
+            # a defensive unit has been destroyed, the paths have changed
+            x, y = self.x[g, t, k], self.y[g, t, k]
+            self._freed.append((g, x * PADDED_GRID_SIZE + y))
+            # and the destroyed encryptors are forgotten by the units they
+            # shielded, as in GameState.remove_dead_units
+            e = self.uid[g, t, k] == 5
+            if e.any():
+                g, t, x, y = g[e], t[e], x[e], y[e]
+                forgotten = np.zeros((self.n_games, 2), dtype=np.int64)
+                index = self._encryptor_index[g, t, x, y].astype(np.int64)
+                np.bitwise_or.at(forgotten, (g, t), np.left_shift(1, index))
+                games = np.unique(g)
+                self.shielded_by[games] &= ~forgotten[games, :, None]
+                self._shield_bits[g, t, x + SHIELD_PAD, y + SHIELD_PAD] = 0
+                np.subtract.at(self._n_encryptors, (g, t), 1)
+        self.uid[dead] = 0
+        # The empty slots are left where they are, unless the arrays can be
+        # made shorter: then the slots are compacted, keeping their order
+        empty = self.uid == 0
+        n_slots = max((~empty).sum(2).max(), 1)
+        if n_slots < self.uid.shape[2]:
+            order = np.argsort(empty, axis=2, kind='stable')[:, :, :n_slots]
+            for f in FIELDS:
+                setattr(self, f, np.take_along_axis(getattr(self, f), order, axis=2))
+
+    def observe(self, out=None):
+        """
+        Write the observations of all the games (see tc1.observation) into
+        out, an array of shape (n_games,) + OBSERVATION_SHAPE, and return it.
+        Without out, a new float32 array is created.
+        """
+        if out is None:
+            out = np.zeros((self.n_games,) + OBSERVATION_SHAPE, dtype=np.float32)
+        # the distance maps of the games whose layout changed in the last step
+        self._update_distance_maps()
+        out[:, :DIST] = 0
+        # out is indexed directly, so that it can also be a view which is
+        # not contiguous (a flattened view would silently be a copy)
+        g, t, k = np.nonzero(self.uid)
+        uid = self.uid[g, t, k]
+        x, y = self.x[g, t, k], self.y[g, t, k]
+        np.add.at(out, (g, t * N_UNIT_TYPES + uid - 1, x, y), 1)
+        np.add.at(out, (g, STABILITY + t, x, y), self.stability[g, t, k])
+        info = uid < 4
+        np.add.at(out, (g[info], N_TURNS_STATIC + t[info], x[info], y[info]),
+                self.n_turns_static[g, t, k][info])
+        out[:, DIST:] = self._dist
+        return out
+
+    def to_states(self):
+        """
+        Return the list of GameState corresponding to the current state
+        of the games
+        """
+        states = []
+        for g in range(self.n_games):
+            state = GameState(testmode=self._testmode[g])
+            state.s_health, state.a_health = self.health[g].tolist()
+            state.s_core, state.a_core = self.core[g].tolist()
+            state.s_bits, state.a_bits = self.bits[g].tolist()
+            state.turn = int(self.turn[g])
+            for t, units in enumerate([state.s_units, state.a_units]):
+                for k in np.nonzero(self.uid[g, t])[0]:
+                    units.append(self._unit(g, t, k))
+            states.append(state)
+        return states
+
+    def _unit(self, g, t, k):
+        """Return the unit in slot k of team t in game g, as in GameState"""
+        uid = int(self.uid[g,t,k])
+        target = int(self.target[g,t,k]) if uid < 4 else None
+        unit = Unit(uid, (int(self.x[g,t,k]), int(self.y[g,t,k])), target)
+        unit.stability = int(self.stability[g,t,k])
+        unit.previous_move = MOVES[self.previous_move[g,t,k]]
+        unit.n_turns_static = int(self.n_turns_static[g,t,k])
+        unit.n_moves = int(self.n_moves[g,t,k])
+        mask = int(self.shielded_by[g,t,k])
+        unit.shielded_by = sum(1 << n for i, n in enumerate(self._encryptor_nodes[g][t]) if mask >> i & 1)
+        return unit
@@ -0,0 +1,323 @@
+"""
+BFS kernels on the padded 30x30 grid. The nodes are given by their flat
+index x * 30 + y, and the blocked nodes (defensive units, or outside of
+the map) are given as a flat list of booleans.
+"""
+import numpy as np
+from .geometry import GEOMETRY, PADDED_GRID_SIZE
+
+INTMAX = 30 * 30 + 1 # distance of the unreachable nodes
+
+# The tables of the board (see tc1.geometry): the mask of the nodes outside
+# of the map, the flat index of the nodes of each border (and their masks
+# stacked in the order 2, 3, 4, 5 for the batched kernel), and the
+# neighbours of each node
+OUTSIDE = GEOMETRY.outside
+BORDER_NODES = GEOMETRY.border_nodes
+BORDERS = GEOMETRY.borders
+NEIGHBOURS = GEOMETRY.neighbours
+# Initial distances: -1 outside of the map, INTMAX in the map
+_TEMPLATE = np.where(OUTSIDE, -1, INTMAX).ravel().tolist()
+
+
+def _propagate(dist, blocked, q):
+    """
+    Run the BFS from the nodes in the list q, lowering the distances in
+    dist (a flat list) in place. The list q is used as the queue, so it
+    holds all the expanded nodes at the end.
+    Return the number of expanded nodes.
+    """
+    for n in q: # the list grows while we iterate on it
+        c = dist[n] + 1
+        for m in NEIGHBOURS[n]:
+            if c < dist[m] and not blocked[m]:
+                dist[m] = c
+                q.append(m)
+    return len(q)
+
+
+def distance_map(blocked, sources, stats=None):
+    """
+    Return the flat list of the distances to the closest node in sources.
+    Blocked sources are ignored.
+    If an EngineStats is given, the run and the expanded nodes are counted.
+    """
+    dist = list(_TEMPLATE)
+    q = []
+    for n in sources:
+        if not blocked[n]:
+            dist[n] = 0
+            q.append(n)
+    expanded = _propagate(dist, blocked, q)
+    if stats is not None:
+        stats.count('bfs_runs')
+        stats.count('nodes_expanded', expanded)
+    return dist
+
+
+def border_distance_maps(blocked, stats=None):
+    """
+    Compute the distance to the four borders in a single call.
+    Arguments:
+        - blocked: boolean array of shape (30, 30)
+    Return an int array of shape (4, 30, 30), the axis 0 being the borders
+    2 to 5. Unreachable nodes are given the value INTMAX, and the nodes
+    outside of the map -1.
+    """
+    blocked = blocked.ravel().tolist()
+    maps = [distance_map(blocked, BORDER_NODES[i], stats) for i in [2,3,4,5]]
+    return np.array(maps).reshape(4, PADDED_GRID_SIZE, PADDED_GRID_SIZE)
+
+
+def repair_distance_map(dist, blocked, freed, sources, stats=None):
+    """
+    Update a distance map in place after some nodes have been freed. Freeing
+    a node can only make the distances shorter, so we give the freed nodes
+    their distance from their neighbours and propagate the improvements with
+    a BFS starting from them.
+    Arguments:
+        - dist: int array of shape (30, 30), the map to repair
+        - blocked: the new blocked nodes, boolean array of shape (30, 30)
+        - freed: list of the flat index of the freed nodes
+        - sources: the flat index of the nodes at distance 0
+        - stats: optional EngineStats, counting the run and expanded nodes
+    """
+    flat = dist.ravel().tolist()
+    blocked = blocked.ravel().tolist()
+    sources = set(sources)
+    q = []
+    for n in freed:
+        c = INTMAX
+        if n in sources:
+            c = 0
+        for m in NEIGHBOURS[n]:
+            if not blocked[m]:
+                c = min(c, flat[m] + 1)
+        flat[n] = c
+        q.append(n)
+    expanded = _propagate(flat, blocked, q)
+    if stats is not None:
+        stats.count('bfs_runs')
+        stats.count('nodes_expanded', expanded)
+    dist[...] = np.reshape(flat, dist.shape)
+
+
+def label_components(blocked):
+    """
+    Label the connected components of the free nodes.
+    Return the flat list of the labels of the nodes (0 for the blocked
+    nodes, components are numbered from 1), and the list of the nodes of each
+    component (the first one being empty, for the label 0).
+    """
+    labels = [0] * len(blocked)
+    components = [[]]
+    for start in range(len(blocked)):
+        if blocked[start] or labels[start]:
+            continue
+        label = len(components)
+        labels[start] = label
+        nodes = [start]
+        for n in nodes: # the list grows while we iterate on it
+            for m in NEIGHBOURS[n]:
+                if not labels[m] and not blocked[m]:
+                    labels[m] = label
+                    nodes.append(m)
+        components.append(nodes)
+    return labels, components
+
+
+def pack_rows(mask):
+    """
+    Pack a boolean array of shape (..., 30, 30) into its rows: the nodes
+    (x, 0) to (x, 29) are the bits 0 to 29 of a uint32. Return an array of
+    shape (..., 30).
+    """
+    # packing a contiguous array is much faster than packing along an axis
+    padded = np.zeros(mask.shape[:-1] + (32,), dtype=bool)
+    padded[..., :PADDED_GRID_SIZE] = mask
+    return np.packbits(padded.reshape(-1), bitorder='little').view('<u4').reshape(mask.shape[:-1])
+
+
+# The borders as packed rows and as flat masks, for the batched kernels,
+# and the offsets of the flat index of the four neighbours of a node (the
+# nodes of the map have all their neighbours in the padded grid)
+_BORDER_ROWS = pack_rows(BORDERS)
+_BORDER_FLAT = BORDERS.reshape(4, -1)
+_NEIGHBOUR_OFFSETS = np.array([-PADDED_GRID_SIZE, PADDED_GRID_SIZE, -1, 1])
+
+
+def _transpose_bytes(x):
+    """
+    Transpose the 8x8 bit matrices held by an array of uint64: the bit i of
+    the byte b becomes the bit b of the byte i
+    """
+    u = np.uint64
+    for shift, mask in [(7, 0x00AA00AA00AA00AA), (14, 0x0000CCCC0000CCCC), (28, 0x00000000F0F0F0F0)]:
+        t = (x ^ (x >> u(shift))) & u(mask)
+        x = x ^ t ^ (t << u(shift))
+    return x
+
+
+def _wavefront(free, front, seen, planes):
+    """
+    Run a wavefront BFS from the nodes of front, through the nodes of free,
+    all of them given as packed rows (see pack_rows). Every node of the
+    current front is expanded at once: the neighbours in the same row are
+    the next and previous bits, the others are in the next and previous
+    rows. The reached nodes are added to seen (in place), and the level of
+    each node is recorded in the bit planes (the plane b holds the nodes
+    whose distance has the bit b). Return the last level reached.
+    """
+    front = front.copy()
+    nxt = np.empty_like(front)
+    one = np.uint32(1)
+    level = 0
+    while True:
+        np.left_shift(front, one, out=nxt)
+        nxt |= front >> one
+        nxt[..., 1:] |= front[..., :-1]
+        nxt[..., :-1] |= front[..., 1:]
+        nxt &= free
+        nxt &= ~seen
+        if not nxt.any():
+            return level
+        seen |= nxt
+        front, nxt = nxt, front
+        level += 1
+        for b in range(level.bit_length()):
+            if level >> b & 1:
+                planes[b] |= front
+
+
+def _unpack_levels(planes, seen, last):
+    """
+    Turn the bit planes of _wavefront, of shape (16, ..., 30), into the
+    int16 levels of the nodes, of shape (..., 30, 30). The 8 planes of each
+    byte of the levels are read byte by byte of the rows, as uint64 whose
+    byte b is the plane b, and their bits are transposed. The nodes not in
+    seen are given INTMAX.
+    """
+    shape = planes.shape[1:-1]
+    size = PADDED_GRID_SIZE
+    n_bytes = 1 if last < 256 else 2
+    groups = planes[:8 * n_bytes].view(np.uint8).reshape((n_bytes, 8) + shape + (size, 4))
+    groups = np.ascontiguousarray(np.moveaxis(groups, 1, -1)).view('<u8')
+    levels = _transpose_bytes(groups).view(np.uint8).reshape((n_bytes,) + shape + (size, 32))[..., :size]
+    dist = levels[0].astype(np.int16)
+    if n_bytes == 2:
+        dist |= levels[1].astype(np.int16) << 8
+    seen = np.unpackbits(seen.view(np.uint8).reshape(shape + (size, 4)), axis=-1,
+            bitorder='little')[..., :size]
+    dist[seen == 0] = INTMAX
+    return dist
+
+
+def batch_border_distance_maps(blocked):
+    """
+    Compute the distance to the four borders for a batch of grids, with a
+    wavefront BFS (see _wavefront): the rows of the grids are packed in
+    uint32, so expanding a front is a few shifts and masks on arrays of
+    shape (n, 4, 30). This is slower than border_distance_maps for one
+    grid, but much faster for many grids.
+    Arguments:
+        - blocked: boolean array of shape (n, 30, 30)
+    Return an int16 array of shape (n, 4, 30, 30), with the same values as
+    border_distance_maps.
+    """
+    n = len(blocked)
+    free = pack_rows(~blocked)[:, None]
+    front = _BORDER_ROWS[None] & free
+    seen = front.copy()
+    # distances below 2 ** 16, INTMAX included
+    planes = np.zeros((16, n, 4, PADDED_GRID_SIZE), dtype=np.uint32)
+    dist = _unpack_levels(planes, seen, _wavefront(free, front, seen, planes))
+    dist[..., OUTSIDE] = -1
+    return dist
+
+
+def batch_self_destruct_maps(blocked, dist, directions):
+    """
+    Compute, for a batch of grids, the distance of each free node which
+    can't reach the target border to the deepest node of its component,
+    where its units self-destruct (see MapGraph.find_deepest_position).
+    The components are disjoint, so each round finds the
+    deepest node not reached yet in each grid, and runs the wavefront BFS
+    from it (see _wavefront): the number of rounds is the largest number
+    of such components in a grid.
+    Arguments:
+        - blocked: boolean array of shape (n, 30, 30)
+        - dist: the distance maps to the target borders, int array of shape
+            (n, 30, 30), as returned by batch_border_distance_maps
+        - directions: int array of shape (n, 2), the prefered directions of
+            the deepest node (see MapGraph.find_deepest_position): the
+            biggest y * directions[:, 1], then x * directions[:, 0]
+    Return an int16 array of shape (n, 30, 30), INTMAX for the nodes from
+    which the border can be reached and for the blocked nodes.
+    """
+    n = len(blocked)
+    stuck = ~blocked & (dist == INTMAX)
+    free = pack_rows(stuck)
+    # the y coordinate has priority, |x| < 64 can't change the order of y
+    x, y = np.divmod(np.arange(PADDED_GRID_SIZE ** 2), PADDED_GRID_SIZE)
+    priority = y * directions[:, 1:] * 64 + x * directions[:, :1]
+    remaining = stuck.reshape(n, -1).copy()
+    seen = np.zeros_like(free)
+    planes = np.zeros((16, n, PADDED_GRID_SIZE), dtype=np.uint32)
+    last = 0
+    while True:
+        grids = np.flatnonzero(remaining.any(1))
+        if not len(grids):
+            break
+        # the deepest node not reached yet starts the BFS of its component
+        deepest = np.where(remaining[grids], priority[grids], -PADDED_GRID_SIZE ** 3).argmax(1)
+        dx, dy = np.divmod(deepest, PADDED_GRID_SIZE)
+        front = np.zeros_like(free)
+        front[grids, dx] = np.left_shift(1, dy).astype(np.uint32)
+        seen |= front
+        last = max(last, _wavefront(free, front, seen, planes))
+        reached = np.unpackbits(seen[grids].view(np.uint8).reshape(len(grids), PADDED_GRID_SIZE, 4),
+                axis=-1, bitorder='little')[..., :PADDED_GRID_SIZE]
+        remaining[grids] &= reached.reshape(len(grids), -1) == 0
+    return _unpack_levels(planes, seen, last)
+
+
+def batch_repair_distance_maps(dist, blocked, grids, freed):
+    """
+    Batched version of repair_distance_map, for the four maps of some grids
+    of a batch. As in repair_distance_map, the freed nodes are given their
+    distance from their neighbours, then the improvements are propagated,
+    here for all the grids at once: each step expands the list of the
+    nodes whose distance just decreased, so the work only depends on the
+    number of nodes that change, not on the size of the batch.
+    Arguments:
+        - dist: contiguous int16 array of shape (n, 4, 30, 30), as returned
+            by batch_border_distance_maps, repaired in place
+        - blocked: the new blocked nodes, boolean array of shape (n, 30, 30)
+        - grids, freed: int arrays, the index of the grids in the batch and
+            the flat index of their freed nodes
+    """
+    size = PADDED_GRID_SIZE ** 2
+    flat = dist.reshape(-1)
+    free = ~blocked.reshape(-1)
+    # the freed nodes in each of the four maps of their grid
+    maps = (grids[:, None] * 4 + np.arange(4)).ravel()
+    nodes = np.repeat(freed, 4)
+    neighbours = nodes[:, None] + _NEIGHBOUR_OFFSETS
+    reachable = free[grids.repeat(4)[:, None] * size + neighbours]
+    d = np.where(reachable, flat[maps[:, None] * size + neighbours] + 1, INTMAX).min(1)
+    d = np.minimum(d, INTMAX)
+    d[_BORDER_FLAT[maps % 4, nodes]] = 0
+    front = maps * size + nodes
+    flat[front] = d
+    front, d = front[d < INTMAX], d[d < INTMAX]
+    first = np.empty(len(flat), dtype=np.int32)
+    while len(front):
+        nodes = (front[:, None] + _NEIGHBOUR_OFFSETS).ravel()
+        d = np.repeat(d + 1, 4).astype(np.int16)
+        better = free[nodes // (4 * size) * size + nodes % size] & (d < flat[nodes])
+        nodes, d = nodes[better], d[better]
+        np.minimum.at(flat, nodes, d)
+        # each node is expanded once, with its new distance
+        first[nodes] = np.arange(len(nodes), dtype=np.int32)
+        front = nodes[first[nodes] == np.arange(len(nodes))]
+        d = flat[front]
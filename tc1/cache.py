@@ -0,0 +1,55 @@
+from collections import OrderedDict
+
+
+class OutcomeCache:
+    def __init__(self, maxsize=100000):
+        """
+        Bounded cache of the outcomes of the rounds, used by Engine to skip
+        the rounds it has already simulated. The least recently used
+        outcomes are dropped when the cache is full.
+        The hits and misses are counted to help sizing the cache.
+        Arguments:
+            - maxsize: maximum number of outcomes kept
+        """
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Return the outcome stored for key, or None"""
+        outcome = self._entries.get(key)
+        if outcome is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return outcome
+
+    def put(self, key, outcome):
+        self._entries[key] = outcome
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    @property
+    def hit_rate(self):
+        """Fraction of the lookups that found an outcome"""
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.
+
+    def clear(self):
+        """Drop all the outcomes and reset the counters"""
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __repr__(self):
+        return 'OutcomeCache({}/{} outcomes, {} hits, {} misses, hit rate {:.1%})'.format(
+                len(self), self.maxsize, self.hits, self.misses, self.hit_rate)
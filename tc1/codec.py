@@ -0,0 +1,197 @@
+"""
+Compact binary encoding of a GameState, used to send states between
+processes or to store them on disk without pickling the units one by one.
+The layout is a fixed-size header followed by one fixed-size record per
+unit, the friendly units first. The units of each team are encoded
+separately (see encode_units), as their shields refer to the encryptors of
+their team. Encoded states can be concatenated in a
+single buffer, see iter_views.
+"""
+import struct
+import numpy as np
+from .state import GameState
+from .unit import MOVES, Unit
+
+# Identify the encoding, and its version
+MAGIC = b'TC1\x04'
+
+# magic, health of both teams, then cores and bits of both teams, the turn,
+# then the number of friendly and ennemy units
+HEADER = struct.Struct('<4s2i4d3I')
+
+UNIT_DTYPE = np.dtype([
+    ('id', 'u1'),
+    ('x', 'u1'),
+    ('y', 'u1'),
+    ('target', 'u1'), # 0 for defensive units
+    ('previous_move', 'u1'), # index in MOVES
+    ('n_turns_static', 'u1'),
+    ('n_moves', '<u2'),
+    ('stability', '<i4'),
+    # the encryptors that shielded the unit: the bit i is set for the i-th
+    # encryptor of the encoded units (so a team has at most 64 encryptors)
+    ('shielded_by', '<u8')])
+
+# Lookup tables to decode the records without parsing them field by field:
+# the positions by flat index (the tuples are shared by the decoded units,
+# which is fine as they are immutable), and the targets by stored value
+_POSITIONS = [(x, y) for x in range(30) for y in range(30)]
+_TARGETS = [None, None, 2, 3, 4, 5]
+_MOVE_INDEX = {move: i for i, move in enumerate(MOVES)}
+
+
+def encoded_size(n_units):
+    """Size in bytes of the encoding of a state with n_units units"""
+    return HEADER.size + n_units * UNIT_DTYPE.itemsize
+
+
+def encode_state(state):
+    """Return the binary encoding of a GameState, as bytes"""
+    header = HEADER.pack(MAGIC, state.s_health, state.a_health, state.s_core,
+            state.a_core, state.s_bits, state.a_bits, state.turn, len(state.s_units),
+            len(state.a_units))
+    return header + encode_units(state.s_units).tobytes() + encode_units(state.a_units).tobytes()
+
+
+def _encryptor_nodes(units):
+    """
+    Return the flat index of the nodes of the encryptors in a list of
+    units, in their order
+    """
+    return [u.pos[0] * 30 + u.pos[1] for u in units if u.id == 5]
+
+
+def encode_units(units):
+    """
+    Return the array of the records (of dtype UNIT_DTYPE) of a list of
+    units, all of the same team. The encryptors that shielded the units are
+    given by their order in the list, and a ValueError is raised if a unit
+    was shielded by an encryptor after the 64th.
+    """
+    # fill the records column by column, it is faster than building a
+    # tuple for each unit
+    records = np.empty(len(units), UNIT_DTYPE)
+    records['id'] = [u.id for u in units]
+    records['x'] = [u.pos[0] for u in units]
+    records['y'] = [u.pos[1] for u in units]
+    records['target'] = [u.target or 0 for u in units]
+    records['previous_move'] = [_MOVE_INDEX[u.previous_move] for u in units]
+    records['n_turns_static'] = [u.n_turns_static for u in units]
+    records['n_moves'] = [u.n_moves for u in units]
+    records['stability'] = [u.stability for u in units]
+    records['shielded_by'] = 0
+    shielded = [i for i, u in enumerate(units) if u.shielded_by]
+    if shielded:
+        # the bits of the nodes become the bits of the order of the
+        # encryptors, the encryptors already destroyed being ignored
+        order = {}
+        for j, n in enumerate(_encryptor_nodes(units)):
+            order.setdefault(n, j)
+        for i in shielded:
+            mask = 0
+            for n, j in order.items():
+                if units[i].shielded_by >> n & 1:
+                    if j >= 64:
+                        raise ValueError('Only the shields of the first 64 encryptors can be encoded')
+                    mask |= 1 << j
+            records['shielded_by'][i] = mask
+    return records
+
+
+def _unpack_header(buf, offset=0):
+    """Return the values of the header, checking the magic"""
+    values = HEADER.unpack_from(buf, offset)
+    if values[0] != MAGIC:
+        raise ValueError('Not an encoded GameState (magic {!r})'.format(values[0]))
+    return values[1:]
+
+
+def decode_units(records):
+    """Create the units of an array of records of the same team"""
+    new = Unit.__new__
+    flat = (records['x'] * np.uint16(30) + records['y']).tolist()
+    units = []
+    for uid, n, stability, target, move, n_turns, n_moves in zip(records['id'].tolist(),
+            flat, records['stability'].tolist(), records['target'].tolist(),
+            records['previous_move'].tolist(), records['n_turns_static'].tolist(),
+            records['n_moves'].tolist()):
+        unit = new(Unit)
+        unit.id = uid
+        unit.pos = _POSITIONS[n]
+        unit.stability = stability
+        unit.target = _TARGETS[target]
+        unit.previous_move = MOVES[move]
+        unit.n_turns_static = n_turns
+        unit.n_moves = n_moves
+        unit.shielded_by = 0
+        units.append(unit)
+    if records['shielded_by'].any():
+        nodes = _encryptor_nodes(units)
+        for i in np.nonzero(records['shielded_by'])[0].tolist():
+            mask = int(records['shielded_by'][i])
+            units[i].shielded_by = sum(1 << n for j, n in enumerate(nodes) if mask >> j & 1)
+    return units
+
+
+def decode_state(buf, testmode=False):
+    """
+    Create a new GameState from the bytes returned by encode_state. Any
+    object supporting the buffer protocol (bytes, memoryview, mmap...) can
+    be given.
+    """
+    return StateView(buf).to_state(testmode)
+
+
+class StateView:
+    def __init__(self, buf, offset=0):
+        """
+        Read-only view of an encoded GameState, without copying the buffer.
+        The values of the header are attributes (s_health, a_core...), and
+        the units are numpy record arrays (units, s_units and a_units)
+        sharing the memory of the buffer.
+        Arguments:
+            - buf: bytes, memoryview or any object supporting the buffer
+                protocol, containing the state returned by encode_state
+            - offset: position of the state in buf
+        """
+        (self.s_health, self.a_health, self.s_core, self.a_core, self.s_bits,
+                self.a_bits, self.turn, self.n_s_units, self.n_a_units) = _unpack_header(buf, offset)
+        self.units = np.frombuffer(buf, UNIT_DTYPE, self.n_s_units + self.n_a_units,
+                offset + HEADER.size)
+        self.offset = offset
+        self.nbytes = encoded_size(len(self.units))
+
+    @property
+    def s_units(self):
+        return self.units[:self.n_s_units]
+
+    @property
+    def a_units(self):
+        return self.units[self.n_s_units:]
+
+    def to_state(self, testmode=False):
+        """Return a new GameState with the values of the view"""
+        state = GameState(testmode)
+        (state.s_health, state.a_health, state.s_core, state.a_core,
+                state.s_bits, state.a_bits, state.turn) = (self.s_health, self.a_health,
+                        self.s_core, self.a_core, self.s_bits, self.a_bits, self.turn)
+        state.s_units = decode_units(self.s_units)
+        state.a_units = decode_units(self.a_units)
+        return state
+
+    def __repr__(self):
+        return 'StateView(health={}/{}, units={}/{})'.format(self.s_health,
+                self.a_health, self.n_s_units, self.n_a_units)
+
+
+def iter_views(buf):
+    """
+    Iterate on the StateView of the states encoded one after the other in
+    buf (for instance a file of concatenated encodings, opened with mmap).
+    """
+    offset = 0
+    size = memoryview(buf).nbytes
+    while offset < size:
+        view = StateView(buf, offset)
+        yield view
+        offset += view.nbytes
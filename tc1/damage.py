@@ -1,125 +1,290 @@
 import numpy as np
+from .bfs import OUTSIDE, PADDED_GRID_SIZE
+from .geometry import GEOMETRY
+from .unit import MOVES
+from .unit_desc import UNITS_DESC
+
+# Stability given by an encryptor to each friendly information unit that
+# enters its range, once per unit (see MapGraph), and range of the
+# self-destructions
+SHIELD = UNITS_DESC['encryptor']['shield']
+SELF_DESTRUCT_RANGE = 1.5
 
 def l1dist(t1,t2):
     # L1 distance for tuples
     return abs(t1[0] - t2[0]) + abs(t1[1] - t2[1])
 
+def _make_range_table():
+    """
+    For each range of the units, and each node of the map (given by its flat
+    index), list the nodes of the map within range with their distance.
+    This only depends on the board, so it is computed once.
+    """
+    xs, ys = np.nonzero(~OUTSIDE)
+    flat = (xs * PADDED_GRID_SIZE + ys).tolist()
+    dmat = np.abs(xs[:, None] - xs[None]) + np.abs(ys[:, None] - ys[None])
+    table = {}
+    for r in set(u['range'] for u in UNITS_DESC.values()):
+        table[r] = [() for _ in range(PADDED_GRID_SIZE ** 2)]
+        for i, n in enumerate(flat):
+            in_range = np.nonzero(dmat[i] < r)[0]
+            table[r][n] = tuple((flat[j], int(dmat[i, j])) for j in in_range)
+    return table
+
+RANGE_TABLE = _make_range_table()
+# Distance of each node (by flat index) to the closest edge, for the targeting
+EDGE_DISTANCE = GEOMETRY.edge_distance.ravel().tolist()
+
+def _offsets(r):
+    """Offsets (dx,dy) of the nodes within range r, as in RANGE_TABLE"""
+    k = int(r)
+    return [(dx, dy) for dx in range(-k, k + 1) for dy in range(-k, k + 1)
+            if abs(dx) + abs(dy) < r]
+
+# Neighbourhood masks of the encryptors and of the self-destructions. An
+# encryptor at offset o of a node shields the units entering the node with
+# the move m if o + m is out of its range, as the unit was out of range
+# before the move. ENTER_OFFSETS is indexed like MOVES (no offsets for
+# the units that didn't move)
+SHIELD_OFFSETS = _offsets(UNITS_DESC['encryptor']['range'])
+BLAST_OFFSETS = _offsets(SELF_DESTRUCT_RANGE)
+ENTER_OFFSETS = [[]] + [[(dx, dy) for dx, dy in SHIELD_OFFSETS
+    if (dx + mx, dy + my) not in SHIELD_OFFSETS] for mx, my in MOVES[1:]]
+
+def neighbourhood_sum(grid, offsets):
+    """
+    Return the array out with out[..., x, y] being the sum of the values
+    grid[..., x+dx, y+dy] for each offset. The grid is an array of shape
+    (..., 30, 30), the nodes outside of the padded grid count as zero.
+    """
+    out = np.zeros_like(grid)
+    if not offsets:
+        return out
+    k = max(max(abs(dx), abs(dy)) for dx, dy in offsets)
+    n = PADDED_GRID_SIZE
+    padded = np.zeros(grid.shape[:-2] + (n + 2 * k, n + 2 * k), grid.dtype)
+    padded[..., k:k+n, k:k+n] = grid
+    for dx, dy in offsets:
+        out += padded[..., k+dx:k+dx+n, k+dy:k+dy+n]
+    return out
+
+def shield_masks(encryptors):
+    """
+    From the positions of the encryptors of a team, return the encryptors
+    covering each node, and the encryptors whose range is entered when
+    moving to each node, for each move of MOVES. The encryptors are given
+    as masks, with the bit 1 << (x * 30 + y) for the encryptor at (x, y) as
+    in Unit.shielded_by, in flat lists indexed by node (a dict of lists
+    indexed by move for the second one).
+    """
+    n = PADDED_GRID_SIZE
+    cover = [0] * (n * n)
+    enter = {move: [0] * (n * n) for move in MOVES[1:]}
+    for ex, ey in encryptors:
+        bit = 1 << (ex * n + ey)
+        # the encryptor at e is at the offset o of the node e - o
+        for masks, offsets in [(cover, SHIELD_OFFSETS)] + [(enter[move], offsets)
+                for move, offsets in zip(MOVES[1:], ENTER_OFFSETS[1:])]:
+            for dx, dy in offsets:
+                x, y = ex - dx, ey - dy
+                if 0 <= x < n and 0 <= y < n:
+                    masks[x * n + y] |= bit
+    return cover, enter
+
 class DamageEngine:
-    def __init__(self):
+    def __init__(self, stats=None):
         """
         This class is used to compute the damages afflicted by units to other units.
         It assume that the units were already moved
+        Arguments:
+            - stats: optional EngineStats, counting the targeting comparisons
         """
-        pass
+        self.stats = stats
 
-    def __call__(self, state):
+    def __call__(self, state, events=None):
         """
         Inflict damages on the units according to the rules of the game.
         Assume units were moved, and that units killed in the previous
         turn are no longer in the state object.
+        First the units that self-destructed damage the ennemy firewalls
+        around them. Then the friendly units attack, then the ennemy ones. Each
+        unit sees the damages inflicted by the previous ones when choosing
+        its target.
+        Arguments:
+            - state: the GameState
+            - events: the friendly and ennemy events of the frame, as
+                returned by MapGraph, for the self-destructions
+        Return the total damages inflicted by the friendly and ennemy units.
+        """
+        s_damage = a_damage = 0
+        if events is not None:
+            s_damage = self._self_destruct(events[0], state.a_units)
+            a_damage = self._self_destruct(events[1], state.s_units)
+        s_stacks = self._stacks(state.s_units)
+        a_stacks = self._stacks(state.a_units)
+        for attacking, count in self._runs(state.s_units):
+            s_damage += self._attack(attacking, count, a_stacks, True)
+        for attacking, count in self._runs(state.a_units):
+            a_damage += self._attack(attacking, count, s_stacks, False)
+        return s_damage, a_damage
+
+    def _self_destruct(self, events, ennemies):
+        """
+        Inflict the damages of the units that self-destructed this frame
+        (see MapGraph._move_one) to the ennemy firewalls around them (the
+        information units are not damaged). The damages are spread on the
+        grid with the neighbourhood mask, then each firewall reads the
+        damages of its node. Return the damages inflicted.
         """
-        # pairwise distances between the units of both teams
-        dmat = self._get_distance_matrix(state)
-        # list of pairs [a,b] where a can and should attack b
-        for attacking, attacked in self._find_targets(state, dmat):
-            if attacked is None: # out of range
+        grid = None
+        for e in events:
+            if e[0] == 'self_destruct' and e[2]:
+                if grid is None:
+                    grid = np.zeros((PADDED_GRID_SIZE, PADDED_GRID_SIZE), dtype=np.int64)
+                grid[e[1]] += e[2]
+        if grid is None:
+            return 0
+        blast = neighbourhood_sum(grid, BLAST_OFFSETS).ravel().tolist()
+        damage = 0
+        for unit in ennemies:
+            if unit.id < 4 or unit.stability <= 0:
                 continue
-            if attacking['id'] == 3: # scrambler
-                if attacked['id'] > 3: # defensive unit
-                    continue # scrambler can't attack defensive units
-            attacked['stability'] -= attacking['dpf']
+            x, y = unit.pos
+            d = blast[x * PADDED_GRID_SIZE + y]
+            unit.stability -= d
+            damage += d
+        return damage
 
-    def _find_targets(self, state, dmat):
+    def _stacks(self, units):
         """
-        Find target for all units, and return None if there is no available
-        target within range. The result is a list of list of two nodes, the
-        first one being the attacking unit and the second one the attacked.
+        Return a dict mapping the flat index of the occupied nodes to the
+        stack of the living units on this node. All the units of a stack
+        are at the same distance of an attacker, so the member attacked is
+        the one with the lowest key (information units first, then the
+        lowest stability, then the last created). The stacks are sorted by
+        decreasing key, so the member attacked is the last one.
+        The attacked member only gets a lower key when it takes damage, so it
+        stays the last one until it dies and is popped.
         """
-        # start with the friendly units
-        for i,s in enumerate(state.s_units):
-            target = None
-            for j,a in enumerate(state.a_units):
-                if dmat[i,j] < s['range']:
-                    # if new node as the priority
-                    if self._targeting_priority(s, target, a):
-                        target = a
-            yield [s, target]
-
-        # Now match the ennemy units
-        for i,a in enumerate(state.a_units):
+        stacks = {}
+        for order, unit in enumerate(units):
+            if unit.stability <= 0: # the units that scored this frame
+                continue
+            x, y = unit.pos
+            stacks.setdefault(x * PADDED_GRID_SIZE + y, []).append((order, unit))
+        for n, stack in stacks.items():
+            if len(stack) > 1:
+                stack.sort(key=lambda e: (e[1].id > 3, e[1].stability, -e[0]), reverse=True)
+        return stacks
+
+    def _runs(self, units):
+        """
+        Group the consecutive units with the same id on the same node (like
+        a stack deployed at once). Yield (unit, count) for each group, the
+        units of a group attacking one after the other.
+        """
+        first, count = None, 0
+        for unit in units:
+            if count and unit.id == first.id and unit.pos == first.pos:
+                count += 1
+                continue
+            if count:
+                yield first, count
+            first, count = unit, 1
+        if count:
+            yield first, count
+
+    def has_targets(self, state):
+        """
+        Return True if at least one unit has an ennemy within its range. If
+        not, and if no unit moves, the next frame won't change anything.
+        """
+        for units, ennemies in [(state.s_units, state.a_units), (state.a_units, state.s_units)]:
+            grid = self._occupancy(ennemies)
+            for unit in units:
+                if not unit.dpf:
+                    continue
+                x, y = unit.pos
+                for node, _ in RANGE_TABLE[unit.range][x * PADDED_GRID_SIZE + y]:
+                    if node in grid:
+                        return True
+        return False
+
+    def _occupancy(self, units):
+        """
+        Return a dict mapping the flat index of the occupied nodes to the list
+        of (order, unit) on this node, order being the index of the unit in
+        its team
+        """
+        grid = {}
+        for order, unit in enumerate(units):
+            x, y = unit.pos
+            grid.setdefault(x * PADDED_GRID_SIZE + y, []).append((order, unit))
+        return grid
+
+    def _attack(self, attacking, count, stacks, friendly):
+        """
+        Find the targets of a group of identical units and inflict the
+        damages. Only the nodes within the range of the units are checked.
+        The target of the first unit stays the best one for the next units
+        until it dies (its stability only decreases), so the hits of the
+        group are applied to it at once. Return the damages inflicted.
+        Arguments:
+            - attacking: the first unit of the group
+            - count: the number of units in the group, see _runs
+            - stacks: the stacks of the ennemies of the units, see _stacks
+            - friendly: whether the attacking units are friendly units
+        """
+        dpf = attacking.dpf
+        if not dpf: # filters and encryptors don't attack
+            return 0
+        x, y = attacking.pos
+        in_range = RANGE_TABLE[attacking.range][x * PADDED_GRID_SIZE + y]
+        damage = 0
+        n_compared = 0
+        while count:
             target = None
-            for j,s in enumerate(state.s_units):
-                if dmat[j,i] < a['range']:
-                    # if new node as the priority
-                    if self._targeting_priority(a, target, s):
-                        target = s
-            yield [a, target]
-
-    def _get_distance_matrix(self, state):
-        """
-        Return a pairwise distance matrix between the friendly units (axis 0) and
-        the ennemy units (axis 1).
-        Exemple: dmat[i,j] = distance { state.s_units[i], state.a_units[j] }
-        """
-        nrows = len(state.s_units)
-        ncols = len(state.a_units)
-        dmat = np.zeros((nrows, ncols))
-        for i,s in enumerate(state.s_units):
-            for j,a in enumerate(state.a_units):
-                dmat[i,j] = l1dist(s['pos'], a['pos'])
-        return dmat
-
-    def _targeting_priority(self, attacking_unit,  unit1, unit2):
-        """
-        Return true if unit2 has a higher priority than unit1 when attacked by
-        'attacking_unit'.
-        The priority is defined by the following rules:
+            best_key = None
+            for node, dist in in_range:
+                stack = stacks.get(node)
+                if not stack:
+                    continue
+                order, unit = stack[-1]
+                key = self._targeting_key(unit, dist, order, friendly)
+                n_compared += 1
+                if best_key is None or key < best_key:
+                    target, best_key, best_stack = unit, key, stack
+            if target is None: # nothing in range
+                break
+            if attacking.id == 3 and target.id > 3: # scrambler
+                break # scrambler can't attack defensive units
+            # number of hits before the target dies
+            hits = min(count, -(-target.stability // dpf))
+            target.stability -= hits * dpf
+            damage += hits * dpf
+            count -= hits
+            if target.stability <= 0:
+                best_stack.pop()
+        if self.stats is not None:
+            self.stats.count('targeting_comparisons', n_compared)
+        return damage
+
+    def _targeting_key(self, unit, dist, order, friendly):
+        """
+        Return the key of a potential target, the target with the lowest key
+        being attacked. The priority is defined by the following rules:
             1) Prioritize Information over Firewalls
             2) Choose the nearest target(s). Note that the potential targets could
                 include multiple locations if they are the same distance away.
             3) Choose the target(s) with the lowest remaining Stability
             4) Choose the target(s) which are the furthest into/towards your side of the arena
             5) Choose the target closest to an edge
+        When everything is equal, the last unit created is attacked.
         """
-        # Just ignore the new unit if it's health is equal or less to zero
-        if unit2['stability'] <= 0:
-            return False
-        # For convenience, we consider than any unit as a higher priority than None
-        if unit1 is None:
-            return True
-        # For rule 1):
-        if unit1['id'] > 3 and unit2['id'] < 4:
-            return True
-        # For rule 2):
-        d1 = l1dist(unit1['pos'], attacking_unit['pos'])
-        d2 = l1dist(unit2['pos'], attacking_unit['pos'])
-        if d1 < d2:
-            return False
-        if d2 > d1:
-            return True
-        # For rule 3):
-        if unit1['stability'] < unit2['stability']:
-            return False
-        if unit2['stability'] < unit1['stability']:
-            return True
-        # for rule 4):
-        if attacking_unit['target'] in [2,3]: # means the attacking unit is friendly
-            if unit1['pos'][1] < unit2['pos'][1]: # unit1 is closer to my side
-                return False
-            if unit1['pos'][1] > unit2['pos'][1]: # unit2 is closer
-                return True
-        else: # attacking unit is not friendly
-            if unit1['pos'][1] < unit2['pos'][1]: # unit1 is closer to my side
-                return True
-            if unit1['pos'][1] > unit2['pos'][1]: # unit2 is closer
-                return False
-        # For rule 5):
-        # this one rule is not super clear, I assume it means to look at the x coordinate
-        if min(unit1['pos'][0], 30 - unit1['pos'][0]) < min(unit2['pos'][0], 30 - unit2['pos'][0]):
-            return False # unit 1 closer to an edge
-        return True
-
-
-
-
-
+        x, y = unit.pos
+        # For rule 4), friendly side is at the bottom of the map
+        depth = y if friendly else -y
+        # For rule 5), this one rule is not super clear, I assume it means
+        # to look at the x coordinate
+        edge = EDGE_DISTANCE[x * PADDED_GRID_SIZE + y]
+        return (unit.id > 3, dist, unit.stability, depth, edge, -order)
@@ -1,21 +1,14 @@
 from matplotlib import pyplot as plt
-import numpy as np
+from .geometry import GEOMETRY, PADDED_GRID_SIZE
 
 class Matplotlib_display:
     def __init__(self):
         self.GRID_SIZE = 28
-        self.PADDED_GRID_SIZE = 30
-
-    def _make_grid(self):
-        self._grid = -1 * np.ones((self.PADDED_GRID_SIZE,
-            self.PADDED_GRID_SIZE))
-        for i in range(15):
-            for j in range(15 - i, 15 + i):
-                self._grid[i,j] = 0
-                self._grid[30 - i - 1, j] = 0
+        self.PADDED_GRID_SIZE = PADDED_GRID_SIZE
 
     def update_state(self, newstate):
-        self._make_grid()
+        # start from the empty board, computed once (see tc1.geometry)
+        self._grid = GEOMETRY.grid_template.copy()
         # update for friendly units
         for su in newstate['s_units']:
             x,y = su['pos']
@@ -1,22 +1,42 @@
+import copy
+from time import perf_counter
 from .mapgraph import MapGraph
 from .state import GameState
 from .damage import DamageEngine
-from .display import Matplotlib_display
+from .unit import Unit
 
 class Engine:
-    def __init__(self):
+    def __init__(self, stats=None, cache=None):
         """
         Class to contain and operate on the GameState
+        Arguments:
+            - stats: optional EngineStats (see tc1.stats), filled with the
+                time spent in each phase of step and some counters. Without
+                it, nothing is measured.
+            - cache: optional OutcomeCache (see tc1.cache). simulate_round
+                then reuses the outcome of the rounds already simulated from
+                the same board (see GameState.board_hash). The cache can be
+                shared by several engines.
         """
         # The gamestate contains every units, the pv and resources
         self.game_state = GameState()
         # The MapGrpah contains the functions need to move the units
-        self.map_graph = MapGraph()
+        self.map_graph = MapGraph(stats)
         # The DamageEngine is used to compute the damages inflicted by the units
-        self.damage_engine = DamageEngine()
+        self.damage_engine = DamageEngine(stats)
+        self.stats = stats
+        self.cache = cache
         # The grid is only used to vizualize the fight and should not be
-        # called during training
-        self.display_util = Matplotlib_display()
+        # called during training, so it is only created (and matplotlib
+        # imported) when needed. See display_util
+        self._display_util = None
+
+    @property
+    def display_util(self):
+        if self._display_util is None:
+            from .display import Matplotlib_display
+            self._display_util = Matplotlib_display()
+        return self._display_util
 
     def simulate_and_show(self, nstepsmax, savepath=None):
         _logs = []
@@ -25,13 +45,210 @@ class Engine:
             _logs.append(self.game_state.serialize_state())
         self.display_util.animate_logs(_logs, savepath)
 
-    def step(self):
-        """Perform a unique step in the game"""
+    def fork(self):
+        """
+        Return an independent Engine, with a fork of the GameState (see
+        GameState.fork) and of the MapGraph, which keeps the distance maps
+        already computed. The stats are shared.
+        """
+        engine = copy.copy(self)
+        engine.game_state = self.game_state.fork()
+        engine.map_graph = self.map_graph.fork()
+        return engine
+
+    def play_turn(self, s_deploy, a_deploy, max_frames=1000, recorder=None):
+        """
+        Play a full turn: both teams pay for and deploy their units, the
+        action phase is simulated until no information unit remains, then
+        the resources are updated for the next turn (see GameState.deploy
+        and GameState.end_turn).
+        Arguments:
+            - s_deploy, a_deploy: the units deployed by the friendly and the
+                ennemy team, as lists of (unit_name, pos)
+            - max_frames, recorder: see simulate_round
+        Return the RoundResult of the action phase. The game is over when
+        self.game_state.game_over is True. If a deployment is too expensive
+        or misplaced, a ValueError is raised and nothing is deployed or paid
+        by either team.
+        """
+        state = self.game_state
+        if state.game_over:
+            raise ValueError('The game is over')
+        # The deployments are done together: if the ennemy one fails, the
+        # friendly units are removed and refunded, as if nothing happened
+        n_units, bits, cores = len(state.s_units), state.s_bits, state.s_core
+        state.deploy('s', s_deploy)
+        try:
+            state.deploy('a', a_deploy)
+        except ValueError:
+            del state.s_units[n_units:]
+            state.s_bits, state.s_core = bits, cores
+            state.invalidate_hash()
+            state.invalidate_occupancy()
+            raise
+        state, result = self.simulate_round(max_frames, recorder)
+        state.end_turn()
+        return result
+
+    def simulate_round(self, max_frames=1000, recorder=None):
+        """
+        Simulate the round until no information unit remains on the board.
+        The frames where no unit can move or attack are skipped, only the
+        counters of the units are updated.
+        Arguments:
+            - max_frames: maximum number of frames to simulate, as the units
+                that can't reach a border never leave the board
+            - recorder: optional TrajectoryWriter (see tc1.trajectory). The
+                round is added to it, with the initial state as frame 0,
+                then each simulated frame and the last frame (the other
+                skipped frames are not written, see
+                TrajectoryReader.get_frame)
+        Return the final GameState and a RoundResult
+        """
+        state = self.game_state
+        key = None
+        if self.cache is not None and recorder is None:
+            key = (state.board_hash(), max_frames)
+            outcome = self.cache.get(key)
+            if outcome is not None:
+                return state, self._apply_outcome(outcome)
+        result = RoundResult()
+        if recorder is not None:
+            recorder.begin_round()
+            recorder.append(state, 0)
+        recorded = 0 # last frame written
+        while result.n_frames < max_frames:
+            mobile_units = [u for u in state.s_units + state.a_units if u.id < 4]
+            if not mobile_units:
+                break
+            # Number of frames before the next move of a unit
+            n_static = min(u.speed - 1 - u.n_turns_static for u in mobile_units)
+            n_static = min(n_static, max_frames - result.n_frames)
+            if n_static > 0 and not self.damage_engine.has_targets(state):
+                state.invalidate_hash()
+                for u in mobile_units:
+                    u.n_turns_static += n_static
+                result.n_frames += n_static
+                if self.stats is not None:
+                    self.stats.count('frames_skipped', n_static)
+                continue
+            self.step(result)
+            if recorder is not None:
+                recorder.append(state, result.n_frames)
+                recorded = result.n_frames
+        if recorder is not None and recorded != result.n_frames:
+            # the round ended with skipped frames, write its last frame
+            recorder.append(state, result.n_frames)
+        result.finish(state)
+        if key is not None:
+            units = (tuple([u.record() for u in state.s_units]),
+                    tuple([u.record() for u in state.a_units]))
+            self.cache.put(key, (result.copy(), units))
+        return state, result
+
+    def _apply_outcome(self, outcome):
+        """
+        Put the game state at the end of a round found in the cache, and
+        return a copy of its RoundResult
+        """
+        result, (s_records, a_records) = outcome
+        state = self.game_state
+        state.s_units = [Unit.from_record(r) for r in s_records]
+        state.a_units = [Unit.from_record(r) for r in a_records]
+        state.invalidate_hash()
+        state.invalidate_occupancy()
+        # the units that scored during the round
+        state.a_health -= result.s_scores
+        state.s_health -= result.a_scores
+        return result.copy()
+
+    def step(self, result=None):
+        """
+        Perform a unique step in the game. If a RoundResult is given, the
+        events of the step are added to it.
+        """
+        # the units are modified in place, the board hash must be recomputed
+        self.game_state.invalidate_hash()
+        if self.stats is not None:
+            return self._timed_step(result)
         # Start by moving the units
-        self.map_graph(self.game_state)
+        events = self.map_graph(self.game_state)
         # Apply the damages
-        self.damage_engine(self.game_state)
+        damages = self.damage_engine(self.game_state, events)
         # Remove the dead units
         self.game_state.remove_dead_units()
+        if result is not None:
+            result.add_frame(events, damages)
+
+    def _timed_step(self, result):
+        """Same as step, measuring each phase in self.stats"""
+        stats, state = self.stats, self.game_state
+        t0 = perf_counter()
+        events = self.map_graph(state)
+        t1 = perf_counter()
+        damages = self.damage_engine(state, events)
+        t2 = perf_counter()
+        n_units = len(state.s_units) + len(state.a_units)
+        state.remove_dead_units()
+        t3 = perf_counter()
+        stats.add_time('move', t1 - t0)
+        stats.add_time('damage', t2 - t1)
+        stats.add_time('remove', t3 - t2)
+        stats.count('frames')
+        stats.count('units_removed', n_units - len(state.s_units) - len(state.a_units))
+        if result is not None:
+            result.add_frame(events, damages)
+
+
+class RoundResult:
+    def __init__(self):
+        """
+        Aggregated results of a round simulated with Engine.simulate_round.
+        The s_ (resp. a_) values are the ones of the friendly (resp. ennemy)
+        team:
+            - n_frames: number of frames simulated
+            - s_damage, a_damage: damages inflicted by the team
+            - s_scores, a_scores: number of units of the team that reached
+                the ennemy border
+            - score_events: list of (frame, team, position) for each score
+            - s_firewalls, a_firewalls: number of defensive units of the team
+                still standing at the end of the round
+        """
+        self.n_frames = 0
+        self.s_damage = 0
+        self.a_damage = 0
+        self.s_scores = 0
+        self.a_scores = 0
+        self.score_events = []
+        self.s_firewalls = 0
+        self.a_firewalls = 0
+
+    def add_frame(self, events, damages):
+        """Add the events and damages returned by MapGraph and DamageEngine"""
+        self.n_frames += 1
+        for team, team_events in zip(['s', 'a'], events):
+            for e in team_events:
+                if e[0] == 'score':
+                    self.score_events.append((self.n_frames, team, e[1]))
+        self.s_scores += sum(e[0] == 'score' for e in events[0])
+        self.a_scores += sum(e[0] == 'score' for e in events[1])
+        self.s_damage += damages[0]
+        self.a_damage += damages[1]
+
+    def copy(self):
+        """Return an independent copy of the result"""
+        result = copy.copy(self)
+        result.score_events = list(self.score_events)
+        return result
+
+    def finish(self, state):
+        """Count the defensive units still standing"""
+        self.s_firewalls = sum(u.id > 3 for u in state.s_units)
+        self.a_firewalls = sum(u.id > 3 for u in state.a_units)
+
+    def __repr__(self):
+        return ('RoundResult(n_frames={}, scores={}/{}, damage={}/{}, firewalls={}/{})'
+                .format(self.n_frames, self.s_scores, self.a_scores, self.s_damage,
+                    self.a_damage, self.s_firewalls, self.a_firewalls))
 
 
@@ -0,0 +1,84 @@
+"""
+Static geometry of the board: the diamond map in the padded 30x30 grid,
+its borders, the neighbours of each node and the distance of the nodes to
+the edges. It only depends on the size of the board, so it is computed
+once at import in GEOMETRY and shared by the whole package (bfs,
+MapGraph, GameState, the damages and the display). Nothing in it may be
+modified: the arrays are read-only and the other tables are tuples.
+The nodes are given either by their position (x, y) or by their flat
+index x * 30 + y.
+"""
+import numpy as np
+from types import MappingProxyType
+
+PADDED_GRID_SIZE = 30
+
+
+def _read_only(a):
+    a.flags.writeable = False
+    return a
+
+
+class BoardGeometry:
+    def __init__(self, size=PADDED_GRID_SIZE):
+        """
+        Precompute the tables of a board in a padded grid of the given size:
+            - outside: boolean (size, size) mask of the nodes outside of the
+                map, in_map being its negation
+            - grid_template: int8 (size, size) grid with -1 outside of the
+                map and 0 in the map, the empty grid of MapGraph and of the
+                display
+            - border_cells, border_nodes: positions and flat indices of the
+                nodes of each border, by border id. Borders are denoted 2
+                and 3 for ennemy borders and 4 and 5 for friendly borders
+            - borders: boolean (4, size, size) masks of the borders, stacked
+                in the order 2, 3, 4, 5 for the batched kernels
+            - friendly_borders, ennemy_borders: positions of the nodes of
+                the borders of each team, where its information units are
+                deployed
+            - neighbours: for each flat index, the flat indices of its
+                neighbours in the map (none for the nodes outside of it)
+            - edge_distance: int (size, size) distance of each node to the
+                closest vertical edge, used to break the ties when choosing
+                a target
+        """
+        half = size // 2
+        self.size = size
+        xs = np.indices((size, size))[0]
+        # carve the diamond: the rows are 2 nodes wider at each step towards
+        # the middle of the grid
+        outside = np.ones((size, size), dtype=bool)
+        for i in range(half):
+            for j in range(half - i, half + i):
+                outside[i, j] = False
+                outside[size - i - 1, j] = False
+        self.outside = _read_only(outside)
+        self.in_map = _read_only(~outside)
+        self.grid_template = _read_only(np.where(outside, -1, 0).astype(np.int8))
+
+        r = range(1, half)
+        self.border_cells = MappingProxyType({
+                2: tuple((size - 1 - i, half - 1 + i) for i in r),
+                3: tuple((i, half - 1 + i) for i in r),
+                4: tuple((half - i, i) for i in r),
+                5: tuple((half - 1 + i, i) for i in r)})
+        self.border_nodes = MappingProxyType({border_id: tuple(x * size + y for x, y in cells)
+                for border_id, cells in self.border_cells.items()})
+        borders = np.zeros((4, size * size), dtype=bool)
+        for i, border_id in enumerate([2, 3, 4, 5]):
+            borders[i, self.border_nodes[border_id]] = True
+        self.borders = _read_only(borders.reshape(4, size, size))
+        self.friendly_borders = self.border_cells[4] + self.border_cells[5]
+        self.ennemy_borders = self.border_cells[3] + self.border_cells[2]
+
+        # only the nodes of the map have neighbours, and only in the map
+        neighbours = [() for _ in range(size * size)]
+        for x, y in zip(*np.nonzero(~outside)):
+            neighbours[x * size + y] = tuple(int((x+dx) * size + y+dy)
+                    for dx, dy in [(-1,0), (1,0), (0, -1), (0, 1)]
+                    if not outside[x+dx, y+dy])
+        self.neighbours = tuple(neighbours)
+        self.edge_distance = _read_only(np.minimum(xs, size - xs))
+
+
+GEOMETRY = BoardGeometry()
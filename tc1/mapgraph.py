@@ -1,169 +1,314 @@
-from matplotlib import pyplot as plt
+import copy
 import numpy as np
-from queue import Queue
+from . import bfs
+from .geometry import GEOMETRY, PADDED_GRID_SIZE
+from .damage import SHIELD, shield_masks
+from .unit_desc import UNITS_BY_ID
+
+# The units that self-destruct only damage the ennemies if they moved at
+# least this number of times
+SELF_DESTRUCT_MIN_MOVES = 5
+# The directions prefered for the deepest position of each target border:
+# for the border 2, the big y coordinates, then the big x coordinates
+DEEPEST_DIRECTIONS = {2:(1,1), 3:(-1,1), 4:(-1,-1), 5:(1,-1)}
 
 class MapGraph:
-    def __init__(self):
-        self.INTMAX = 30 * 30 + 1 # max dist in graph
-        self._make_grid()
-
-    def _make_grid(self):
-        """
-        Create the internal grid used for BFS
-        Empty nodes are denoted with a 0
-        Node outside of the map are denoted with -1
-        Borders are denoted 2 and 3 for ennemy borders and
-        3 and 5 for friendly borders
-        """
-        self.PADDED_GRID_SIZE = 30
-        self._grid_template = -1 * np.ones((self.PADDED_GRID_SIZE,
-            self.PADDED_GRID_SIZE))
-        self._dtemplate= -1 * np.ones((self.PADDED_GRID_SIZE,
-            self.PADDED_GRID_SIZE))
-
-        # carve the grid
-        for i in range(15):
-            for j in range(15 - i, 15 + i):
-                self._grid_template[i,j] = 0
-                self._grid_template[30 - i - 1, j] = 0
-                self._dtemplate[i,j] = self.INTMAX
-                self._dtemplate[30 - i - 1, j] = self.INTMAX
+    def __init__(self, stats=None):
+        """
+        Move the units along the shortest paths to their target border.
+        Arguments:
+            - stats: optional EngineStats, counting the BFS runs and the
+                self-destruct fallbacks
+        """
+        self.stats = stats
+        self.INTMAX = bfs.INTMAX # max dist in graph
+        self.PADDED_GRID_SIZE = PADDED_GRID_SIZE
+        # The internal grid used for BFS is a copy of the empty grid of the
+        # board (see update_state): empty nodes are denoted with a 0, nodes
+        # outside of the map with -1
+        self._grid_template = GEOMETRY.grid_template
+        # Nodes blocked when the distance maps were computed, used to know
+        # if the maps must be updated
+        self._blocked = None
+        self._layout_key = None
+        # Shield masks of the layouts of encryptors already seen, see _shields
+        self._shield_cache = {}
+        self._clear_caches()
+
+    def _clear_caches(self):
+        """
+        Forget everything that depends on the defensive units. Must be called
+        each time the distance maps change.
+        """
+        # Next move of the units, see get_direction
+        self._next_moves = {}
+        # Connected components of the free nodes, see _get_component
+        self._labels = None
+        self._components = None
+        # Self-destruction node and its distance map, for each component
+        # and target, see find_deepest_position
+        self._deepest = {}
+
+    def fork(self):
+        """
+        Return a copy of the MapGraph, sharing its distance maps and caches.
+        The shared values are never modified in place: they are replaced
+        when the layout of the defensive units changes, so a fork only pays
+        for the computations when its layout diverges.
+        """
+        return copy.copy(self)
 
     def get_frontier_nodes(self, frontier_id):
         """
-        Return a list of tuple representing the coordinates
-        of the nodes composing a given frontier
-        """
-        # create the first friendly border:
-        if frontier_id == 4:
-            return ((15-i, i) for i in range(1,15))
-        # create the second friendly border:
-        if frontier_id == 5:
-            return ((14+i, i) for i in range(1,15))
-        # create the first ennemy border:
-        if frontier_id == 3:
-            return ((i, 14+i) for i in range(1,15))
-        # create the second ennemy border:
-        if frontier_id == 2:
-            return ((29-i, 14+i) for i in range(1,15))
-        raise ValueError("Wrong border id: {}".format(frontier_id))
+        Return a tuple of tuple representing the coordinates
+        of the nodes composing a given frontier. Borders are denoted 2 and
+        3 for ennemy borders and 4 and 5 for friendly borders
+        """
+        if frontier_id not in GEOMETRY.border_cells:
+            raise ValueError("Wrong border id: {}".format(frontier_id))
+        return GEOMETRY.border_cells[frontier_id]
 
     def get_dijkstra(self, border_id):
         """
-        Apply Dijkstra algorithm to compute, for each node,
-        the minimum distance to a given frontier. This is less
-        efficient than a A* seach for one unit, but the same map
-        can be used by all units.
-        Unreachable nodes are given the value self.MAXINT
-        """
-        q = Queue()
-        distance_graph = self._dtemplate.copy()
-        # Initialize the queue
-        if isinstance(border_id, int): # if we get an int, we're looking for a border
-            initial_nodes = self.get_frontier_nodes(border_id)
-            for n in initial_nodes:
-                # check if the starting node is on a defensive unit
-                if self._grid[n[0], n[1]]:
-                    continue
-                distance_graph[n[0], n[1]] = 0
-                q.put(n)
-        elif isinstance(border_id, tuple): # Looking for a path to a custom node
+        Compute, for each node, the minimum distance to a given frontier
+        (or to a given node if border_id is a tuple). This is less efficient
+        than a A* seach for one unit, but the same map can be used by all
+        units.
+        Unreachable nodes are given the value self.INTMAX
+        """
+        blocked = (self._grid != 0).ravel().tolist()
+        if isinstance(border_id, tuple): # Looking for a path to a custom node
             cx,cy = border_id
             if self._grid[cx,cy]:
                 raise ValueError("Can't compute a path to occupied node ({},{})".format(cx,cy))
-            distance_graph[cx,cy] = 0
-            q.put((cx,cy))
-        # BFS on the graph
-        while not q.empty():
-            nx, ny = q.get()
-            c = distance_graph[nx, ny]
-            for dx, dy in [(-1,0), (1,0), (0, -1), (0, 1)]:
-                # check if the node is occupied by a defense unit
-                if self._grid[nx+dx, ny+dy]:
-                    continue
-                if distance_graph[nx+dx, ny+dy] > c + 1:
-                    distance_graph[nx+dx, ny+dy] = c + 1
-                    q.put((nx+dx, ny+dy))
-        return distance_graph
+            sources = [cx * self.PADDED_GRID_SIZE + cy]
+        else: # if we get an int, we're looking for a border
+            sources = bfs.BORDER_NODES[border_id]
+        distance_graph = bfs.distance_map(blocked, sources, self.stats)
+        return np.reshape(distance_graph, (self.PADDED_GRID_SIZE, self.PADDED_GRID_SIZE))
 
     def update_state(self, state):
         self._grid = self._grid_template.copy()
+        # positions of the encryptors of each team, for the shields
+        self._encryptors = ([], [])
 
         # update for friendly units
         for su in state.s_units:
-            if su['id'] > 3: # only populate grid for defensive units
-                x,y = su['pos']
-                self._grid[x, y] = su['id']
+            if su.id > 3: # only populate grid for defensive units
+                x,y = su.pos
+                self._grid[x, y] = su.id
+                if su.id == 5:
+                    self._encryptors[0].append(su.pos)
 
         # update for ennemy units
         for au in state.a_units:
-            if au['id'] > 3:
-                x,y = au['pos']
-                self._grid[x, y] = 6 + au['id']
+            if au.id > 3:
+                x,y = au.pos
+                self._grid[x, y] = 6 + au.id
+                if au.id == 5:
+                    self._encryptors[1].append(au.pos)
 
     def recompute_distance_maps(self):
         """
         Recompute the distance matrix for each frontier. Must be called
         each time a devensive unit is created/destroyed.
         """
-        self.distance_maps = {i:self.get_dijkstra(i) for i in [2,3,4,5]}
+        self._blocked = self._grid != 0
+        maps = bfs.border_distance_maps(self._blocked, self.stats) # the four maps in one go
+        self.distance_maps = {i:maps[i-2] for i in [2,3,4,5]}
+        self._layout_key = self._blocked.tobytes()
+        self._clear_caches()
+
+    def update_distance_maps(self):
+        """
+        Update the distance maps after a call to update_state. The maps are
+        kept as long as the nodes occupied by defensive units are the same.
+        If some defensive units have been destroyed (and none created), the
+        maps are repaired from the freed nodes instead of being recomputed.
+        """
+        blocked = self._grid != 0
+        layout_key = blocked.tobytes()
+        if layout_key == self._layout_key:
+            return
+        if self._blocked is None or (blocked & ~self._blocked).any():
+            # new defensive units, distances can only increase so we start over
+            self.recompute_distance_maps()
+            return
+        freed = np.flatnonzero(self._blocked & ~blocked).tolist()
+        maps = {}
+        for border_id, distance_graph in self.distance_maps.items():
+            # the maps may be shared with a fork, so we repair a copy
+            distance_graph = distance_graph.copy()
+            bfs.repair_distance_map(distance_graph, blocked, freed,
+                    bfs.BORDER_NODES[border_id], self.stats)
+            maps[border_id] = distance_graph
+        self.distance_maps = maps
+        self._blocked = blocked
+        self._layout_key = layout_key
+        self._clear_caches()
 
     def __call__(self, state):
         """
         Move the units in state according to the rules of the game.
         Should modify state by reference (please ?)
+        Return the lists of the events of the friendly and ennemy units.
         """
-        # we recompute the distance map each time now
         self.update_state(state) # this change the accessible nodes bases on def.
-        self.recompute_distance_maps()
+        self.update_distance_maps() # only does some work if the layout changed
 
-        events = []
-        for s_unit in state.s_units:
-            events += self._move_one(s_unit)
-        for e in events:
+        s_events = self._move_team(state.s_units, self._shields(0))
+        for e in s_events:
             if e[0] == 'score':
                 state.a_health -= 1 # Ennemy lose 1 health point
 
-        events = []
-        for a_unit in state.a_units:
-            events += self._move_one(a_unit)
-        for e in events:
+        a_events = self._move_team(state.a_units, self._shields(1))
+        for e in a_events:
             if e[0] == 'score':
                 state.s_health -= 1 # We lose 1 health point
+        return s_events, a_events
+
+
+    def _shields(self, team):
+        """
+        Return the shield masks of the encryptors of a team, as flat lists
+        (the encryptors covering each node, and a dict giving for each move
+        the encryptors entered at each node, see damage.shield_masks), or
+        None if the team has no encryptor.
+        The masks only depend on the positions of the encryptors, so they
+        are computed once for each layout.
+        """
+        encryptors = self._encryptors[team]
+        if not encryptors:
+            return None
+        key = tuple(encryptors)
+        masks = self._shield_cache.get(key)
+        if masks is None:
+            if len(self._shield_cache) >= 16:
+                # the cache may be shared with a fork, replace it
+                self._shield_cache = {}
+            masks = shield_masks(encryptors)
+            self._shield_cache[key] = masks
+        return masks
 
+    def _move_team(self, units, shields=None):
+        """
+        Move the units of a team, and return the list of their events.
+        The units of a stack (same type, position, target, previous move,
+        counters and shields) move exactly the same way, so when a unit
+        follows an identical one, it just copies its move.
+        If the team has encryptors, the shield masks are given (see
+        _shields) and the units that moved are shielded: each encryptor
+        shields a unit once, when it first enters its range (or on its first
+        move, if it was deployed in range). The encryptors that already
+        shielded a unit are kept in unit.shielded_by, so a unit walking
+        along the edge of a range, in and out of it, is only shielded once.
+        """
+        events = []
+        # key of the previous unit that moved, with the result of its move
+        # (new values, shield and events), copied by the units of its stack
+        previous = None
+        moved = None
+        shield = 0
+        unit_events = []
+        for unit in units:
+            if unit.id > 3:
+                continue
+            key = (unit.id, unit.pos, unit.target, unit.previous_move, unit.n_turns_static,
+                    unit.n_moves, unit.shielded_by)
+            if key == previous:
+                (unit.pos, unit.previous_move, unit.n_turns_static, unit.n_moves,
+                        unit.shielded_by) = moved
+                unit.stability += shield
+                if unit_events:
+                    # it scored or self-destructed, like the previous one
+                    unit.stability = 0
+                    events += unit_events
+                continue
+            unit_events = self._move_one(unit)
+            events += unit_events
+            shield = 0
+            if shields is not None and not unit_events and not unit.n_turns_static:
+                # the unit moved, from the node pos - previous_move
+                cover, enter = shields
+                x, y = unit.pos
+                n = x * self.PADDED_GRID_SIZE + y
+                entered = enter[unit.previous_move][n]
+                if unit.n_moves == 1:
+                    dx, dy = unit.previous_move
+                    entered |= cover[n - dx * self.PADDED_GRID_SIZE - dy]
+                new = entered & ~unit.shielded_by
+                if new:
+                    shield = bin(new).count('1') * SHIELD
+                    unit.stability += shield
+                    unit.shielded_by |= new
+            previous = key
+            moved = (unit.pos, unit.previous_move, unit.n_turns_static, unit.n_moves,
+                    unit.shielded_by)
+        return events
 
     def _move_one(self, unit):
         """
         Move only one unit according to the rules of the game
-        Return a list of events that occured during the move
-        (for now, only a scoring event if the unit reached the border)
+        Return a list of events that occured during the move: a scoring
+        event if the unit reached the border, or a self-destruct event
+        ('self_destruct', position, damages) if it can't reach its border
+        and is already at its deepest position (see find_deepest_position).
+        The damages are the initial stability of the unit if it moved at
+        least SELF_DESTRUCT_MIN_MOVES times, else zero. They are inflicted
+        by the DamageEngine.
         """
         # If the unit is a defensive unit, do nothing
-        if unit['id'] > 3:
+        if unit.id > 3:
             return []
         # Else, we first increment the counter to see if the unit should move:
-        unit['n_turns_static'] += 1
+        unit.n_turns_static += 1
         # Check if it is the right moment to move
-        if unit['n_turns_static'] <  unit['speed']:
+        if unit.n_turns_static <  unit.speed:
            return []
         # The unit can move. First, reinitialize its counter to zero
-        unit['n_turns_static'] = 0
+        unit.n_turns_static = 0
         # Now it the unit is at a distance 0 of its border, it scores.
         # The unit is deleted and we return the event 'scored' to recognize
         # that (along with the last position of the unit)
         # We also put the life of the unit to zero so that it can be removed later
-        dmat = self.distance_maps[unit['target']]
-        last_x, last_y = unit['pos']
+        dmat = self.distance_maps[unit.target]
+        last_x, last_y = unit.pos
         if not dmat[last_x, last_y]: # true if zero
-            last_x, last_y = unit['pos']
-            unit['stability'] = 0
+            last_x, last_y = unit.pos
+            unit.stability = 0
             return [('score', (last_x, last_y))]
+        # If the unit can't reach its border and has nowhere deeper to go,
+        # it self-destructs
+        if dmat[last_x, last_y] == self.INTMAX and self.find_deepest_position(unit) == unit.pos:
+            unit.stability = 0
+            damage = 0
+            if unit.n_moves >= SELF_DESTRUCT_MIN_MOVES:
+                damage = UNITS_BY_ID[unit.id]['stability']
+            return [('self_destruct', unit.pos, damage)]
         # else we just move the unit according to the direction algorithm
         new_x, new_y = self.get_direction(unit)
-        unit['pos'] = (new_x, new_y)
+        unit.pos = (new_x, new_y)
+        unit.n_moves += 1
         return []
 
 
+    def _get_component(self, pos):
+        """
+        Return a key identifying the connected component of the free nodes
+        that contains pos, and the list of its nodes. The components are
+        labelled once for each layout of the defensive units.
+        A unit can stand on a blocked node (when it has been deployed on a
+        defensive unit), it then reaches the components of its neighbours.
+        """
+        if self._labels is None:
+            blocked = (self._grid != 0).ravel().tolist()
+            self._labels, self._components = bfs.label_components(blocked)
+        n = pos[0] * self.PADDED_GRID_SIZE + pos[1]
+        if self._labels[n]:
+            return self._labels[n], self._components[self._labels[n]]
+        labels = tuple(sorted(set(self._labels[m] for m in bfs.NEIGHBOURS[n]) - {0}))
+        return labels, [m for label in labels for m in self._components[label]]
+
     def find_deepest_position(self, unit):
         """
         Find the deepest position into the ennemy territory to self-destruct
@@ -171,49 +316,73 @@ class MapGraph:
              The deepest location is the location with the furthest Y coordinate
              from your territory. If multiple such locations are reachable, the
              Unit will choose the one closest to its target
+        The result only depends on the component of the unit and its target,
+        so it is memorized along with the distance map to this position.
         """
-        # For now, we do a BFS to find all the accessible nodes, before picking the
-        # best one. We don't memorize the result, so there might be efficiency issues
-        q = Queue(); q.put(unit['pos']); visited = set(); bestx, besty = unit['pos']
-        while not q.empty():
-            x,y = q.get()
-            for dx, dy in [(0,1), (0,-1), (1,0), (-1,0)]:
-                if self._grid[x+dx,y+dy] or (x+dx, y+dy) in visited:
-                    continue
-                q.put((x+dx, y+dy)); visited.add((x+dx, y+dy))
-        # Now find the best node by iterating on the set of visited nodes
-        prefered_directions = {
-                2:(1,1), # If target border is 2, we prefer the big x and y coordinates
-                3:(-1,1), 4:(-1,-1), 5:(1,-1)
-                }
-        px,py = prefered_directions[unit['target']]
-        for sx,sy in visited:
-            if sy*py > besty*py: # The y coordinate has priority when selecting the best node
-                besty = sy; bestx = sx
-            elif sy == besty:
-                if sx*px > bestx*px: # If equality on y coordinate, look for best x
-                    bestx = sx
-        return bestx, besty
+        return self._self_destruct_target(unit)[0]
+
+    def _self_destruct_target(self, unit):
+        """
+        Return the deepest position for a unit (see find_deepest_position)
+        and the distance map to this position (None if the unit is stuck on
+        a blocked node, it then self-destructs where it is).
+        """
+        label, nodes = self._get_component(unit.pos)
+        if not nodes: # the unit is on a blocked node, with no free neighbour
+            return unit.pos, None
+        key = (label, unit.target)
+        if key not in self._deepest:
+            px,py = DEEPEST_DIRECTIONS[unit.target]
+            # The y coordinate has priority when selecting the best node,
+            # then the x coordinate
+            best = max(nodes, key=lambda n: (n % self.PADDED_GRID_SIZE * py,
+                n // self.PADDED_GRID_SIZE * px))
+            bestx, besty = divmod(best, self.PADDED_GRID_SIZE)
+            self._deepest[key] = ((bestx, besty), self.get_dijkstra((bestx, besty)))
+        return self._deepest[key]
 
     def get_direction(self, unit):
         """
         Return a couple (x,y) giving the optimal mouvement for
         a unit, according to the games rules.
+        The move only depends on the position, the target and the direction
+        of the previous move (none, vertical or horizontal), so it is
+        memorized until the defensive units change. Stacked units walking
+        the same path only compute it once.
+        """
+        cx, cy = unit.pos
+        prev = unit.previous_move
+        key = (cx, cy, unit.target, None if prev is None else abs(prev[0]))
+        move = self._next_moves.get(key)
+        if move is None:
+            move = self._compute_move(unit)
+            self._next_moves[key] = move
+        unit.previous_move = move # to know where to move next turn
+        return (cx + move[0], cy + move[1])
+
+    def _compute_move(self, unit):
+        """
+        Return the optimal move (dx,dy) for a unit, according to the games
+        rules.
         For now, undefined behavior when the frontier is not accessible
         """
-        cx, cy = unit['pos']
+        cx, cy = unit.pos
         # First, check if the target border is accessible
-        target_border = unit['target']
+        target_border = unit.target
         d_map = self.distance_maps[target_border]
         # If our position on the distance map is +inf, then we can't access
         # the target border and we must find a place to self destruct
         if d_map[cx, cy] == self.INTMAX:
-            # We find the deepest accessible position
-            tx, ty = self.find_deepest_position(unit)
-            d_map = self.get_dijkstra((tx, ty))
+            # We find the deepest accessible position, and the distance to it
+            _, d_map = self._self_destruct_target(unit)
+            if self.stats is not None:
+                self.stats.count('deepest_fallbacks')
         # Now that we get the distance map, we can find the prefered movement
         # according to the rules
         mindist = self.INTMAX
+        # a unit deployed on a defensive unit can have unreachable neighbours
+        # (in another component) before the first reachable one
+        possible_deltas = []
         for dx, dy in [(1,0), (-1,0), (0,1), (0,-1)]:
             if self._grid[cx+dx, cy+dy]: # non accessible node
                 continue
@@ -225,30 +394,27 @@ class MapGraph:
 
         # If we only have one choice, we don't have any more things to consider:
         if len(possible_deltas) == 1:
-            DX,DY = possible_deltas[0]
-            unit['previous_move'] = (DX,DY) # to know where to move next turn
-            return (cx+DX, cy+DY)
+            return possible_deltas[0]
 
         # Else, we move in the another direction than the previous move
         # Case 1: "In the case where a Unit has just been deployed and has
         # yet to move, it will prefer a vertical movement."
-        if unit['previous_move'] is None:
-            vertical_deltas = [(dx,dy) for dx,dy in possible_deltas if dx==0]
-            assert len(vertical_deltas) == 1 # should always be verified ?
-            DX,DY = vertical_deltas[0]
-            unit['previous_move'] = (DX,DY) # to know where to move next turn
-            return (cx+DX, cy+DY)
-
+        if unit.previous_move is None:
+            prefered_deltas = [(dx,dy) for dx,dy in possible_deltas if dx==0]
         # Case 2: If multiple tiles are equally close to the units destination,
         # move in the opposite direction of the previous movement. For example,
         # if the Unit made a vertical move on its previous step, it will prefer
         # a horizontal move.
-        aodx = abs(unit['previous_move'][0]) # 1 if last move was horizontal
-        prefered_deltas = [(dx,dy) for dx,dy in possible_deltas if abs(dx)!=aodx]
+        else:
+            aodx = abs(unit.previous_move[0]) # 1 if last move was horizontal
+            prefered_deltas = [(dx,dy) for dx,dy in possible_deltas if abs(dx)!=aodx]
         if len(prefered_deltas) == 1:
-            DX,DY = prefered_deltas[0]
-            unit['previous_move'] = (DX,DY)
-            return (cx+DX, cy+DY)
+            return prefered_deltas[0]
+        # The closest tiles can all be in the direction that isn't prefered
+        # (e.g. left and right after a horizontal move), then they are
+        # equally prefered
+        if not prefered_deltas:
+            prefered_deltas = possible_deltas
 
         # Case 3: This on is super edgy..
         # If there are two tiles with equal distances and are equally prefered
@@ -262,17 +428,20 @@ class MapGraph:
                 3:[(0,1), (-1,0)],
                 4:[(0,-1), (-1,0)],
                 5:[(0,-1), (1,0)]}
-        for px,py in PREFERED_LOC[unit['target']]:
+        for px,py in PREFERED_LOC[unit.target]:
             if (px,py) in prefered_deltas:
-                unit['previous_move'] = (px,py)
-                return (cx+px, cy+py)
-        raise ValueError("Give up on position {},{}".format(cx,cy))
+                return (px,py)
+        # None of the closest tiles is in the direction of the target edge,
+        # then the first one is chosen, in the order the neighbours are
+        # scanned, instead of giving up
+        return prefered_deltas[0]
 
     def debug_print(self, grid_type):
         """
         gridtype = 0 for original map and other integer foe
         distance maps
         """
+        from matplotlib import pyplot as plt # only needed to debug
         if grid_type == 0:
             M = self._grid
         else:
@@ -0,0 +1,96 @@
+"""
+Dense observations of the board for the agents: a stack of 30x30 planes
+(in the padded notation) describing the units of both teams and the
+distance maps of the current layout. See CHANNELS for the planes.
+"""
+import numpy as np
+from .bfs import PADDED_GRID_SIZE
+from .mapgraph import MapGraph
+from .unit_desc import UNITS_BY_ID
+
+TEAMS = ['s', 'a']
+N_UNIT_TYPES = len(UNITS_BY_ID) - 1
+
+# Names of the planes, in order:
+#   - <unit name>_<team>: number of units of this type on the node
+#   - stability_<team>: total stability of the units of the team on the node
+#   - n_turns_static_<team>: total of the speed counters of the information
+#       units of the team on the node
+#   - dist_<border>: the distance map to the border, as in MapGraph (INTMAX
+#       for the unreachable nodes, -1 outside of the map)
+CHANNELS = ['{}_{}'.format(d['name'], team) for team in TEAMS for d in UNITS_BY_ID[1:]]
+CHANNELS += ['stability_s', 'stability_a', 'n_turns_static_s', 'n_turns_static_a']
+CHANNELS += ['dist_{}'.format(border) for border in [2, 3, 4, 5]]
+N_CHANNELS = len(CHANNELS)
+OBSERVATION_SHAPE = (N_CHANNELS, PADDED_GRID_SIZE, PADDED_GRID_SIZE)
+
+# Offset of the first plane of each group of channels
+STABILITY = CHANNELS.index('stability_s')
+N_TURNS_STATIC = CHANNELS.index('n_turns_static_s')
+DIST = CHANNELS.index('dist_2')
+
+
+class ObservationBuilder:
+    def __init__(self, dtype=np.float32):
+        """
+        Write the observations of GameStates into preallocated arrays of
+        shape OBSERVATION_SHAPE. The builder keeps a MapGraph, so the distance
+        maps are only recomputed when the defensive units change, and it
+        should be reused from one step to the next.
+        Arguments:
+            - dtype: type of the arrays created when no output is given
+        """
+        self.dtype = dtype
+        self.map_graph = MapGraph()
+
+    def new_buffer(self, n=None):
+        """Return a zero array for one observation, or a batch of n observations"""
+        shape = OBSERVATION_SHAPE if n is None else (n,) + OBSERVATION_SHAPE
+        return np.zeros(shape, dtype=self.dtype)
+
+    def build(self, state, out=None):
+        """
+        Write the observation of a GameState into out (an array of shape
+        OBSERVATION_SHAPE), and return it. Without out, a new
+        array is created.
+        """
+        if out is None:
+            out = self.new_buffer()
+        out[:DIST] = 0
+        # out is indexed directly, so that it can also be a view which is
+        # not contiguous (a flattened view would silently be a copy)
+        for t, units in enumerate([state.s_units, state.a_units]):
+            for u in units:
+                x, y = u.pos
+                out[t * N_UNIT_TYPES + u.id - 1, x, y] += 1
+                out[STABILITY + t, x, y] += u.stability
+                if u.id < 4:
+                    out[N_TURNS_STATIC + t, x, y] += u.n_turns_static
+        self.map_graph.update_state(state)
+        self.map_graph.update_distance_maps()
+        for i, border in enumerate([2, 3, 4, 5]):
+            out[DIST + i] = self.map_graph.distance_maps[border]
+        return out
+
+    def build_batch(self, states, out=None):
+        """
+        Write the observations of a list of GameStates into out (an array of
+        shape (len(states),) + OBSERVATION_SHAPE), and return it.
+        """
+        if out is None:
+            out = self.new_buffer(len(states))
+        for state, obs in zip(states, out):
+            self.build(state, obs)
+        return out
+
+
+# Builder used by GameState.to_tensor when none is given, see default_builder
+_DEFAULT_BUILDER = None
+
+
+def default_builder():
+    """Return the ObservationBuilder shared by the calls to GameState.to_tensor"""
+    global _DEFAULT_BUILDER
+    if _DEFAULT_BUILDER is None:
+        _DEFAULT_BUILDER = ObservationBuilder()
+    return _DEFAULT_BUILDER
@@ -0,0 +1,82 @@
+import multiprocessing
+from functools import partial
+from .codec import decode_state, encode_state
+from .engine import Engine
+
+# Engine of the worker process, created once by _init_worker and reused
+# for all the candidates evaluated by this worker
+_ENGINE = None
+
+
+def _init_worker():
+    global _ENGINE
+    _ENGINE = Engine()
+
+
+def _evaluate(base, max_frames, deployment):
+    """
+    Deploy the units of a candidate on the base state (given as bytes) and
+    simulate the round. Return the RoundResult, or None if a unit of the
+    candidate can't be deployed (the other candidates are still evaluated).
+    """
+    if _ENGINE is None: # in process evaluation
+        _init_worker()
+    state = decode_state(base)
+    try:
+        for team, unit_name, pos in deployment:
+            state.add_unit(team, unit_name, pos)
+    except ValueError:
+        return None # invalid candidate
+    _ENGINE.game_state = state
+    _, result = _ENGINE.simulate_round(max_frames)
+    return result
+
+
+class RolloutPool:
+    def __init__(self, n_workers=None, max_frames=1000):
+        """
+        Evaluate many candidate deployments from the same state in parallel.
+        Each worker process keeps its own Engine, and the states are sent to
+        the workers in the binary form of tc1.codec.
+        Arguments:
+            - n_workers: number of worker processes (default to the number of
+                cores). With 0, the candidates are evaluated in this process.
+            - max_frames: maximum number of frames of each round
+        """
+        if n_workers is None:
+            n_workers = multiprocessing.cpu_count()
+        self.n_workers = n_workers
+        self.max_frames = max_frames
+        self._pool = None
+        if n_workers > 0:
+            self._pool = multiprocessing.Pool(n_workers, initializer=_init_worker)
+
+    def evaluate(self, state, deployments):
+        """
+        Simulate a round for each candidate deployment.
+        Arguments:
+            - state: the GameState before the deployment, it is not modified
+            - deployments: list of candidates, each candidate being a list of
+                (team, unit_name, pos) as given to GameState.add_unit
+        Return the list of the RoundResult of the candidates, in order. The
+        result of a candidate with a misplaced unit is None.
+        """
+        run = partial(_evaluate, encode_state(state), self.max_frames)
+        if self._pool is None:
+            return [run(d) for d in deployments]
+        # big chunks, to send the base state as few times as possible
+        chunksize = max(1, len(deployments) // (4 * self.n_workers))
+        return self._pool.map(run, deployments, chunksize)
+
+    def close(self):
+        """Stop the worker processes"""
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
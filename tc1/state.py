@@ -1,16 +1,122 @@
-from .unit_desc import UNITS_DESC
-from copy import deepcopy
+import numpy as np
+from .geometry import GEOMETRY, PADDED_GRID_SIZE
+from .unit_desc import UNITS_BY_ID, UNITS_DESC
+from .unit import MOVES, Unit
+from collections.abc import Mapping
+
+# The board hash is the sum, modulo 2**64, of the keys of the units
+HASH_MASK = 2 ** 64 - 1
+# Fixed random keys of the units by team and id, drawn from a seeded
+# generator so that they never change (see _unit_key), and the (odd)
+# multiplier mixing the other values of the units into them
+_UNIT_KEYS = {team: [int(k) for k in keys] for team, keys in
+    zip('sa', np.random.RandomState(0x7C1).randint(0, HASH_MASK, (2, len(UNITS_BY_ID)), dtype=np.uint64))}
+_MIX_MULTIPLIER = 0x9E3779B97F4A7C15
+_MERSENNE_61 = 2 ** 61 - 1
+# Previous moves are mixed as their index in MOVES
+_MOVE_INDEX = {move: i for i, move in enumerate(MOVES)}
+
+def _make_placement_masks():
+    """
+    Return the nodes where each team can deploy its units, ignoring the
+    occupied nodes: PLACEMENT_MASKS[team][True] for the information units
+    (the borders of the team), PLACEMENT_MASKS[team][False] for the
+    defensive units (the half of the map of the team). The masks are
+    (30, 30) read-only boolean arrays in the padded notation.
+    """
+    in_map, borders = GEOMETRY.in_map, GEOMETRY.borders
+    y = np.arange(PADDED_GRID_SIZE)[None, :]
+    masks = {
+            's': {True: borders[2] | borders[3], False: in_map & (y < 15)},
+            'a': {True: borders[0] | borders[1], False: in_map & (y > 14)}}
+    for team_masks in masks.values():
+        for mask in team_masks.values():
+            mask.flags.writeable = False
+    return masks
+
+PLACEMENT_MASKS = _make_placement_masks()
+# The same nodes as sets of positions, for the checks of add_unit
+_PLACEMENT_CELLS = {team: {info: frozenset(zip(*[c.tolist() for c in np.nonzero(mask)]))
+    for info, mask in team_masks.items()} for team, team_masks in PLACEMENT_MASKS.items()}
+# And as arrays indexed by unit id (the rows), then by the flat index of
+# the node in the grid padded with one more node on each side (so that the
+# positions out of the grid can be clipped to it), for the checks of
+# add_units
+_PAD = PADDED_GRID_SIZE + 2
+_PLACEMENT_TABLES = {team: np.pad(np.array([team_masks[unit_id < 4] for unit_id in range(len(UNITS_BY_ID))]),
+    ((0, 0), (1, 1), (1, 1))).reshape(len(UNITS_BY_ID), -1) for team, team_masks in PLACEMENT_MASKS.items()}
+_FREE_TEMPLATE = np.pad(GEOMETRY.in_map, 1)
+_STRIDES = np.array([_PAD, 1])
+_STABILITIES = [0] + [d['stability'] for d in UNITS_BY_ID[1:]]
+# The units can be given to add_units by name or by id
+_UNIT_IDS = {name: d['id'] for name, d in UNITS_DESC.items()}
+_UNIT_IDS.update({d['id']: d['id'] for d in UNITS_DESC.values()})
+
+def _new_units(team, ids, positions):
+    """
+    Return the new units of a team, given their ids and positions, built
+    without the checks of Unit.__init__ (see GameState.add_units)
+    """
+    # target borders, as in add_unit
+    targets = (2, 3) if team == 's' else (5, 4)
+    new = Unit.__new__
+    units = []
+    for unit_id, pos in zip(ids, positions):
+        unit = new(Unit)
+        unit.id = unit_id
+        unit.pos = pos
+        unit.stability = _STABILITIES[unit_id]
+        unit.target = targets[pos[0] >= 15] if unit_id < 4 else None
+        unit.previous_move = None
+        unit.n_turns_static = 0
+        unit.n_moves = 0
+        unit.shielded_by = 0
+        units.append(unit)
+    return units
+
+def _unit_key(team, order, unit):
+    """
+    Key of a unit in the board hash, depending on all its values and on its
+    order in its team. The key of the team and id of the unit is read in
+    the seeded table _UNIT_KEYS, then the other values are mixed into it
+    with a multiply-xorshift. Unlike hash(), which is randomized for the
+    strings and None, the keys are the same in every process and every run,
+    so the hashes can be shared with the workers or saved.
+    """
+    x, y = unit.pos
+    h = _UNIT_KEYS[team][unit.id]
+    # the small values are packed together to mix fewer values: the targets
+    # are below 6, the moves below 5, and the units wait less than 64 frames
+    # between two moves
+    node = ((x * 30 + y) * 6 + (unit.target or 0)) * 5 + _MOVE_INDEX[unit.previous_move]
+    # the encryptors that shielded the unit are folded on 61 bits
+    for value in (order, node, unit.stability, unit.n_moves * 64 + unit.n_turns_static,
+            unit.shielded_by % _MERSENNE_61):
+        h = (h ^ value) * _MIX_MULTIPLIER & HASH_MASK
+        h ^= h >> 29
+    return h
+
+def _keys_sum(team, units, start=0):
+    """Sum of the keys of the units, the first one being at the order start"""
+    return sum([_unit_key(team, order, u) for order, u in enumerate(units, start)])
 
 class GameState:
     def __init__(self, testmode=False):
         self.INITIALE_HEALTH = 30
         self.INITIALE_CORE = 5
         self.INITIALE_BITS = 6
+        # Resources given at the end of each turn. The bits given grow by
+        # one every BITS_GROWTH_PERIOD turns, and a part of the bits that
+        # were not spent decays at the end of each turn
+        self.CORES_PER_TURN = 4
+        self.BITS_PER_TURN = 5
+        self.BITS_GROWTH_PERIOD = 10
+        self.BITS_DECAY = 0.25
 
-        self.FRIENDLY_BORDERS = [(15-i, i) for i in range(1,15)]
-        self.FRIENDLY_BORDERS += [(14+i, i) for i in range(1,15)]
-        self.ENNEMY_BORDERS = [(i, 14+i) for i in range(1,15)]
-        self.ENNEMY_BORDERS += [(29-i, 14+i) for i in range(1,15)]
+        # The nodes where each team deploys its information units, shared
+        # by all the states (see tc1.geometry)
+        self.FRIENDLY_BORDERS = GEOMETRY.friendly_borders
+        self.ENNEMY_BORDERS = GEOMETRY.ennemy_borders
 
         self.s_health = self.INITIALE_HEALTH
         self.a_health = self.INITIALE_HEALTH
@@ -24,22 +130,164 @@ class GameState:
         self.s_units = []
         self.a_units = []
 
+        # Number of turns played, see Engine.play_turn
+        self.turn = 0
+
+        # Hash of the units, see board_hash. None when it is not known
+        self._board_hash = None
+        # Number of defensive units on each occupied node, and the mask of
+        # the free nodes, see legal_placements. None when they are not known
+        self._occupancy = None
+        self._free = None
+
         self.testmode = testmode
 
+    @property
+    def game_over(self):
+        """True when a team has no more health"""
+        return self.s_health <= 0 or self.a_health <= 0
+
     def serialize_state(self):
         """
-        Serialize the current state of the game
+        Serialize the current state of the game. The result is a frozen
+        Snapshot that can be read like a dictionnary, and won't change when
+        the game continues.
         """
-        dct = { 's_health':self.s_health,
-                'a_health':self.a_health,
-                's_core':self.s_core,
-                'a_core':self.a_core,
-                's_bits':self.s_bits,
-                'a_bits':self.a_bits,
-                's_units':self.s_units,
-                'a_units':self.a_units}
+        return Snapshot(self)
 
-        return deepcopy(dct)
+    def board_hash(self):
+        """
+        Return a 64 bits hash of the units on the board. Like a Zobrist hash,
+        each unit adds a key, so that the hash can be updated when units are
+        added or removed. The key of a unit depends on its order in its team:
+        the units attack in this order, each one seeing the damages of the
+        previous ones, and the order breaks the targeting ties, so the same
+        units in another order can give another round.
+        The hash is updated by add_unit, add_units and remove_dead_units.
+        When the units are modified directly (as done by Engine.step),
+        invalidate_hash must be called, and the hash is computed again from
+        scratch the next time it is needed.
+        """
+        if self._board_hash is None:
+            keys = _keys_sum('s', self.s_units) + _keys_sum('a', self.a_units)
+            self._board_hash = keys & HASH_MASK
+        return self._board_hash
+
+    def invalidate_hash(self):
+        """Forget the board hash, after the units were modified"""
+        self._board_hash = None
+
+    def fork(self):
+        """
+        Return an independent copy of the state, much faster than deepcopy.
+        The values and the units are copied, the constant tables (like the
+        borders) are shared.
+        """
+        state = self.__class__.__new__(self.__class__)
+        state.__dict__.update(self.__dict__)
+        state.s_units = [u.copy() for u in self.s_units]
+        state.a_units = [u.copy() for u in self.a_units]
+        if self._occupancy is not None:
+            state._occupancy = dict(self._occupancy)
+        return state
+
+    def checkpoint(self):
+        """
+        Return a checkpoint of the state, to go back to it later with
+        restore. The checkpoint is a Snapshot, so it never changes.
+        """
+        return Snapshot(self)
+
+    def restore(self, checkpoint):
+        """Put the state back in the state of a checkpoint (or Snapshot)"""
+        checkpoint.restore_into(self)
+
+    def to_bytes(self):
+        """
+        Return the compact binary encoding of the state (see tc1.codec),
+        to send it to another process or save it to disk.
+        """
+        from .codec import encode_state # codec depends on this module
+        return encode_state(self)
+
+    @classmethod
+    def from_bytes(cls, buf, testmode=False):
+        """
+        Create a new GameState from the bytes returned by to_bytes (or any
+        object supporting the buffer protocol, like a memoryview)
+        """
+        from .codec import decode_state
+        return decode_state(buf, testmode)
+
+    def to_tensor(self, out=None, builder=None):
+        """
+        Return the observation of the state as an array of shape
+        tc1.observation.OBSERVATION_SHAPE, written into out if it is given
+        (see tc1.observation for the planes).
+        Arguments:
+            - out: preallocated array (it can be a view), to avoid an allocation
+                at each step
+            - builder: the ObservationBuilder to use, default to a shared one
+        """
+        from . import observation
+        if builder is None:
+            builder = observation.default_builder()
+        return builder.build(self, out)
+
+    def _occupied(self):
+        """
+        Return a dict mapping the positions of the defensive units to their
+        number (more than one only in testmode). The dict is built from the
+        units the first time it is needed, then updated by add_unit and
+        remove_dead_units. When the units are replaced directly,
+        invalidate_occupancy must be called.
+        """
+        if self._occupancy is None:
+            self._free = None
+            occupancy = {}
+            for u in self.s_units + self.a_units:
+                if u.id > 3:
+                    occupancy[u.pos] = occupancy.get(u.pos, 0) + 1
+            self._occupancy = occupancy
+        return self._occupancy
+
+    def invalidate_occupancy(self):
+        """Forget the occupied nodes, after the units were replaced"""
+        self._occupancy = None
+        self._free = None
+
+    def legal_placements(self, team, unit_name):
+        """
+        Return the (30, 30) boolean mask of the nodes where a unit can be
+        deployed by add_unit (in the padded notation). The information
+        units must be deployed on the borders of their team, the defensive
+        units on the half of the map of their team, and no unit can be
+        deployed on a defensive unit. Several information units can share
+        a node.
+        Arguments:
+            - team: 's' or 'a'
+            - unit_name: the name of the unit in UNITS_DESC
+        """
+        return PLACEMENT_MASKS[team][UNITS_DESC[unit_name]['id'] < 4] & self._free_nodes()[1:-1, 1:-1]
+
+    def _free_nodes(self):
+        """
+        Return the mask of the nodes of the map without defensive unit, in
+        the grid padded with one more node on each side (see _PAD)
+        """
+        occupancy = self._occupied()
+        if self._free is None:
+            # the mask is replaced (never modified) when the nodes change,
+            # so it can be shared with the forks
+            free = _FREE_TEMPLATE.copy()
+            # the units placed out of the map in testmode are ignored
+            occupied = [pos for pos in occupancy if pos in _PLACEMENT_CELLS['s'][False]
+                    or pos in _PLACEMENT_CELLS['a'][False]]
+            if occupied:
+                xs, ys = zip(*occupied)
+                free[np.add(xs, 1), np.add(ys, 1)] = False
+            self._free = free
+        return self._free
 
     def _raise(self, error):
         """
@@ -54,64 +302,293 @@ class GameState:
     def add_unit(self, team, unit_name, pos):
         """
         Function to add a new unit to the current game
-        Will check if the offensive units are placed on
-        the borders.
+        Will check if the unit can be placed at this position, see
+        legal_placements (the position is looked up in sets, so it costs
+        the same for any position).
         WARNING: We use the "padded notation" for the coordinates which is
         differente from the official API. (ours if from 1 to 29)
         """
         # team must be s (allies) of a (ennemies)
         assert team in ['s', 'a']
-        # copy the basic stats of the unit
-        spec = dict(UNITS_DESC[unit_name])
-        # add the position to the stat dict
-        spec['pos'] = pos
+        # only the id is needed, the basic stats are shared by all the units
+        unit_id = UNITS_DESC[unit_name]['id']
+        target = None
+        legal = pos in _PLACEMENT_CELLS[team][unit_id < 4]
+        occupancy = self._occupied()
 
         # now check if the unit is an offensive one, and check its
         # position if so
-        if spec['id'] < 4: # offensive id's all 3 or below
-            if team == 's' and pos not in self.FRIENDLY_BORDERS:
-                self._raise('Offensive unit must be placed of borderds, but got position {}'.format(pos))
-            if team == 'a' and pos not in self.ENNEMY_BORDERS:
+        if unit_id < 4: # offensive id's all 3 or below
+            if not legal:
                 self._raise('Offensive unit must be placed of borderds, but got position {}'.format(pos))
             # now we define the target border, as offensive units
             # will try to move toward the ennemy border on the
             # opposite side of the board.
             if team == 's':
                 if pos[0] < 15:
-                    spec['target'] = 2 # nums start from 2 to 5 in trig. order
+                    target = 2 # nums start from 2 to 5 in trig. order
                 else:
-                    spec['target'] = 3
+                    target = 3
             else:
                 if pos[0] < 15:
-                    spec['target'] = 5
+                    target = 5
                 else:
-                    spec['target'] = 4
+                    target = 4
         # now check if defensive units has been placed in the right
         # side of the arena
         else:
-            if team == 's' and pos[1] > 14:
+            if not legal:
                 self._raise('Defensive unit must be placed in your side, but got position {}'.format(pos))
-            if team == 'a' and pos[1] < 15:
+        if pos in occupancy:
+            self._raise('Position {} is occupied by a defensive unit'.format(pos))
+
+        unit = Unit(unit_id, pos, target)
+        units = self.s_units if team == 's' else self.a_units
+        units.append(unit)
+        if unit_id > 3:
+            occupancy[pos] = occupancy.get(pos, 0) + 1
+            self._free = None
+        if self._board_hash is not None:
+            self._board_hash = (self._board_hash + _unit_key(team, len(units) - 1, unit)) & HASH_MASK
+
+    def add_units(self, team, names, positions):
+        """
+        Add many units of a team at once. The placements are checked as
+        add_unit would check them one after the other (see
+        legal_placements), in a single vectorized pass when they are given
+        as arrays, and the units are only added if all of them are legal
+        (else a ValueError is raised, except in testmode).
+        Arguments:
+            - team: 's' or 'a'
+            - names: the names of the units, or their ids, as a sequence or
+                an array
+            - positions: the positions of the units in the padded notation,
+                as a sequence of (x,y) or an array of shape (n, 2)
+        """
+        assert team in ['s', 'a']
+        if not isinstance(names, np.ndarray) and not isinstance(positions, np.ndarray):
+            # converting sequences to arrays costs more than checking the
+            # units in sets, whatever the number of units
+            return self._add_listed_units(team, names, positions)
+        if isinstance(names, np.ndarray) and names.dtype.kind in 'iu':
+            ids = names.reshape(-1)
+            if len(ids) and (ids.min() < 1 or ids.max() >= len(UNITS_BY_ID)):
+                raise ValueError('Unknown unit id in {}'.format(ids))
+        else:
+            if isinstance(names, np.ndarray):
+                names = names.tolist()
+            ids = np.array([_UNIT_IDS[name] for name in names], dtype=np.int64)
+        positions = np.asarray(positions, dtype=np.int64).reshape(-1, 2)
+        n_units = len(ids)
+        if n_units != len(positions):
+            raise ValueError('Got {} units but {} positions'.format(n_units, len(positions)))
+        if not n_units:
+            return
+
+        # index of the nodes in the padded grid, the positions out of the
+        # grid going to its padding (which is never legal)
+        padded = np.minimum(np.maximum(positions + 1, 0), _PAD - 1)
+        flat = padded @ _STRIDES
+        placed = _PLACEMENT_TABLES[team][ids, flat]
+        legal = placed & self._free_nodes().ravel()[flat]
+        defensive = ids > 3
+        if n_units > 1 and defensive.any():
+            # as with add_unit, a unit can't follow a defensive unit on its
+            # node: find the first defensive unit of each node
+            order = np.arange(n_units)
+            first = np.empty(_PAD * _PAD, dtype=np.int64)
+            first[flat] = n_units
+            np.minimum.at(first, flat[defensive], order[defensive])
+            legal &= first[flat] >= order
+        if not legal.all():
+            i = np.argmin(legal)
+            pos = tuple(positions[i].tolist())
+            if placed[i]:
+                self._raise('Position {} is occupied by a defensive unit'.format(pos))
+            elif ids[i] < 4:
+                self._raise('Offensive unit must be placed of borderds, but got position {}'.format(pos))
+            else:
                 self._raise('Defensive unit must be placed in your side, but got position {}'.format(pos))
 
-        # To know where to move when two nodes are equally close to the border, we need to
-        # maintain a variable for the previous move
-        spec['previous_move'] = None
+        self._insert_units(team, _new_units(team, ids.tolist(), map(tuple, positions.tolist())))
+
+    def _add_listed_units(self, team, names, positions):
+        """
+        Same as add_units, checking the placements one after the other as
+        add_unit does, for the units given as sequences
+        """
+        ids = [_UNIT_IDS[name] for name in names]
+        positions = [tuple(pos) for pos in positions]
+        if len(ids) != len(positions):
+            raise ValueError('Got {} units but {} positions'.format(len(ids), len(positions)))
+        occupancy = self._occupied()
+        # the nodes of the defensive units of the batch
+        taken = set()
+        for unit_id, pos in zip(ids, positions):
+            if pos not in _PLACEMENT_CELLS[team][unit_id < 4]:
+                if unit_id < 4:
+                    self._raise('Offensive unit must be placed of borderds, but got position {}'.format(pos))
+                else:
+                    self._raise('Defensive unit must be placed in your side, but got position {}'.format(pos))
+            elif pos in occupancy or pos in taken:
+                self._raise('Position {} is occupied by a defensive unit'.format(pos))
+            if unit_id > 3:
+                taken.add(pos)
+        if ids:
+            self._insert_units(team, _new_units(team, ids, positions))
 
-        # Units does not move every turn, thus we must count for how many turn
-        # it hasn't moved. Counter is initialized to zero (so ping will the second frame)
-        # such as in C1 engine
-        spec['n_turns_static'] = 0
+    def _insert_units(self, team, units):
+        """
+        Append the new units to their team, and update the occupied nodes
+        and the board hash
+        """
+        team_units = self.s_units if team == 's' else self.a_units
+        start = len(team_units)
+        team_units += units
+        defensive = [unit for unit in units if unit.id > 3]
+        if defensive:
+            occupancy = self._occupied()
+            for unit in defensive:
+                occupancy[unit.pos] = occupancy.get(unit.pos, 0) + 1
+            self._free = None
+        if self._board_hash is not None:
+            self._board_hash = (self._board_hash + _keys_sum(team, units, start)) & HASH_MASK
 
+    def deploy(self, team, deployment):
+        """
+        Pay for and deploy a list of units. The information units are paid
+        with bits and the defensive units with cores, at the cost given by
+        UNITS_DESC. Nothing is deployed (and a ValueError is raised) if the
+        team can't afford all of them or if a unit is misplaced (see
+        add_units).
+        Arguments:
+            - team: 's' or 'a'
+            - deployment: list of (unit_name, pos), as given to add_unit
+        """
+        bits = cores = 0
+        for unit_name, _ in deployment:
+            desc = UNITS_DESC[unit_name]
+            if desc['id'] < 4:
+                bits += desc['cost']
+            else:
+                cores += desc['cost']
+        available_bits = self.s_bits if team == 's' else self.a_bits
+        available_cores = self.s_core if team == 's' else self.a_core
+        if bits > available_bits or cores > available_cores:
+            self._raise('Deployment costs {} bits and {} cores, but only {} bits and {} cores are available'.format(
+                bits, cores, available_bits, available_cores))
+        if deployment:
+            names, positions = zip(*deployment)
+            self.add_units(team, names, positions)
         if team == 's':
-            self.s_units.append(spec)
+            self.s_bits -= bits
+            self.s_core -= cores
         else:
-            self.a_units.append(spec)
+            self.a_bits -= bits
+            self.a_core -= cores
+
+    def end_turn(self):
+        """
+        Apply the bit decay and the income of both teams, and start the
+        next turn
+        """
+        keep = 1 - self.BITS_DECAY
+        self.turn += 1
+        bits = self.BITS_PER_TURN + self.turn // self.BITS_GROWTH_PERIOD
+        self.s_bits = round(self.s_bits * keep + bits, 1)
+        self.a_bits = round(self.a_bits * keep + bits, 1)
+        self.s_core += self.CORES_PER_TURN
+        self.a_core += self.CORES_PER_TURN
 
     def remove_dead_units(self):
         """
         Remove units whose stability has reached zero
         """
-        self.a_units = [u for u in self.a_units if u['stability']>0]
-        self.s_units = [u for u in self.s_units if u['stability']>0]
+        s_units = [u for u in self.s_units if u.stability>0]
+        a_units = [u for u in self.a_units if u.stability>0]
+        # the hash and the occupancy grid are only updated if units died
+        for team, units, alive in [('s', self.s_units, s_units), ('a', self.a_units, a_units)]:
+            if len(alive) == len(units):
+                continue
+            if self._board_hash is not None:
+                # the units after the first dead one change of order
+                first = next(i for i, u in enumerate(units) if u.stability <= 0)
+                removed = _keys_sum(team, units[first:], first)
+                added = _keys_sum(team, alive[first:], first)
+                self._board_hash = (self._board_hash - removed + added) & HASH_MASK
+            # nodes of the destroyed encryptors, as in Unit.shielded_by
+            dead_encryptors = 0
+            for u in units:
+                if u.stability > 0:
+                    continue
+                if u.id == 5:
+                    dead_encryptors |= 1 << (u.pos[0] * PADDED_GRID_SIZE + u.pos[1])
+                if u.id > 3 and self._occupancy is not None:
+                    self._free = None
+                    if self._occupancy[u.pos] == 1:
+                        del self._occupancy[u.pos]
+                    else:
+                        self._occupancy[u.pos] -= 1
+            # the destroyed encryptors are forgotten by the units they
+            # shielded, so that a new encryptor on their node shields again
+            if dead_encryptors and any(u.shielded_by & dead_encryptors for u in alive):
+                for u in alive:
+                    u.shielded_by &= ~dead_encryptors
+                self._board_hash = None
+        self.s_units = s_units
+        self.a_units = a_units
+
+
+
+class Snapshot(Mapping):
+    """
+    A frozen copy of a GameState, as returned by GameState.serialize_state.
+    The units are only stored as tuples of immutable values (see Unit.record),
+    which is much cheaper than copying their dictionnaries at each frame.
+    The units are rebuilt when someone reads them, and a full GameState can
+    be rebuilt with to_state.
+    """
+    __slots__ = ('_values', '_records', '_units')
+
+    _KEYS = ('s_health', 'a_health', 's_core', 'a_core', 's_bits', 'a_bits',
+            'turn', 's_units', 'a_units')
+
+    def __init__(self, state):
+        self._values = (state.s_health, state.a_health, state.s_core,
+                state.a_core, state.s_bits, state.a_bits, state.turn)
+        self._records = (tuple([u.record() for u in state.s_units]),
+                tuple([u.record() for u in state.a_units]))
+        self._units = [None, None]
+
+    def __getitem__(self, key):
+        if key == 's_units' or key == 'a_units':
+            team = key == 'a_units'
+            # rebuild the units the first time they are read
+            if self._units[team] is None:
+                self._units[team] = [Unit.from_record(r) for r in self._records[team]]
+            return self._units[team]
+        try:
+            return self._values[self._KEYS.index(key)]
+        except ValueError:
+            raise KeyError(key)
+
+    def __iter__(self):
+        return iter(self._KEYS)
+
+    def __len__(self):
+        return len(self._KEYS)
+
+    def to_state(self, testmode=False):
+        """Return a new GameState in the state of the snapshot"""
+        state = GameState(testmode)
+        self.restore_into(state)
+        return state
 
+    def restore_into(self, state):
+        """Set the values and the units of a GameState to the ones of the snapshot"""
+        state.invalidate_hash()
+        state.invalidate_occupancy()
+        (state.s_health, state.a_health, state.s_core, state.a_core,
+                state.s_bits, state.a_bits, state.turn) = self._values
+        state.s_units = [Unit.from_record(r) for r in self._records[0]]
+        state.a_units = [Unit.from_record(r) for r in self._records[1]]
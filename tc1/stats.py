@@ -0,0 +1,60 @@
+class EngineStats:
+    # Phases of Engine.step, timed in seconds
+    PHASES = ('move', 'damage', 'remove')
+    # Counters:
+    #   - frames: frames simulated by Engine.step
+    #   - frames_skipped: static frames skipped by Engine.simulate_round
+    #   - bfs_runs: distance maps computed or repaired
+    #   - nodes_expanded: nodes expanded by these BFS
+    #   - deepest_fallbacks: moves computed towards a self-destruct position,
+    #       because the target border can't be reached
+    #   - targeting_comparisons: potential targets compared by the attackers
+    #   - units_removed: dead or scored units removed from the board
+    COUNTERS = ('frames', 'frames_skipped', 'bfs_runs', 'nodes_expanded',
+            'deepest_fallbacks', 'targeting_comparisons', 'units_removed')
+
+    def __init__(self):
+        """
+        Timers and counters filled by an Engine (and its MapGraph and
+        DamageEngine) when it is given this object. When an Engine has no
+        stats, nothing is measured.
+        The same object can be given to several engines to aggregate their
+        statistics.
+        """
+        self.reset()
+
+    def reset(self):
+        """Set all the timers and counters to zero"""
+        self.timers = dict.fromkeys(self.PHASES, 0.)
+        self.counters = dict.fromkeys(self.COUNTERS, 0)
+
+    def count(self, name, n=1):
+        self.counters[name] += n
+
+    def add_time(self, phase, seconds):
+        self.timers[phase] += seconds
+
+    def merge(self, other):
+        """Add the timers and counters of another EngineStats to this one"""
+        for phase, seconds in other.timers.items():
+            self.timers[phase] += seconds
+        for name, n in other.counters.items():
+            self.counters[name] += n
+        return self
+
+    def as_dict(self):
+        """Return the timers (prefixed with time_) and the counters in a dict"""
+        values = {'time_' + phase: seconds for phase, seconds in self.timers.items()}
+        values.update(self.counters)
+        return values
+
+    def __repr__(self):
+        frames = max(self.counters['frames'], 1)
+        lines = ['EngineStats({} frames)'.format(self.counters['frames'])]
+        for phase, seconds in self.timers.items():
+            lines.append('  {:22} {:10.3f} ms  ({:.1f} us/frame)'.format(
+                phase, seconds * 1e3, seconds * 1e6 / frames))
+        for name, n in self.counters.items():
+            if name != 'frames':
+                lines.append('  {:22} {:10d}'.format(name, n))
+        return '\n'.join(lines)
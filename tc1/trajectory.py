@@ -0,0 +1,231 @@
+"""
+On-disk store of recorded rounds. A store is a directory of three
+append-only files of fixed-width records:
+    - frames.bin: one FRAME_DTYPE record per frame, with the values of the
+        GameState and the position of its units in units.bin
+    - units.bin: the units of all the frames, as records of codec.UNIT_DTYPE
+    - rounds.bin: the index of the first frame of each round
+and of header.bin, identifying the store and the version of its records
+(see STORE_HEADER). The records are read as they are, so a store written
+with other records can't be read, and the reader refuses it.
+The reader maps the files in memory, so any frame of any round can be read
+without loading the whole store. Engine.simulate_round doesn't write the
+frames it skips, but they only differ from the last frame written before
+them by the counters of the information units, so they are rebuilt by
+TrajectoryReader.get_frame.
+"""
+import os
+import struct
+import numpy as np
+from .codec import MAGIC, UNIT_DTYPE, decode_units, encode_units
+from .state import GameState
+
+# Content of header.bin: the magic of the stores, the version of the frame
+# records (to increment when FRAME_DTYPE changes), and the magic of the
+# encoding of the units (which changes with codec.UNIT_DTYPE)
+STORE_HEADER = struct.Struct('<4sI4s')
+STORE_MAGIC = b'TC1S'
+STORE_VERSION = 1
+HEADER_FILE = 'header.bin'
+
+FRAME_DTYPE = np.dtype([
+    ('round', '<u4'),
+    ('frame', '<u4'), # frame number in the round, frames may be skipped
+    ('turn', '<u4'),
+    ('s_health', '<i4'),
+    ('a_health', '<i4'),
+    ('s_core', '<f8'),
+    ('a_core', '<f8'),
+    ('s_bits', '<f8'),
+    ('a_bits', '<f8'),
+    ('n_s_units', '<u2'),
+    ('n_a_units', '<u2'),
+    ('units_offset', '<u8')]) # index of the first unit in units.bin
+
+ROUND_DTYPE = np.dtype('<u8')
+
+FILES = {'frames': ('frames.bin', FRAME_DTYPE),
+        'units': ('units.bin', UNIT_DTYPE),
+        'rounds': ('rounds.bin', ROUND_DTYPE)}
+
+
+def _check_header(path):
+    """
+    Raise a ValueError if the directory path doesn't contain a store
+    written with the current records. Return False if it contains no store
+    at all (no header and no records), True if the store can be used.
+    """
+    filepath = os.path.join(path, HEADER_FILE)
+    if not os.path.exists(filepath):
+        if any(os.path.exists(os.path.join(path, filename)) for filename, _ in FILES.values()):
+            raise ValueError('{} has no {}, it was written by an older version'.format(path, HEADER_FILE))
+        return False
+    with open(filepath, 'rb') as f:
+        header = f.read()
+    if header != STORE_HEADER.pack(STORE_MAGIC, STORE_VERSION, MAGIC):
+        raise ValueError('{} is not a trajectory store of this version (header {!r})'.format(path, header))
+    return True
+
+
+def _count(path, dtype):
+    """Number of complete records in a file"""
+    return os.path.getsize(path) // dtype.itemsize if os.path.exists(path) else 0
+
+
+class TrajectoryWriter:
+    def __init__(self, path):
+        """
+        Append rounds to the store in the directory path (created if needed).
+        Rounds already in the store are kept.
+        Usage:
+            with TrajectoryWriter(path) as writer:
+                writer.begin_round()
+                writer.append(state) # for each frame
+        """
+        os.makedirs(path, exist_ok=True)
+        if not _check_header(path):
+            with open(os.path.join(path, HEADER_FILE), 'wb') as f:
+                f.write(STORE_HEADER.pack(STORE_MAGIC, STORE_VERSION, MAGIC))
+        self.path = path
+        self.n_frames = _count(os.path.join(path, 'frames.bin'), FRAME_DTYPE)
+        self.n_units = _count(os.path.join(path, 'units.bin'), UNIT_DTYPE)
+        self.n_rounds = _count(os.path.join(path, 'rounds.bin'), ROUND_DTYPE)
+        self._files = {name: open(os.path.join(path, filename), 'ab')
+                for name, (filename, _) in FILES.items()}
+        self._record = np.zeros(1, FRAME_DTYPE)
+        # index of the first frame of the current round, None until
+        # begin_round is called
+        self._round_start = None
+
+    def begin_round(self):
+        """Start a new round, the next frames appended belong to it"""
+        self._files['rounds'].write(np.array([self.n_frames], ROUND_DTYPE).tobytes())
+        self._round_start = self.n_frames
+        self.n_rounds += 1
+
+    def append(self, state, frame=None):
+        """
+        Append a frame to the current round.
+        Arguments:
+            - state: the GameState of the frame
+            - frame: the number of the frame in the round, default to the
+                number of frames appended to the round
+        """
+        if self._round_start is None:
+            raise ValueError('begin_round must be called before append')
+        if frame is None:
+            frame = self.n_frames - self._round_start
+        units = np.concatenate([encode_units(state.s_units), encode_units(state.a_units)])
+        record = self._record
+        record[0] = (self.n_rounds - 1, frame, state.turn, state.s_health, state.a_health,
+                state.s_core, state.a_core, state.s_bits, state.a_bits,
+                len(state.s_units), len(state.a_units), self.n_units)
+        # the units first, so that a frame is never written without its units
+        self._files['units'].write(units.tobytes())
+        self._files['frames'].write(record.tobytes())
+        self.n_units += len(units)
+        self.n_frames += 1
+
+    def flush(self):
+        """Write the buffered frames to the disk, so that readers can see them"""
+        for f in self._files.values():
+            f.flush()
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class TrajectoryReader:
+    def __init__(self, path):
+        """
+        Read the rounds of a store written by TrajectoryWriter. The files are
+        memory-mapped: frames, units and rounds are read-only arrays of
+        records, read from the disk when they are accessed.
+        A ValueError is raised if path isn't a store of the current version.
+        """
+        if not _check_header(path):
+            raise ValueError('{} is not a trajectory store'.format(path))
+        self.path = path
+        self.reload()
+
+    def reload(self):
+        """Map the files again, to see the frames appended since"""
+        for name, (filename, dtype) in FILES.items():
+            filepath = os.path.join(self.path, filename)
+            count = _count(filepath, dtype)
+            if count: # an empty file can't be mapped
+                records = np.memmap(filepath, dtype, 'r', shape=(count,))
+            else:
+                records = np.zeros(0, dtype)
+            setattr(self, name, records)
+
+    @property
+    def n_rounds(self):
+        return len(self.rounds)
+
+    @property
+    def n_frames(self):
+        return len(self.frames)
+
+    def round_frames(self, round_id):
+        """Return the range of the indexes of the frames of a round"""
+        start = int(self.rounds[round_id])
+        if round_id + 1 < len(self.rounds):
+            stop = int(self.rounds[round_id + 1])
+        else:
+            stop = len(self.frames)
+        return range(start, stop)
+
+    def frame_units(self, index):
+        """Return the records of the units of a frame (a view of the file)"""
+        _, _, _, _, _, _, _, _, _, n_s, n_a, offset = self.frames[index].item()
+        # plain array, as the operations on memmap objects are slower
+        return np.asarray(self.units[offset:offset + n_s + n_a])
+
+    def get_state(self, index, testmode=False):
+        """Return a new GameState with the values of a frame"""
+        state = GameState(testmode)
+        (_, _, state.turn, state.s_health, state.a_health, state.s_core, state.a_core,
+                state.s_bits, state.a_bits, n_s, _, _) = self.frames[index].item()
+        units = self.frame_units(index)
+        state.s_units = decode_units(units[:n_s])
+        state.a_units = decode_units(units[n_s:])
+        return state
+
+    def get_frame(self, round_id, frame, testmode=False):
+        """
+        Return a new GameState with the values of a frame of a round, given
+        by its number in the round, even if it was skipped by
+        Engine.simulate_round: during the skipped frames, the only change
+        is the counter n_turns_static of the information units, incremented
+        at each frame. So the frame is rebuilt from the last frame written
+        before it. A ValueError is raised for the frames after the end of
+        the round (its last frame is always written).
+        """
+        indexes = self.round_frames(round_id)
+        frames = self.frames['frame'][indexes.start:indexes.stop]
+        # frames are written in order, find the last one before frame
+        i = int(np.searchsorted(frames, frame, 'right')) - 1
+        if i < 0 or (i == len(frames) - 1 and frames[i] != frame):
+            raise ValueError('Round {} has no frame {}'.format(round_id, frame))
+        state = self.get_state(indexes.start + i, testmode)
+        n_skipped = frame - int(frames[i])
+        if n_skipped:
+            for u in state.s_units + state.a_units:
+                if u.id < 4:
+                    u.n_turns_static += n_skipped
+        return state
+
+    def round_logs(self, round_id):
+        """
+        Return the snapshots of the frames of a round, as the logs given to
+        Matplotlib_display.animate_logs
+        """
+        return [self.get_state(i).serialize_state() for i in self.round_frames(round_id)]
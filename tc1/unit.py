@@ -0,0 +1,122 @@
+from collections.abc import Mapping
+from .unit_desc import UNITS_BY_ID
+
+# The possible values of Unit.previous_move. When the moves are stored as
+# integers, they are stored as their index in this list (0 means no move
+# yet). The order is the one used by MapGraph.get_direction to scan the
+# neighbours.
+MOVES = [None, (1,0), (-1,0), (0,1), (0,-1)]
+
+class Unit(Mapping):
+    """
+    A unit on the board. Only the values that change during the game are
+    stored on the unit, the basic stats (name, cost, range...) are read from
+    the table UNITS_BY_ID using the id of the unit.
+    The engine uses the attributes, but the unit can also be read as a
+    dictionnary (unit['pos'], unit['stability']...) like the dicts that were
+    used before. This view is read-only.
+    """
+    __slots__ = ('id', 'pos', 'stability', 'target', 'previous_move', 'n_turns_static',
+            'n_moves', 'shielded_by')
+
+    # Keys of the dictionnary view, in the order of the old unit dicts
+    _STATS_KEYS = ('name', 'id', 'cost', 'stability', 'range', 'dpf', 'speed')
+    _STATE_KEYS = ('pos', 'target', 'previous_move', 'n_turns_static', 'n_moves',
+            'shielded_by')
+
+    def __init__(self, unit_id, pos, target=None):
+        """
+        Create a new unit with its full stability.
+        Arguments:
+            - unit_id: int, the id of the unit in UNITS_DESC
+            - pos: tuple of int, the position in the padded notation
+            - target: the border targeted by an offensive unit (2 to 5),
+                None for a defensive unit
+        """
+        self.id = unit_id
+        self.pos = pos
+        self.stability = UNITS_BY_ID[unit_id]['stability']
+        self.target = target
+        # To know where to move when two nodes are equally close to the border,
+        # we need to maintain a variable for the previous move
+        self.previous_move = None
+        # Units does not move every turn, thus we must count for how many turn
+        # it hasn't moved. Counter is initialized to zero (so ping will move
+        # the second frame) such as in C1 engine
+        self.n_turns_static = 0
+        # Number of moves done, as the units only deal self-destruct damages
+        # after some moves (see MapGraph._move_one)
+        self.n_moves = 0
+        # Encryptors that already shielded the unit, as each one only
+        # shields it once: the bit 1 << (x * 30 + y) is set for the
+        # encryptor at (x, y) (see MapGraph._move_team)
+        self.shielded_by = 0
+
+    def record(self):
+        """
+        Return the values of the unit as a tuple. The tuple only contains
+        immutable values, so it can be shared between the snapshots.
+        """
+        return (self.id, self.pos, self.stability, self.target,
+                self.previous_move, self.n_turns_static, self.n_moves, self.shielded_by)
+
+    @classmethod
+    def from_record(cls, record):
+        """Create a new unit from a tuple returned by Unit.record"""
+        unit = cls.__new__(cls)
+        (unit.id, unit.pos, unit.stability, unit.target,
+                unit.previous_move, unit.n_turns_static, unit.n_moves, unit.shielded_by) = record
+        return unit
+
+    def copy(self):
+        """Return an independent copy of the unit"""
+        unit = self.__class__.__new__(self.__class__)
+        unit.id = self.id
+        unit.pos = self.pos
+        unit.stability = self.stability
+        unit.target = self.target
+        unit.previous_move = self.previous_move
+        unit.n_turns_static = self.n_turns_static
+        unit.n_moves = self.n_moves
+        unit.shielded_by = self.shielded_by
+        return unit
+
+    @property
+    def name(self):
+        return UNITS_BY_ID[self.id]['name']
+
+    @property
+    def cost(self):
+        return UNITS_BY_ID[self.id]['cost']
+
+    @property
+    def range(self):
+        return UNITS_BY_ID[self.id]['range']
+
+    @property
+    def dpf(self):
+        return UNITS_BY_ID[self.id]['dpf']
+
+    @property
+    def speed(self):
+        return UNITS_BY_ID[self.id]['speed']
+
+    def _keys(self):
+        # Defensive units have no target, so no 'target' key
+        if self.target is None:
+            return self._STATS_KEYS + ('pos', 'previous_move', 'n_turns_static')
+        return self._STATS_KEYS + self._STATE_KEYS
+
+    def __getitem__(self, key):
+        if key not in self._keys():
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __iter__(self):
+        return iter(self._keys())
+
+    def __len__(self):
+        return len(self._keys())
+
+    def __repr__(self):
+        return 'Unit({}, pos={}, stability={})'.format(self.name, self.pos, self.stability)
@@ -42,7 +42,10 @@ UNITS_DESC = {
             'stability':30,
             'range':3.5,
             'dpf':0,
-            'speed':0
+            'speed':0,
+            # stability given to the friendly information units entering
+            # its range, see DamageEngine
+            'shield':10
             },
         'destructor':{
             'name':'destructor',
@@ -55,4 +58,6 @@ UNITS_DESC = {
             }
         }
 
-
+# The same stats, indexed by the id of the units. The index 0 is left empty
+# so that the id can be used directly
+UNITS_BY_ID = [None] + sorted(UNITS_DESC.values(), key=lambda d: d['id'])
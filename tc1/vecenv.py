@@ -0,0 +1,192 @@
+import multiprocessing
+import numpy as np
+from .engine import Engine
+from .observation import OBSERVATION_SHAPE, ObservationBuilder
+from .state import GameState
+
+
+class _EnvGroup:
+    def __init__(self, n_envs, make_state, max_frames, max_rounds):
+        """
+        Games run one after the other in the current process, used by VecEnv
+        directly or in each of its worker processes (see VecEnv for the
+        arguments)
+        """
+        self.engines = [Engine() for _ in range(n_envs)]
+        self.rounds = [0] * n_envs
+        self.make_state = make_state
+        self.max_frames = max_frames
+        self.max_rounds = max_rounds
+        self.builder = ObservationBuilder()
+
+    def _reset_one(self, i):
+        self.engines[i].game_state = self.make_state()
+        self.rounds[i] = 0
+
+    def reset(self, obs):
+        """Start new games, and write their observations into obs"""
+        for i, engine in enumerate(self.engines):
+            self._reset_one(i)
+            self.builder.build(engine.game_state, obs[i])
+
+    def step(self, actions, obs):
+        """
+        Deploy the units of each action, simulate the rounds and write the
+        new observations into obs. Return the rewards, done flags and infos.
+        """
+        rewards = np.zeros(len(self.engines))
+        dones = np.zeros(len(self.engines), dtype=bool)
+        infos = []
+        for i, (engine, deployment) in enumerate(zip(self.engines, actions)):
+            state = engine.game_state
+            invalid = 0
+            for team, unit_name, pos in deployment:
+                try:
+                    state.add_unit(team, unit_name, pos)
+                except ValueError:
+                    invalid += 1 # the unit is not deployed
+            s_health, a_health = state.s_health, state.a_health
+            state, result = engine.simulate_round(self.max_frames)
+            self.rounds[i] += 1
+            # the health points are decremented by MapGraph when units score
+            rewards[i] = (a_health - state.a_health) - (s_health - state.s_health)
+            info = {'round': self.rounds[i], 'result': result, 'invalid': invalid}
+            if state.s_health <= 0 or state.a_health <= 0 or self.rounds[i] >= self.max_rounds:
+                dones[i] = True
+                info['final_health'] = (state.s_health, state.a_health)
+                self._reset_one(i)
+            infos.append(info)
+            self.builder.build(engine.game_state, obs[i])
+        return rewards, dones, infos
+
+
+def _worker(conn, buffer, shape, start, stop, group_args):
+    """Run the games start to stop of a VecEnv in a worker process"""
+    obs = np.frombuffer(buffer, dtype=np.float32).reshape(shape)[start:stop]
+    group = _EnvGroup(stop - start, *group_args)
+    try:
+        while True:
+            cmd, data = conn.recv()
+            if cmd == 'reset':
+                group.reset(obs)
+                conn.send(None)
+            elif cmd == 'step':
+                conn.send(group.step(data, obs))
+            else: # close
+                break
+    finally:
+        conn.close()
+
+
+class VecEnv:
+    def __init__(self, n_envs, make_state=GameState, n_workers=0, max_frames=1000,
+            max_rounds=100):
+        """
+        Run n_envs games, with a gym-like interface. Each step of a game
+        is a round: the units of the action are deployed, then the round is
+        simulated until no information unit remains.
+        The observations (see tc1.observation), rewards and done flags of all
+        the games are returned as arrays. The finished games are reset
+        automatically, so the observation of a finished game is the one of
+        its new game.
+        Arguments:
+            - n_envs: number of games
+            - make_state: function returning the GameState of a new game
+                (it must be picklable with n_workers > 0)
+            - n_workers: number of worker processes, the games being shared
+                between them. With 0, the games run in this process.
+            - max_frames: maximum number of frames of each round
+            - max_rounds: a game is over after this number of rounds, or
+                when a team has no more health
+        """
+        self.n_envs = n_envs
+        self.n_workers = n_workers
+        group_args = (make_state, max_frames, max_rounds)
+        shape = (n_envs,) + OBSERVATION_SHAPE
+        if n_workers == 0:
+            self._group = _EnvGroup(n_envs, *group_args)
+            self._obs = np.zeros(shape, dtype=np.float32)
+            return
+        # The workers write the observations in shared memory, so only the
+        # actions, rewards and infos are sent through the pipes. A RawArray
+        # of C floats (float32) is used, as multiprocessing.shared_memory
+        # needs python 3.8
+        self._buffer = multiprocessing.RawArray('f', int(np.prod(shape)))
+        self._obs = np.frombuffer(self._buffer, dtype=np.float32).reshape(shape)
+        bounds = np.linspace(0, n_envs, n_workers + 1).astype(int).tolist()
+        self._slices = list(zip(bounds[:-1], bounds[1:]))
+        self._conns = []
+        self._processes = []
+        for start, stop in self._slices:
+            conn, child_conn = multiprocessing.Pipe()
+            p = multiprocessing.Process(target=_worker, daemon=True, args=(child_conn,
+                self._buffer, shape, start, stop, group_args))
+            p.start()
+            child_conn.close()
+            self._conns.append(conn)
+            self._processes.append(p)
+
+    def reset(self):
+        """
+        Start new games in all the environments. Return the observations.
+        The returned array is reused by the next calls to reset and step.
+        """
+        if self.n_workers == 0:
+            self._group.reset(self._obs)
+        else:
+            for conn in self._conns:
+                conn.send(('reset', None))
+            for conn in self._conns:
+                conn.recv()
+        return self._obs
+
+    def step(self, actions):
+        """
+        Play a round in each game.
+        Arguments:
+            - actions: a deployment for each game, being a list of
+                (team, unit_name, pos) as given to GameState.add_unit. The
+                invalid units are not deployed, and counted in the infos.
+        Return (observations, rewards, dones, infos):
+            - observations: array of shape (n_envs,) + OBSERVATION_SHAPE,
+                reused by the next calls
+            - rewards: the health points lost by the ennemy minus the health
+                points lost by the friendly team during the round
+            - dones: whether the game is over (and has been reset)
+            - infos: for each game, a dict with the round number, the
+                RoundResult and the number of invalid units ('round',
+                'result', 'invalid'), and the final health points of both
+                teams if the game is over ('final_health')
+        """
+        if len(actions) != self.n_envs:
+            raise ValueError('Expected {} actions, got {}'.format(self.n_envs, len(actions)))
+        if self.n_workers == 0:
+            rewards, dones, infos = self._group.step(actions, self._obs)
+            return self._obs, rewards, dones, infos
+        for conn, (start, stop) in zip(self._conns, self._slices):
+            conn.send(('step', actions[start:stop]))
+        results = [conn.recv() for conn in self._conns]
+        rewards = np.concatenate([r[0] for r in results])
+        dones = np.concatenate([r[1] for r in results])
+        infos = [info for r in results for info in r[2]]
+        return self._obs, rewards, dones, infos
+
+    def close(self):
+        """Stop the worker processes and release the shared memory"""
+        if self.n_workers == 0 or not self._processes:
+            return
+        for conn in self._conns:
+            conn.send(('close', None))
+            conn.close()
+        for p in self._processes:
+            p.join()
+        self._processes = []
+        # the shared memory is released with the last reference to it
+        self._obs = None
+        self._buffer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
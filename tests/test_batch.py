@@ -0,0 +1,156 @@
+import random
+from tc1.state import GameState
+from tc1.engine import Engine
+from tc1.batch import BatchEngine
+
+
+def random_state(seed, n_firewalls=30, n_info=8,
+        defensive=('filter', 'filter', 'encryptor', 'destructor')):
+    """
+    Create a random game with firewalls on both sides, and information units
+    of both teams deployed on the borders (the firewalls are not placed on
+    the borders, so that units can be deployed anywhere on them)
+    """
+    rng = random.Random(seed)
+    state = GameState()
+    free = [(x, y) for x in range(1, 29) for y in range(1, 29)
+            if abs(x - 14.5) + abs(y - 14.5) < 14]
+    rng.shuffle(free)
+    for x, y in free[:n_firewalls]:
+        state.add_unit('s' if y < 15 else 'a', rng.choice(defensive), (x, y))
+    for _ in range(n_info):
+        team = rng.choice(['s', 'a'])
+        borders = state.FRIENDLY_BORDERS if team == 's' else state.ENNEMY_BORDERS
+        state.add_unit(team, rng.choice(['ping', 'emp', 'scrambler']), rng.choice(borders))
+    return state
+
+
+def summary(state):
+    """Everything that should be identical between the two engines"""
+    units = [[(u['name'], u['pos'], u['stability'], u['n_turns_static'],
+        u['previous_move'], u.shielded_by) for u in team] for team in [state.s_units, state.a_units]]
+    return state.s_health, state.a_health, units
+
+
+def test_batchMatchesEngine():
+    """The batch engine must give the same results as the engine, game by game"""
+    states = [random_state(seed) for seed in range(12)]
+    batch = BatchEngine(states)
+    engines = []
+    for s in states:
+        eng = Engine()
+        eng.game_state = s
+        engines.append(eng)
+    for frame in range(100):
+        batch.step()
+        for eng in engines:
+            eng.step()
+        for eng, s in zip(engines, batch.to_states()):
+            assert summary(eng.game_state) == summary(s), "Mismatch at frame {}".format(frame)
+
+
+def test_batchMainScenario():
+    """Same check with the wall of filters of main.py and stacked units"""
+    state = GameState()
+    for p in range(19):
+        state.add_unit('a', 'filter', (p+1, 15))
+    state.add_unit('s', 'ping', (10,5))
+    state.add_unit('s', 'emp', (10,5))
+    state.add_unit('s', 'ping', (17,3))
+    eng = Engine()
+    eng.game_state = state
+    batch = BatchEngine([state])
+    for frame in range(80):
+        eng.step()
+        batch.step()
+        assert summary(eng.game_state) == summary(batch.to_states()[0])
+
+
+def test_batchMaze():
+    """Same check on crowded boards, where units self-destruct"""
+    states = [random_state(seed, n_firewalls=120, n_info=12) for seed in range(8, 24)]
+    batch = BatchEngine(states)
+    engines = []
+    for s in states:
+        eng = Engine()
+        eng.game_state = s
+        engines.append(eng)
+    n_blasts = 0
+    for frame in range(150):
+        batch.step()
+        for eng in engines:
+            events = eng.map_graph(eng.game_state)
+            n_blasts += sum(e[0] == 'self_destruct' and e[2] > 0 for team in events for e in team)
+            eng.damage_engine(eng.game_state, events)
+            eng.game_state.remove_dead_units()
+        for eng, s in zip(engines, batch.to_states()):
+            assert summary(eng.game_state) == summary(s), "Mismatch at frame {}".format(frame)
+    assert n_blasts > 0
+
+
+def test_batchSelfDestruct():
+    """As in DamageEngine, the blasts only damage the ennemy firewalls"""
+    state = GameState()
+    state.add_unit('a', 'filter', (13, 15))
+    state.add_unit('a', 'ping', (13, 27))
+    state.a_units[-1].pos = (12, 14)
+    batch = BatchEngine([state])
+    batch._blasts = [(0, 0, 13, 14, 15)]
+    batch._self_destruct()
+    assert [u.stability for u in batch.to_states()[0].a_units] == [45, 15]
+
+
+def test_batchStacks():
+    """The stacks of identical units attack as groups, as in DamageEngine"""
+    states = []
+    for seed in range(4):
+        rng = random.Random(seed)
+        state = GameState()
+        for x in rng.sample(range(8, 22), 5):
+            state.add_unit('a', rng.choice(['destructor', 'filter']), (x, rng.randint(16, 19)))
+        for _ in range(20):
+            state.add_unit('s', rng.choice(['ping', 'scrambler']), (13, 2))
+        states.append(state)
+    batch = BatchEngine(states)
+    engines = []
+    for s in states:
+        eng = Engine()
+        eng.game_state = s.fork()
+        engines.append(eng)
+    for frame in range(60):
+        batch.step()
+        for eng in engines:
+            eng.step()
+        for eng, s in zip(engines, batch.to_states()):
+            assert summary(eng.game_state) == summary(s), "Mismatch at frame {}".format(frame)
+
+
+def test_batchShields():
+    """Each encryptor shields a unit once, and is forgotten when destroyed"""
+    state = GameState()
+    state.add_unit('s', 'encryptor', (6, 13))
+    state.add_unit('s', 'ping', (18, 4))
+    states = [state] + [random_state(seed, n_firewalls=60, defensive=('encryptor', 'filter'))
+            for seed in range(4)]
+    batch = BatchEngine(states)
+    engines = []
+    for s in states:
+        eng = Engine()
+        eng.game_state = s.fork()
+        engines.append(eng)
+    shielded = set()
+    for frame in range(60):
+        if frame == 45:
+            # the ping walks along the range of the first encryptor, which
+            # is now destroyed in both engines
+            assert engines[0].game_state.s_units[1].shielded_by
+            batch.stability[0, 0, 0] = engines[0].game_state.s_units[0].stability = 0
+        batch.step()
+        for eng in engines:
+            eng.step()
+            shielded.update(u.shielded_by for u in eng.game_state.s_units + eng.game_state.a_units)
+        for eng, s in zip(engines, batch.to_states()):
+            assert summary(eng.game_state) == summary(s), "Mismatch at frame {}".format(frame)
+        if frame == 45:
+            assert [u.shielded_by for u in engines[0].game_state.s_units] == [0]
+    assert len(shielded) > 3
@@ -0,0 +1,283 @@
+import os
+import subprocess
+import sys
+import pytest
+from tc1.codec import decode_state, encode_state
+from tc1.engine import Engine
+from tc1.stats import EngineStats
+from tc1.cache import OutcomeCache
+from .test_batch import random_state, summary
+
+
+def test_simulateRound():
+    """Skipping the static frames must give the same round as stepping"""
+    for seed in range(5):
+        reference = Engine()
+        reference.game_state = random_state(seed, n_firewalls=15, n_info=6,
+                defensive=('filter', 'destructor'))
+        engine = Engine()
+        engine.game_state = random_state(seed, n_firewalls=15, n_info=6,
+                defensive=('filter', 'destructor'))
+        state, result = engine.simulate_round()
+
+        n_frames = 0
+        s_health, a_health = reference.game_state.s_health, reference.game_state.a_health
+        while any(u.id < 4 for u in reference.game_state.s_units + reference.game_state.a_units):
+            reference.step()
+            n_frames += 1
+        assert summary(state) == summary(reference.game_state)
+        assert result.n_frames == n_frames
+        assert result.s_scores == a_health - state.a_health
+        assert result.a_scores == s_health - state.s_health
+        assert len(result.score_events) == result.s_scores + result.a_scores
+        assert result.s_firewalls == sum(u.id > 3 for u in state.s_units)
+
+
+def test_simulateRoundMaxFrames():
+    """The round must stop after max_frames, even if units remain"""
+    engine = Engine()
+    state = engine.game_state
+    state.add_unit('s', 'ping', (14, 1))
+    state, result = engine.simulate_round(max_frames=20)
+    assert result.n_frames == 20
+    assert len(state.s_units) == 1 and state.s_units[0].n_moves == 10
+
+
+def test_selfDestruct():
+    """Units that can't reach their border self-destruct at the deepest position"""
+    # walled in right after its deployment: it self-destructs without damages
+    engine = Engine()
+    state = engine.game_state
+    state.add_unit('s', 'filter', (14, 2))
+    state.add_unit('s', 'filter', (15, 2))
+    state.add_unit('s', 'ping', (14, 1))
+    state, result = engine.simulate_round()
+    assert result.n_frames == 4 and len(state.s_units) == 2
+    assert result.s_damage == 0
+
+    # a wall of ennemy filters: the scrambler (which can't attack them)
+    # walks to (28, 14) and damages the filter next to it with its initial
+    # stability
+    engine = Engine()
+    state = engine.game_state
+    for x in range(1, 29):
+        state.add_unit('a', 'filter', (x, 15))
+    state.add_unit('s', 'scrambler', (14, 1))
+    state, result = engine.simulate_round()
+    assert not any(u.id < 4 for u in state.s_units)
+    assert result.s_damage == 40 and result.s_scores == 0
+    damaged = [(u.pos, u.stability) for u in state.a_units if u.stability < 60]
+    assert damaged == [((28, 15), 20)]
+
+    # only the ennemy firewalls are damaged, not the information units
+    engine = Engine()
+    state = engine.game_state
+    state.add_unit('a', 'filter', (13, 15))
+    state.add_unit('a', 'ping', (13, 27))
+    state.a_units[-1].pos = (12, 14)
+    events = ([('self_destruct', (13, 14), 15)], [])
+    assert engine.damage_engine(state, events) == (15, 0)
+    assert [u.stability for u in state.a_units] == [45, 15]
+
+
+def test_shield():
+    """Each encryptor shields a unit once, when it enters its range"""
+    engine = Engine()
+    state = engine.game_state
+    state.add_unit('s', 'encryptor', (14, 3)) # covering the deployment
+    state.add_unit('s', 'encryptor', (20, 10))
+    state.add_unit('s', 'ping', (14, 1))
+    ping = state.s_units[-1]
+    stabilities = []
+    for _ in range(30):
+        engine.step()
+        stabilities.append(ping.stability)
+    # shielded on its first move, then when entering the range at (20, 7)
+    assert stabilities[:2] == [15, 25] and stabilities.count(25) == 22
+    assert stabilities[23:] == [35] * 7 and ping.pos == (21, 9)
+
+
+def test_stats():
+    """Collecting the stats must not change the round"""
+    stats = EngineStats()
+    engine = Engine(stats)
+    engine.game_state = random_state(3, n_firewalls=15, n_info=6)
+    state, result = engine.simulate_round()
+    reference = Engine()
+    reference.game_state = random_state(3, n_firewalls=15, n_info=6)
+    reference_state, _ = reference.simulate_round()
+    assert summary(state) == summary(reference_state)
+
+    counters = stats.counters
+    assert counters['frames'] + counters['frames_skipped'] == result.n_frames
+    assert counters['bfs_runs'] >= 4
+    assert counters['nodes_expanded'] > counters['bfs_runs']
+    assert counters['units_removed'] == 6 + 15 - result.s_firewalls - result.a_firewalls
+    assert all(stats.timers[phase] > 0 for phase in EngineStats.PHASES)
+    assert stats.as_dict()['time_move'] == stats.timers['move']
+
+
+def test_playTurn():
+    engine = Engine()
+    state = engine.game_state
+    # 6 bits and 5 cores at the start
+    result = engine.play_turn([('ping', (13, 2))] * 4, [('filter', (13, 16)), ('encryptor', (20, 20))])
+    assert state.turn == 1
+    assert (state.s_bits, state.s_core) == (round(2 * 0.75 + 5, 1), 9)
+    assert (state.a_bits, state.a_core) == (round(6 * 0.75 + 5, 1), 4)
+    assert result.s_scores == 4 and state.a_health == 26
+
+    # too expensive, nothing is deployed or paid
+    with pytest.raises(ValueError):
+        engine.play_turn([('scrambler', (13, 2))] * 7, [])
+    # misplaced, nothing is deployed or paid
+    with pytest.raises(ValueError):
+        engine.play_turn([('ping', (13, 2)), ('ping', (13, 5))], [])
+    # the ennemy deployment is misplaced, the friendly one is undone
+    with pytest.raises(ValueError):
+        engine.play_turn([('ping', (13, 2))] * 3, [('ping', (13, 2))])
+    assert (state.s_bits, state.s_core, state.turn) == (6.5, 9, 1)
+    assert not state.s_units
+
+    # play until the ennemy has no more health
+    while not state.game_over:
+        engine.play_turn([('ping', (13, 2))] * int(state.s_bits), [])
+    assert state.a_health <= 0
+    assert state.turn == 6
+    with pytest.raises(ValueError):
+        engine.play_turn([], [])
+
+
+def test_fork():
+    """Forks of an engine play independently, as new engines would"""
+    engine = Engine()
+    engine.game_state = random_state(4, n_firewalls=20, n_info=0, defensive=('filter', 'destructor'))
+    engine.step() # compute the distance maps, shared with the forks
+    maps = {i: m.copy() for i, m in engine.map_graph.distance_maps.items()}
+    results = []
+    for x in range(1, 10):
+        fork = engine.fork()
+        fork.play_turn([('ping', (15 - x, x))] * 4, [('emp', (x, 14 + x))])
+        results.append((summary(fork.game_state), fork.game_state.s_bits))
+    for x, expected in zip(range(1, 10), results):
+        reference = Engine()
+        reference.game_state = engine.game_state.fork()
+        reference.play_turn([('ping', (15 - x, x))] * 4, [('emp', (x, 14 + x))])
+        assert (summary(reference.game_state), reference.game_state.s_bits) == expected
+    assert engine.game_state.turn == 0 and not any(u.id < 4 for u in engine.game_state.s_units)
+    assert all((engine.map_graph.distance_maps[i] == maps[i]).all() for i in maps)
+
+
+def test_boardHash():
+    state = random_state(5)
+    h = state.board_hash()
+    state.add_unit('s', 'ping', (13, 2))
+    state.add_unit('a', 'filter', (13, 16))
+    state.add_units('s', ['ping', 'emp'], [(14, 1), (15, 1)])
+    incremental = state.board_hash()
+    state.invalidate_hash()
+    assert state.board_hash() == incremental != h
+    # the units attack in their order, so it changes the hash
+    state.s_units.reverse()
+    state.invalidate_hash()
+    assert state.board_hash() != incremental
+    state.s_units.reverse()
+    state.invalidate_hash()
+    assert state.board_hash() == incremental
+    # the units after a dead one change of order
+    state.s_units[1].stability = 0
+    state.invalidate_hash()
+    dead = state.board_hash()
+    assert dead != incremental
+    state.remove_dead_units()
+    removed = state.board_hash()
+    state.invalidate_hash()
+    assert state.board_hash() == removed
+
+
+def test_boardHashStable():
+    """The hash doesn't depend on the randomized hash() of the process"""
+    script = 'from tests.test_batch import random_state; print(random_state(5).board_hash())'
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    hashes = set()
+    for seed in ['1', '2']:
+        env = dict(os.environ, PYTHONHASHSEED=seed)
+        out = subprocess.check_output([sys.executable, '-c', script], cwd=root, env=env)
+        hashes.add(int(out))
+    assert hashes == {random_state(5).board_hash()}
+
+
+def test_outcomeCache():
+    """Boards with the same units in the same order reuse the outcome of the first round"""
+    cache = OutcomeCache(maxsize=3)
+    base = random_state(6, n_info=0, defensive=('filter', 'destructor'))
+    deployments = [[('s', 'ping', (15 - x, x)), ('s', 'emp', (14 + x, x)), ('a', 'ping', (x, 14 + x))]
+            for x in range(1, 6)]
+    # the last 3 boards are found, but not the last one with its units in
+    # another order
+    boards = deployments + deployments[:1:-1] + [list(reversed(deployments[2]))]
+    for deployment in boards:
+        engine = Engine(cache=cache)
+        reference = Engine()
+        for e in [engine, reference]:
+            e.game_state = base.fork()
+            for team, unit_name, pos in deployment:
+                e.game_state.add_unit(team, unit_name, pos)
+        state, result = engine.simulate_round()
+        reference_state, reference_result = reference.simulate_round()
+        assert repr(result) == repr(reference_result)
+        assert summary(state) == summary(reference_state)
+    assert len(cache) == 3
+    assert (cache.hits, cache.misses) == (3, 6)
+    assert cache.hit_rate == 1 / 3
+
+
+def test_stackDamage():
+    """The member of a stack with the lowest stability, then the last one created, is attacked"""
+    engine = Engine()
+    state = engine.game_state
+    state.add_unit('a', 'destructor', (13, 16))
+    for _ in range(4):
+        state.add_unit('s', 'ping', (13, 2))
+    state.add_unit('s', 'scrambler', (13, 2))
+    stack = list(state.s_units)
+    for unit in stack:
+        unit.pos = (13, 13) # in range of the destructor, which deals 4 per frame
+    stack[1].stability = 5
+    stack[2].stability = 5
+    state.a_units[0].stability = 1000
+    damages = engine.damage_engine(state)
+    # the last ping with the lowest stability takes the hit
+    assert [u.stability for u in stack] == [15, 5, 1, 15, 40]
+    assert damages == (4, 4) # the scrambler can't attack the destructor
+    engine.damage_engine(state)
+    engine.damage_engine(state)
+    assert [u.stability for u in stack] == [15, 1, -3, 15, 40]
+
+
+def test_shieldOnce():
+    """A unit walking diagonally along the edge of the range of an encryptor
+    goes in and out of it, but is only shielded once"""
+    engine = Engine()
+    state = engine.game_state
+    state.add_unit('s', 'encryptor', (6, 13))
+    state.add_unit('s', 'ping', (18, 4))
+    ping = state.s_units[-1]
+    in_range = []
+    for _ in range(50):
+        engine.step()
+        in_range.append(abs(ping.pos[0] - 6) + abs(ping.pos[1] - 13) < 3.5)
+    # it entered the range several times
+    assert sum(a < b for a, b in zip(in_range, in_range[1:])) > 2
+    assert ping.stability == 25 and ping.shielded_by == 1 << (6 * 30 + 13)
+    copy = decode_state(encode_state(state))
+    assert [u.shielded_by for u in copy.s_units] == [u.shielded_by for u in state.s_units]
+
+    # a destroyed encryptor is forgotten
+    h = state.board_hash()
+    state.s_units[0].stability = 0
+    state.remove_dead_units()
+    assert ping.shielded_by == 0 and state.board_hash() != h
+    h = state.board_hash()
+    state.invalidate_hash()
+    assert state.board_hash() == h
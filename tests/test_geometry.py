@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+from tc1.geometry import GEOMETRY
+from tc1.mapgraph import MapGraph
+from tc1.state import GameState
+
+
+def test_geometry():
+    """The diamond, its borders and the neighbours of the nodes"""
+    x, y = np.indices((30, 30))
+    l1 = np.abs(x - 14.5) + np.abs(y - 14.5)
+    assert np.array_equal(GEOMETRY.in_map, l1 <= 14)
+    assert np.array_equal(GEOMETRY.grid_template, np.where(l1 <= 14, 0, -1))
+    # the border nodes are the nodes of the map on its edges
+    assert np.array_equal(GEOMETRY.borders.any(0), l1 == 14)
+    for i, border_id in enumerate([2, 3, 4, 5]):
+        cells = GEOMETRY.border_cells[border_id]
+        assert len(cells) == 14 and all(GEOMETRY.borders[i][c] for c in cells)
+        assert GEOMETRY.border_nodes[border_id] == tuple(x * 30 + y for x, y in cells)
+    assert all(y < 15 for _, y in GEOMETRY.friendly_borders)
+    assert all(y > 14 for _, y in GEOMETRY.ennemy_borders)
+    assert GEOMETRY.neighbours[14 * 30 + 14] == (13 * 30 + 14, 15 * 30 + 14, 14 * 30 + 13, 14 * 30 + 15)
+    assert GEOMETRY.neighbours[0] == () and len(GEOMETRY.neighbours[1 * 30 + 14]) == 2
+    assert GEOMETRY.edge_distance[3, 20] == 3 and GEOMETRY.edge_distance[26, 20] == 4
+
+
+def test_geometryShared():
+    """The tables are computed once and can't be modified"""
+    with pytest.raises(ValueError):
+        GEOMETRY.outside[0, 0] = False
+    with pytest.raises(TypeError):
+        GEOMETRY.border_cells[2] = ()
+    assert MapGraph()._grid_template is MapGraph()._grid_template
+    assert GameState().FRIENDLY_BORDERS is GEOMETRY.friendly_borders
+    assert tuple(MapGraph().get_frontier_nodes(4)) == GEOMETRY.border_cells[4]
+    with pytest.raises(ValueError):
+        MapGraph().get_frontier_nodes(1)
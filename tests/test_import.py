@@ -1,5 +1,13 @@
 import pytest
+import subprocess
+import sys
 from tc1.engine import Engine
 
 def test_importEngine():
     eng = Engine()
+
+def test_noMatplotlibImport():
+    """The engine must not import matplotlib unless we display something"""
+    code = 'import sys, tc1.engine, tc1.batch; tc1.engine.Engine(); print("matplotlib" in sys.modules)'
+    out = subprocess.check_output([sys.executable, '-c', code])
+    assert out.strip() == b'False'
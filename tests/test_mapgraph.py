@@ -0,0 +1,156 @@
+import random
+import numpy as np
+from tc1.state import GameState
+from tc1.mapgraph import DEEPEST_DIRECTIONS, MapGraph
+from tc1 import bfs
+from tc1.batch import BatchEngine
+from tc1.engine import Engine
+from tc1.unit import MOVES, Unit
+from .test_batch import random_state, summary
+
+
+def test_repairedDistanceMaps():
+    """Distance maps repaired after destroying firewalls must be the same
+    as the maps computed from scratch"""
+    rng = random.Random(0)
+    state = GameState()
+    free = [(x, y) for x in range(1, 29) for y in range(1, 29)
+            if abs(x - 14.5) + abs(y - 14.5) <= 14]
+    for x, y in rng.sample(free, 150):
+        state.add_unit('s' if y < 15 else 'a', 'filter', (x, y))
+    mg = MapGraph()
+    mg.update_state(state)
+    mg.update_distance_maps()
+    while state.s_units or state.a_units:
+        # destroy a few firewalls at once, sometimes next to each other
+        for u in rng.sample(state.s_units + state.a_units, min(3, len(state.s_units + state.a_units))):
+            u.stability = 0
+        state.remove_dead_units()
+        mg.update_state(state)
+        mg.update_distance_maps()
+        for border_id in [2,3,4,5]:
+            assert np.array_equal(mg.distance_maps[border_id], mg.get_dijkstra(border_id))
+
+
+def test_batchKernelMatchesKernel():
+    """The wavefront BFS used for batches gives the same maps"""
+    rng = np.random.default_rng(0)
+    blocked = np.broadcast_to(bfs.OUTSIDE, (8, 30, 30)).copy()
+    blocked |= rng.random(blocked.shape) < 0.3
+    maps = bfs.batch_border_distance_maps(blocked)
+    for grid, batch_maps in zip(blocked, maps):
+        assert np.array_equal(bfs.border_distance_maps(grid), batch_maps)
+
+
+def test_batchRepairMatchesKernel():
+    """Repairing the batched maps gives the maps of the new grids"""
+    rng = np.random.default_rng(1)
+    blocked = np.broadcast_to(bfs.OUTSIDE, (8, 30, 30)).copy()
+    blocked |= rng.random(blocked.shape) < 0.4
+    maps = bfs.batch_border_distance_maps(blocked)
+    grids, freed = np.nonzero((rng.random((8, 900)) < 0.1) & ~bfs.OUTSIDE.ravel())
+    blocked.reshape(8, -1)[grids, freed] = False
+    bfs.batch_repair_distance_maps(maps, blocked, grids, freed)
+    assert np.array_equal(maps, bfs.batch_border_distance_maps(blocked))
+
+
+def test_batchSelfDestructMaps():
+    """The batched maps give the distances to the deepest positions of MapGraph"""
+    rng = np.random.default_rng(2)
+    blocked = np.broadcast_to(bfs.OUTSIDE, (8, 30, 30)).copy()
+    blocked |= rng.random(blocked.shape) < 0.35
+    targets = rng.integers(2, 6, size=8)
+    dist = bfs.batch_border_distance_maps(blocked)[np.arange(8), targets - 2]
+    directions = np.array([DEEPEST_DIRECTIONS[t] for t in targets])
+    maps = bfs.batch_self_destruct_maps(blocked, dist, directions)
+    n_stuck = 0
+    for grid, target, d, stuck_map in zip(blocked, targets, dist, maps):
+        mg = MapGraph()
+        mg._grid = mg._grid_template.copy()
+        mg._grid[grid & ~bfs.OUTSIDE] = 1
+        for x, y in zip(*np.nonzero(~grid)):
+            if d[x, y] != bfs.INTMAX:
+                assert stuck_map[x, y] == bfs.INTMAX
+                continue
+            unit = Unit(1, (int(x), int(y)), int(target))
+            deepest, d_map = mg._self_destruct_target(unit)
+            assert stuck_map[x, y] == d_map[x, y] and stuck_map[deepest] == 0
+            n_stuck += 1
+    assert n_stuck > 0
+
+
+def test_nextMoveCache():
+    """The memorized moves are forgotten when a firewall is destroyed"""
+    state = GameState()
+    for x in range(5, 24):
+        state.add_unit('s', 'filter', (x, 13))
+    mg = MapGraph()
+    mg.update_state(state)
+    mg.update_distance_maps()
+    state.add_unit('s', 'ping', (14, 1))
+    state.add_unit('s', 'ping', (14, 1))
+    first, second = state.s_units[-2:]
+    assert mg.get_direction(first) == mg.get_direction(second)
+    assert first.previous_move == second.previous_move
+    assert len(mg._next_moves) == 1
+    state.s_units[0].stability = 0
+    state.remove_dead_units()
+    mg.update_state(state)
+    mg.update_distance_maps()
+    assert not mg._next_moves
+
+
+def test_horizontalTie():
+    """The closest tiles can both be in the direction the unit doesn't
+    prefer, then it moves towards its target edge"""
+    state = GameState()
+    for pos in [(9, 7), (12, 7), (12, 9), (13, 9), (14, 8)]:
+        state.add_unit('s', 'filter', pos)
+    state.add_unit('s', 'ping', (13, 2)) # targets the border 2
+    unit = state.s_units[-1]
+    mg = MapGraph()
+    mg.update_state(state)
+    mg.update_distance_maps()
+    # left and right are equally close, up and down are blocked
+    assert mg.distance_maps[2][11, 8] == mg.distance_maps[2][13, 8]
+    for previous_move in [None, (1, 0), (-1, 0), (0, 1)]:
+        mg._next_moves.clear()
+        unit.pos, unit.previous_move = (12, 8), previous_move
+        assert mg.get_direction(unit) == (13, 8)
+
+    # the batch engine delegates this case to the MapGraph
+    unit.pos, unit.previous_move = (12, 8), (1, 0)
+    batch = BatchEngine([state])
+    engine = Engine()
+    engine.game_state = state
+    while unit.pos == (12, 8):
+        batch.step()
+        engine.step()
+        assert summary(batch.to_states()[0]) == summary(state)
+    assert unit.pos == (13, 8)
+
+
+def test_computeMoveAlwaysMoves():
+    """Every unit that can move gets a move to one of its closest neighbours,
+    whatever its position, target and previous move"""
+    for seed in range(3):
+        state = random_state(seed, n_firewalls=150, n_info=0)
+        mg = MapGraph()
+        mg.update_state(state)
+        mg.update_distance_maps()
+        for x, y in zip(*np.nonzero(mg._grid == 0)):
+            for target in [2, 3, 4, 5]:
+                for previous_move in MOVES:
+                    unit = Unit(1, (int(x), int(y)), target)
+                    d_map = mg.distance_maps[target]
+                    if not d_map[x, y]:
+                        continue # it scores
+                    if d_map[x, y] == bfs.INTMAX:
+                        if mg.find_deepest_position(unit) == unit.pos:
+                            continue # it self-destructs
+                        d_map = mg._self_destruct_target(unit)[1]
+                    unit.previous_move = previous_move
+                    nx, ny = mg.get_direction(unit)
+                    assert abs(nx - x) + abs(ny - y) == 1 and mg._grid[nx, ny] == 0
+                    assert d_map[nx, ny] == min(d_map[x + dx, y + dy] for dx, dy in MOVES[1:]
+                            if mg._grid[x + dx, y + dy] == 0)
@@ -0,0 +1,55 @@
+import numpy as np
+from tc1.batch import BatchEngine
+from tc1.observation import CHANNELS, OBSERVATION_SHAPE, ObservationBuilder
+from tc1.state import GameState
+from .test_batch import random_state
+
+
+def test_toTensor():
+    state = GameState()
+    state.add_unit('s', 'ping', (13, 2))
+    state.add_unit('s', 'ping', (13, 2))
+    state.add_unit('s', 'filter', (13, 3))
+    state.add_unit('a', 'destructor', (13, 16))
+    state.s_units[0].n_turns_static = 1
+    out = np.full(OBSERVATION_SHAPE, 7, dtype=np.float32)
+    assert state.to_tensor(out) is out
+    assert out[CHANNELS.index('ping_s'), 13, 2] == 2
+    assert out[CHANNELS.index('filter_s'), 13, 3] == 1
+    assert out[CHANNELS.index('destructor_a'), 13, 16] == 1
+    assert out[CHANNELS.index('stability_s'), 13, 2] == 30 # two pings
+    assert out[CHANNELS.index('n_turns_static_s'), 13, 2] == 1
+    assert out[CHANNELS.index('stability_a')].sum() == 75
+    # the filter is in the way
+    assert out[CHANNELS.index('dist_2'), 13, 3] == 901
+    assert out[CHANNELS.index('dist_4'), 13, 2] == 0
+    assert out[CHANNELS.index('dist_4'), 0, 0] == -1
+
+
+def test_batchObserve():
+    """The batch engine gives the observations of its games"""
+    states = [random_state(seed) for seed in range(6)]
+    batch = BatchEngine(states)
+    builder = ObservationBuilder()
+    out = builder.new_buffer(len(states))
+    for _ in range(8):
+        batch.step()
+        expected = builder.build_batch(batch.to_states())
+        assert batch.observe(out) is out
+        assert np.array_equal(out, expected)
+
+
+def test_observeView():
+    """The observations can be written into views which are not contiguous"""
+    states = [random_state(seed) for seed in range(3)]
+    batch = BatchEngine(states)
+    builder = ObservationBuilder()
+    expected = builder.build_batch(states)
+    big = np.zeros((3, OBSERVATION_SHAPE[0], 40, 30), dtype=np.float32)
+    out = big[:, :, :30]
+    assert not out.flags.c_contiguous
+    assert builder.build_batch(states, out) is out
+    assert np.array_equal(out, expected)
+    out[...] = 7
+    assert batch.observe(out) is out
+    assert np.array_equal(out, expected)
@@ -0,0 +1,62 @@
+import pytest
+from tc1.engine import Engine
+from tc1.codec import StateView, decode_state, encode_state, iter_views
+from tc1.state import GameState
+from tc1.rollout import RolloutPool
+from .test_batch import random_state, summary
+
+
+def test_codecRoundTrip():
+    state = random_state(0)
+    for _ in range(10):
+        engine = Engine()
+        engine.game_state = state
+        engine.step()
+    assert summary(decode_state(encode_state(state))) == summary(state)
+    buf = state.to_bytes()
+    assert summary(GameState.from_bytes(memoryview(buf))) == summary(state)
+    with pytest.raises(ValueError):
+        GameState.from_bytes(b'X' + buf[1:])
+
+
+def test_stateView():
+    """The views read the units directly in the buffer"""
+    states = [random_state(seed) for seed in range(3)]
+    buf = b''.join(s.to_bytes() for s in states)
+    views = list(iter_views(buf))
+    assert len(views) == 3
+    for view, state in zip(views, states):
+        assert isinstance(view, StateView)
+        assert view.s_health == state.s_health
+        assert view.s_units['id'].tolist() == [u.id for u in state.s_units]
+        assert view.a_units['stability'].tolist() == [u.stability for u in state.a_units]
+        assert view.units.base is not None # no copy
+        assert summary(view.to_state()) == summary(state)
+
+
+def test_rolloutPool():
+    """Parallel evaluation gives the same results as the engine"""
+    base = random_state(1, n_info=0, defensive=('filter', 'destructor'))
+    deployments = [[('s', 'ping', (15 - x, x))] * 3 + [('a', 'emp', (x, 14 + x))]
+            for x in range(1, 13)]
+    expected = []
+    for deployment in deployments:
+        engine = Engine()
+        engine.game_state = decode_state(encode_state(base))
+        for team, unit_name, pos in deployment:
+            engine.game_state.add_unit(team, unit_name, pos)
+        expected.append(repr(engine.simulate_round()[1]))
+    with RolloutPool(n_workers=2) as pool:
+        results = pool.evaluate(base, deployments)
+    assert [repr(r) for r in results] == expected
+    assert [repr(r) for r in RolloutPool(n_workers=0).evaluate(base, deployments)] == expected
+
+
+def test_rolloutInvalid():
+    """An invalid candidate doesn't prevent the evaluation of the others"""
+    base = random_state(1, n_info=0, defensive=('filter', 'destructor'))
+    deployments = [[('s', 'ping', (13, 5))], [('s', 'ping', (14, 1))]]
+    results = RolloutPool(n_workers=0).evaluate(base, deployments)
+    assert results[0] is None and results[1].n_frames > 0
+    with RolloutPool(n_workers=2) as pool:
+        assert [repr(r) for r in pool.evaluate(base, deployments)] == [repr(r) for r in results]
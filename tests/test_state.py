@@ -1,4 +1,5 @@
 import pytest
+import numpy as np
 from tc1.state import GameState
 
 def test_defensiveAssertions():
@@ -35,3 +36,126 @@ def test_defensiveAssertions():
         s.add_unit('a', 'ping', (22,20))
 
 
+def test_unitDictView():
+    """The units can still be read as the dictionnaries used before"""
+    s = GameState()
+    s.add_unit('s', 'ping', (10,5))
+    s.add_unit('s', 'filter', (1,14))
+    ping, firewall = s.s_units
+    assert ping['pos'] == (10,5) and ping['name'] == 'ping'
+    assert ping['stability'] == 15 and ping['target'] == 2
+    assert dict(ping)['speed'] == 2
+    assert 'target' not in firewall and firewall.get('target') is None
+    # the view is read-only, the engine uses the attributes
+    with pytest.raises(TypeError):
+        ping['stability'] = 0
+    ping.stability = 3
+    assert ping['stability'] == 3
+
+def test_snapshot():
+    """Snapshots must not change when the game continues"""
+    s = GameState()
+    s.add_unit('s', 'ping', (10,5))
+    snap = s.serialize_state()
+    s.s_units[0].pos = (10,6)
+    s.s_units[0].stability = 2
+    s.s_health = 12
+    assert snap['s_units'][0]['pos'] == (10,5)
+    assert snap['s_units'][0]['stability'] == 15
+    assert snap['s_health'] == 30 and snap['a_units'] == []
+    restored = snap.to_state()
+    assert dict(restored.s_units[0]) == dict(snap['s_units'][0])
+    assert restored.s_health == 30
+
+
+def test_forkAndRestore():
+    s = GameState()
+    s.add_unit('s', 'ping', (10,5))
+    s.add_unit('a', 'filter', (1,15))
+    fork = s.fork()
+    fork.s_units[0].stability = 1
+    fork.add_unit('s', 'emp', (10,5))
+    fork.a_health = 3
+    assert s.s_units[0].stability == 15 and len(s.s_units) == 1
+    assert s.a_health == 30 and fork.FRIENDLY_BORDERS is s.FRIENDLY_BORDERS
+
+    checkpoint = s.checkpoint()
+    s.s_units[0].pos = (10,6)
+    s.add_unit('a', 'ping', (23,20))
+    s.turn = 4
+    s.restore(checkpoint)
+    assert s.s_units[0].pos == (10,5) and len(s.a_units) == 1 and s.turn == 0
+    # the checkpoint can be restored again
+    s.s_units[0].stability = 0
+    s.restore(checkpoint)
+    assert s.s_units[0].stability == 15
+
+
+def test_legalPlacements():
+    s = GameState()
+    assert s.legal_placements('s', 'ping').sum() == 28
+    assert s.legal_placements('a', 'filter').sum() == 210
+    assert s.legal_placements('s', 'ping')[10, 5] and not s.legal_placements('a', 'ping')[10, 5]
+    s.add_unit('s', 'filter', (10, 5))
+    s.add_unit('s', 'destructor', (12, 9))
+    # no unit can be deployed on a defensive unit
+    assert not s.legal_placements('s', 'ping')[10, 5]
+    assert s.legal_placements('s', 'filter').sum() == 208
+    with pytest.raises(ValueError):
+        s.add_unit('s', 'ping', (10, 5))
+    with pytest.raises(ValueError):
+        s.add_unit('s', 'encryptor', (12, 9))
+    # outside of the diamond
+    with pytest.raises(ValueError):
+        s.add_unit('s', 'filter', (0, 13))
+    # the information units can share a node
+    s.add_unit('s', 'ping', (13, 2))
+    s.add_unit('s', 'ping', (13, 2))
+    assert s.legal_placements('s', 'filter')[13, 2]
+
+    fork = s.fork()
+    fork.s_units[0].stability = 0
+    fork.remove_dead_units()
+    assert fork.legal_placements('s', 'ping')[10, 5]
+    assert not s.legal_placements('s', 'ping')[10, 5]
+    checkpoint = fork.checkpoint()
+    fork.restore(s.checkpoint())
+    assert not fork.legal_placements('s', 'ping')[10, 5]
+    fork.restore(checkpoint)
+    fork.add_unit('s', 'ping', (10, 5))
+
+
+def test_addUnits():
+    """add_units gives the same state as add_unit called for each unit"""
+    names = ['filter', 'destructor', 'ping', 'ping', 'emp']
+    positions = [(10, 5), (12, 9), (13, 2), (13, 2), (20, 6)]
+    s = GameState()
+    s.board_hash()
+    s.add_units('s', names, positions)
+    reference = GameState()
+    for name, pos in zip(names, positions):
+        reference.add_unit('s', name, pos)
+    assert [u.record() for u in s.s_units] == [u.record() for u in reference.s_units]
+    assert s.board_hash() == reference.board_hash()
+    assert (s.legal_placements('s', 'ping') == reference.legal_placements('s', 'ping')).all()
+
+    # ids and arrays are accepted too
+    s.add_units('a', np.array([4, 4, 1]), np.array([[1, 15], [28, 15], [23, 20]]))
+    assert [u.name for u in s.a_units] == ['filter', 'filter', 'ping']
+    assert s.a_units[2].target == 4 and s.a_units[0].target is None
+
+    # nothing is added if a unit is misplaced, or follows a firewall on its node
+    n_units = len(s.s_units)
+    for names, positions in [(['ping', 'ping'], [(13, 2), (13, 3)]),
+            (['filter', 'filter'], [(11, 5), (11, 5)]),
+            (['filter', 'ping'], [(14, 1), (14, 1)]),
+            (['encryptor'], [(10, 5)]), (['filter'], [(0, 13)])]:
+        # the sequences and the arrays are checked in two different ways
+        for args in [(names, positions), (np.array(names), np.array(positions))]:
+            with pytest.raises(ValueError):
+                s.add_units('s', *args)
+            assert len(s.s_units) == n_units
+    with pytest.raises(ValueError):
+        s.add_units('s', ['ping'], [(13, 2), (13, 2)])
+    # an information unit can be deployed before a firewall on the same node
+    s.add_units('s', ['ping', 'filter'], [(14, 1), (14, 1)])
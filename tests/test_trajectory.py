@@ -0,0 +1,92 @@
+import os
+import pytest
+from tc1.engine import Engine
+from tc1.trajectory import (HEADER_FILE, STORE_HEADER, STORE_MAGIC, STORE_VERSION,
+        TrajectoryReader, TrajectoryWriter)
+from .test_batch import random_state, summary
+
+
+def test_recordRounds(tmp_path):
+    """The recorded frames are the states of the engine, frame by frame"""
+    expected = []
+    with TrajectoryWriter(str(tmp_path)) as writer:
+        for seed in range(3):
+            engine = Engine()
+            engine.game_state = random_state(seed, n_firewalls=15, n_info=6)
+            states = [summary(engine.game_state)]
+            engine.simulate_round(recorder=writer)
+            # replay the round step by step, keeping the states of the
+            # recorded (not skipped) frames
+            writer.flush()
+            reader = TrajectoryReader(str(tmp_path))
+            frames = reader.frames[list(reader.round_frames(seed))]['frame'].tolist()
+            replay = Engine()
+            replay.game_state = random_state(seed, n_firewalls=15, n_info=6)
+            for frame in range(1, frames[-1] + 1):
+                replay.step()
+                if frame in frames:
+                    states.append(summary(replay.game_state))
+            expected.append(states)
+
+    # the rounds are still there when reopening the store
+    with TrajectoryWriter(str(tmp_path)) as writer:
+        assert writer.n_rounds == 3
+    reader = TrajectoryReader(str(tmp_path))
+    assert reader.n_rounds == 3
+    for round_id, states in enumerate(expected):
+        indexes = reader.round_frames(round_id)
+        assert [summary(reader.get_state(i)) for i in indexes] == states
+        assert (reader.frames['round'][list(indexes)] == round_id).all()
+
+
+def test_appendWithoutRound(tmp_path):
+    with TrajectoryWriter(str(tmp_path)) as writer:
+        with pytest.raises(ValueError):
+            writer.append(random_state(0))
+    assert TrajectoryReader(str(tmp_path)).n_frames == 0
+
+
+def test_skippedFrames(tmp_path):
+    """Every frame of a round can be read, including the skipped ones (the
+    rounds stopped after 6 frames end with skipped frames)"""
+    n_skipped = 0
+    for seed in range(3):
+        for max_frames in [6, 150]:
+            path = str(tmp_path / '{}_{}'.format(seed, max_frames))
+            engine = Engine()
+            engine.game_state = random_state(seed, n_firewalls=15, n_info=6)
+            with TrajectoryWriter(path) as writer:
+                _, result = engine.simulate_round(max_frames, recorder=writer)
+            reader = TrajectoryReader(path)
+            frames = reader.frames['frame'].tolist()
+            assert frames[-1] == result.n_frames
+            n_skipped += result.n_frames + 1 - len(frames)
+            replay = Engine()
+            replay.game_state = random_state(seed, n_firewalls=15, n_info=6)
+            assert summary(reader.get_frame(0, 0)) == summary(replay.game_state)
+            for frame in range(1, result.n_frames + 1):
+                replay.step()
+                assert summary(reader.get_frame(0, frame)) == summary(replay.game_state)
+            with pytest.raises(ValueError):
+                reader.get_frame(0, result.n_frames + 1)
+    assert n_skipped > 0
+
+
+def test_storeVersion(tmp_path):
+    """Stores written with other records are refused"""
+    with pytest.raises(ValueError):
+        TrajectoryReader(str(tmp_path)) # no store
+    with TrajectoryWriter(str(tmp_path)) as writer:
+        writer.begin_round()
+        writer.append(random_state(0))
+    # a store of an older version, without header
+    os.remove(str(tmp_path / HEADER_FILE))
+    for cls in [TrajectoryReader, TrajectoryWriter]:
+        with pytest.raises(ValueError):
+            cls(str(tmp_path))
+    # or with the units of another encoding
+    with open(str(tmp_path / HEADER_FILE), 'wb') as f:
+        f.write(STORE_HEADER.pack(STORE_MAGIC, STORE_VERSION, b'TC1\x02'))
+    for cls in [TrajectoryReader, TrajectoryWriter]:
+        with pytest.raises(ValueError):
+            cls(str(tmp_path))
@@ -2,7 +2,6 @@ import pytest
 from tc1.state import GameState
 from tc1.engine import Engine
 from collections import defaultdict
-from copy import deepcopy
 
 import pdb
 
@@ -121,7 +120,7 @@ class Tester:
         """Save a animation of the round up to the last rest, for
         debut purpose"""
         eng = Engine()
-        eng.game_state = deepcopy(self._state)
+        eng.game_state = self._state.fork()
         #pdb.set_trace()
         eng.simulate_and_show(self._maxframe, path)
 
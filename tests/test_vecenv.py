@@ -0,0 +1,68 @@
+import numpy as np
+from tc1.observation import CHANNELS
+from tc1.state import GameState
+from tc1.vecenv import VecEnv
+
+
+def small_game():
+    """A game with a few health points, to finish it quickly"""
+    state = GameState()
+    state.s_health = state.a_health = 3
+    state.add_unit('a', 'filter', (14, 16))
+    return state
+
+
+def make_actions(turn, n_envs):
+    actions = []
+    for i in range(n_envs):
+        x = 1 + (turn + i) % 13
+        actions.append([('s', 'ping', (15 - x, x))] * (i % 3)
+                + [('a', 'emp', (x, 14 + x)), ('s', 'filter', (14, 20))])
+    return actions
+
+
+def run(env, n_turns):
+    history = [env.reset().copy()]
+    for turn in range(n_turns):
+        obs, rewards, dones, infos = env.step(make_actions(turn, env.n_envs))
+        history.append((obs.copy(), rewards, dones, [(i['round'], i['invalid'],
+            i.get('final_health'), repr(i['result'])) for i in infos]))
+    return history
+
+
+def test_syncVecEnv():
+    env = VecEnv(4, small_game, max_rounds=5)
+    obs = env.reset()
+    assert obs.shape == (4, len(CHANNELS), 30, 30)
+    assert (obs[:, CHANNELS.index('filter_a'), 14, 16] == 1).all()
+    rounds = np.zeros(4, dtype=int)
+    n_done = 0
+    for turn in range(6):
+        obs, rewards, dones, infos = env.step(make_actions(turn, 4))
+        rounds += 1
+        assert [i['invalid'] for i in infos] == [1] * 4 # the filter is misplaced
+        for k in range(4):
+            assert infos[k]['round'] == rounds[k]
+            if dones[k]:
+                n_done += 1
+                assert min(infos[k]['final_health']) <= 0 or rounds[k] == 5
+                rounds[k] = 0
+                # the game was reset
+                assert obs[k, CHANNELS.index('ping_s')].sum() == 0
+        assert rewards[0] < 0 # no ping deployed, the emp scores
+    assert n_done >= 4
+    assert dones.dtype == bool
+
+
+def test_subprocessVecEnv():
+    """The workers give the same results as the games run in process"""
+    expected = run(VecEnv(5, small_game, max_rounds=4), 6)
+    with VecEnv(5, small_game, n_workers=2, max_rounds=4) as env:
+        history = run(env, 6)
+    assert np.array_equal(history[0], expected[0])
+    for (obs, rewards, dones, infos), (e_obs, e_rewards, e_dones, e_infos) in zip(
+            history[1:], expected[1:]):
+        assert np.array_equal(obs, e_obs)
+        assert np.array_equal(rewards, e_rewards)
+        assert np.array_equal(dones, e_dones)
+        assert infos == e_infos